@@ -0,0 +1,137 @@
+"""
+Control de admisión para los análisis con imagen: límite de análisis simultáneos, cola acotada
+con tiempo máximo de espera y clases de prioridad (capturas del operador antes que monitoreo o lotes)
+"""
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_MONITORING = "monitoring"
+PRIORITY_BATCH = "batch"
+
+# Menor número = se atiende antes
+PRIORITY_ORDER = {PRIORITY_INTERACTIVE: 0, PRIORITY_MONITORING: 1, PRIORITY_BATCH: 2}
+
+
+class AdmissionRejected(Exception):
+    """Solicitud rechazada por sobrecarga; status_code 429 (cola llena) o 503 (espera agotada)"""
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("rank", "seq", "event", "admitted")
+
+    def __init__(self, rank, seq):
+        self.rank = rank
+        self.seq = seq
+        self.event = threading.Event()
+        self.admitted = False
+
+    def __lt__(self, other):
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+
+class AdmissionController:
+    """
+    Deja correr a lo más max_concurrent análisis. Los demás esperan en una cola de a lo más
+    max_queue solicitudes, ordenada por prioridad y luego por llegada. Las clases de baja
+    prioridad solo pueden ocupar low_priority_queue_share de la cola, así siempre queda lugar
+    para una captura del operador.
+    """
+
+    def __init__(self, max_concurrent=1, max_queue=4, queue_timeout_sec=30.0, low_priority_queue_share=0.5):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout_sec = queue_timeout_sec
+        self.low_priority_queue_limit = int(self.max_queue * low_priority_queue_share)
+        self._running = 0
+        self._queue = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._service_sec = None
+        self.admitted = {name: 0 for name in PRIORITY_ORDER}
+        self.rejected = {name: 0 for name in PRIORITY_ORDER}
+        self.timed_out = {name: 0 for name in PRIORITY_ORDER}
+
+    def retry_after(self):
+        """Segundos sugeridos para reintentar: cola actual por duración media de un análisis"""
+        service = self._service_sec or 5.0
+        waiting = len(self._queue) + 1
+        return max(1, int(math.ceil(service * waiting / self.max_concurrent)))
+
+    def _dispatch(self):
+        """Admite a los primeros de la cola mientras haya cupo (con el lock tomado)"""
+        while self._queue and self._running < self.max_concurrent:
+            waiter = heapq.heappop(self._queue)
+            waiter.admitted = True
+            self._running += 1
+            waiter.event.set()
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE):
+        priority = priority if priority in PRIORITY_ORDER else PRIORITY_INTERACTIVE
+        rank = PRIORITY_ORDER[priority]
+        with self._lock:
+            if self._running < self.max_concurrent and not self._queue:
+                self._running += 1
+                self.admitted[priority] += 1
+                return
+            queue_limit = self.max_queue if rank == 0 else self.low_priority_queue_limit
+            if len(self._queue) >= queue_limit:
+                self.rejected[priority] += 1
+                raise AdmissionRejected("Servidor ocupado: demasiados análisis en espera", 429, self.retry_after())
+            waiter = _Waiter(rank, next(self._seq))
+            heapq.heappush(self._queue, waiter)
+
+        waiter.event.wait(self.queue_timeout_sec)
+        with self._lock:
+            if not waiter.admitted:
+                self._queue.remove(waiter)
+                heapq.heapify(self._queue)
+                self.timed_out[priority] += 1
+                raise AdmissionRejected("Servidor ocupado: tiempo de espera agotado", 503, self.retry_after())
+            self.admitted[priority] += 1
+
+    def release(self, elapsed_sec=None):
+        with self._lock:
+            self._running -= 1
+            if elapsed_sec is not None:
+                # Media móvil de la duración de un análisis para estimar Retry-After
+                self._service_sec = elapsed_sec if self._service_sec is None else \
+                    0.8 * self._service_sec + 0.2 * elapsed_sec
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_INTERACTIVE):
+        """Bloque con un cupo de análisis; lanza AdmissionRejected si no se obtiene a tiempo"""
+        self.acquire(priority)
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.release(time.time() - start)
+
+    def status(self):
+        with self._lock:
+            queued = {name: 0 for name in PRIORITY_ORDER}
+            names = {rank: name for name, rank in PRIORITY_ORDER.items()}
+            for waiter in self._queue:
+                queued[names[waiter.rank]] += 1
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "queue_timeout_sec": self.queue_timeout_sec,
+                "running": self._running,
+                "queued": queued,
+                "avg_service_sec": round(self._service_sec, 2) if self._service_sec is not None else None,
+                "admitted": dict(self.admitted),
+                "rejected": dict(self.rejected),
+                "timed_out": dict(self.timed_out)
+            }
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, render_template, redirect, send_from_directory
+from flask import Flask, request, jsonify, render_template, redirect, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 from ultralytics import YOLO
 import cv2
@@ -12,33 +12,129 @@ from dotenv import load_dotenv
 import subprocess
 import tempfile
 
+# Cargar variables de entorno antes de importar los módulos que leen su configuración al importarse
+load_dotenv()
+
 # Importar funciones de base de datos
 from database import (
     create_tables, test_db_connection, save_analysis_result, 
-    get_analysis_history, sync_pending_data, save_to_local_cache,
-    get_local_history, DB_AVAILABLE, create_admin_user, authenticate_user,
+    save_to_local_cache,
+    get_local_history, is_db_available, db_circuit, create_admin_user, authenticate_user,
     create_user, get_all_users, delete_user, update_user_role, get_defects_for_profile,
-    get_analysis_by_id, get_analysis_results, is_sqlite
+    get_analysis_by_id, get_analysis_results, is_sqlite, get_rollup_summary,
+    iter_query_rows, run_query, get_query_stats, clear_synced_cache, local_maintenance, get_table_versions,
+    local_replica, local_engine, auth_cache, get_cached_analysis_key, is_cached_analysis_pending,
+    mark_cache_synced
 )  
 from flask import session, send_file, make_response
+from incremental_analysis import IncrementalZoneAnalyzer
+from inference_worker import InferencePool
+from remote_inference import RemoteInferenceClient, boxes_to_array, encode_detections, DETECTIONS_CONTENT_TYPE
+from quality_control import LatencyController, StageTimer, model_imgsz
+from admission import AdmissionController, AdmissionRejected, PRIORITY_INTERACTIVE, PRIORITY_MONITORING
+from tray_gate import TrayGate, STATUS_OK, REFERENCES_DIR, reference_path
+from zone_registration import ZoneRegistrar
+from image_decode import SpoolingRequest, decode_upload
+from capture_policy import select_capture_settings, capture_stats
+from write_behind import WriteBehindWriter
+from background_services import run_when_leader
+from metadata_cache import JsonResponseCache
+from local_replica import REPLICA_RESULTS_FROM, REPLICA_ZONES_FROM
+from history_service import get_federated_history, decode_history_cursor, federated_delta_cursor, HISTORY_PRIMARY_TIMEOUT_SEC
+from columnar_export import ARROW_AVAILABLE, COLUMNAR_COLUMNS, FORMATS as COLUMNAR_FORMATS, iter_columnar
+from reports_query import (
+    ReportQuery, CountCache, REPORT_COLUMNS, EXPORT_COLUMNS, ESTIMATE_THRESHOLD, AGGREGATE_GROUPS,
+    encode_cursor, decode_cursor, format_row_dates
+)
 import io
 import csv
+import hashlib
+import hmac
+from functools import wraps
 from datetime import datetime, timedelta
 
-# Cargar variables de entorno
-load_dotenv()
+# Escritura diferida: los análisis se confirman en SQLite local y se suben en segundo plano
+persistence_writer = WriteBehindWriter()
+
+# Totales de informes en caché (evita repetir COUNT(*) en cada página)
+report_counts = CountCache()
 
 app = Flask(__name__)
+# Uploads grandes van a archivo temporal; tamaño máximo del cuerpo configurable
+app.request_class = SpoolingRequest
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 32 * 1024 * 1024))
 # Configurar CORS con soporte para credenciales
 CORS(app, supports_credentials=True, origins=["http://localhost:5001", "http://127.0.0.1:5001"])
 
+# Configuración de sesiones (al importar el módulo: aplica igual con app.run y con wsgi.create_app)
+app.secret_key = os.getenv('SECRET_KEY', 'rancoqc_secret_key_change_in_production')
+app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+app.config['SESSION_COOKIE_SECURE'] = os.getenv('SESSION_COOKIE_SECURE', 'False').lower() in ('1', 'true', 'yes')
+app.config['SESSION_COOKIE_HTTPONLY'] = True
+app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hora
+
 # Cargar modelo entrenado
 MODEL_PATH = "best.pt"  # Cambia por tu ruta
-model = YOLO(MODEL_PATH)
+
+# Inferencia en procesos aparte (frames por memoria compartida); INFERENCE_WORKERS=0 la deja en este proceso.
+# gunicorn.conf.py la fija en 0 con varios workers web para que compartan el modelo precargado
+inference_pool = InferencePool(
+    MODEL_PATH,
+    workers=int(os.getenv('INFERENCE_WORKERS', 1)),
+    slots_per_worker=int(os.getenv('INFERENCE_SLOTS', 2)),
+    slot_mb=int(os.getenv('INFERENCE_SLOT_MB', 40)),
+    timeout_sec=float(os.getenv('INFERENCE_TIMEOUT_SEC', 60)),
+    torch_threads=int(os.getenv('TORCH_THREADS', 0)) or None
+)
+local_model = inference_pool if inference_pool.enabled else YOLO(MODEL_PATH)
+
+# Estación con nodo de inferencia central: el modelo local queda como respaldo
+INFERENCE_SERVER_URL = os.getenv('INFERENCE_SERVER_URL', '').strip()
+# Token compartido entre estaciones y nodo central para /api/infer (vacío = sin token)
+INFERENCE_API_TOKEN = os.getenv('INFERENCE_API_TOKEN', '')
+remote_inference = RemoteInferenceClient(
+    INFERENCE_SERVER_URL,
+    local_model,
+    timeout_sec=float(os.getenv('INFERENCE_SERVER_TIMEOUT_SEC', 5)),
+    max_queue_ms=float(os.getenv('INFERENCE_SERVER_MAX_QUEUE_MS', 1500)),
+    cooldown_sec=float(os.getenv('INFERENCE_SERVER_COOLDOWN_SEC', 30)),
+    token=INFERENCE_API_TOKEN or None,
+    station=os.getenv('STATION_NAME')
+) if INFERENCE_SERVER_URL else None
+model = remote_inference or local_model
+
+# Control de admisión: análisis con imagen simultáneos (por proceso web) y cola acotada por prioridad
+admission = AdmissionController(
+    max_concurrent=int(os.getenv('ANALYSIS_MAX_CONCURRENT', max(1, inference_pool.worker_count))),
+    max_queue=int(os.getenv('ANALYSIS_MAX_QUEUE', 4)),
+    queue_timeout_sec=float(os.getenv('ANALYSIS_QUEUE_TIMEOUT_SEC', 30))
+)
+
+# Análisis incremental (monitoreo / capturas repetidas): estado por fuente de imágenes
+incremental_analyzer = IncrementalZoneAnalyzer(model)
+
+# Nivel de calidad adaptativo según el presupuesto de latencia por solicitud y el throttling de la CPU
+latency_controller = LatencyController(
+    budget_ms=float(os.getenv('LATENCY_BUDGET_MS', 3000)),
+    enabled=os.getenv('ADAPTIVE_QUALITY', 'True').lower() == 'true',
+    temp_limit_c=float(os.getenv('THROTTLE_TEMP_C', 80)),
+    # Los niveles bajos reducen el imgsz del propio modelo (en el pool lo informa el proceso de inferencia)
+    base_imgsz=(lambda: inference_pool.model_imgsz) if inference_pool.enabled else model_imgsz(local_model)
+)
+
+# Filtro previo a la inferencia (bandeja vacía, obstrucción, exposición)
+tray_gate = TrayGate()
+
+# Re-registro de zonas por desplazamiento de cámara (características ORB de referencia en caché)
+zone_registrar = ZoneRegistrar()
+
+# Respuestas de perfiles, zonas y defectos serializadas una vez (se invalidan con /upload_zones)
+metadata_cache = JsonResponseCache()
 
 # Crear carpetas necesarias
 os.makedirs('static', exist_ok=True)
 os.makedirs('results', exist_ok=True)
+os.makedirs(REFERENCES_DIR, exist_ok=True)
 
 # Definir perfiles disponibles
 AVAILABLE_PROFILES = {
@@ -59,6 +155,26 @@ AVAILABLE_PROFILES = {
     }
 }
 
+def zone_file_name(profile, distribucion):
+    """Archivo de zonas específico del perfil y distribución"""
+    if profile == "packing_qc":
+        # Packing usa las mismas zonas que contramuestra
+        return f"zones_contramuestra_{distribucion}.json"
+    return f"zones_{profile}_{distribucion}.json"
+
+def zone_files_signature(profile, distribucion):
+    """
+    Fechas de modificación de los archivos que puede leer load_zones (específico, del perfil y zones.json).
+    Con varios workers, un /upload_zones atendido por otro proceso cambia la firma y la respuesta se recalcula.
+    """
+    signature = []
+    for path in (zone_file_name(profile, distribucion), AVAILABLE_PROFILES[profile]["file"], 'zones.json'):
+        try:
+            signature.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
 # Cargar zonas desde JSON basado en perfil y distribución
 def load_zones(profile="qc_recepcion", distribucion="roja"):
     """Carga zonas específicas según el perfil de usuario y tipo de fruta"""
@@ -74,12 +190,9 @@ def load_zones(profile="qc_recepcion", distribucion="roja"):
             distribucion = "roja"
         
         # Construir nombre de archivo específico
+        zone_file = zone_file_name(profile, distribucion)
         if profile == "packing_qc":
-            # Packing usa las mismas zonas que contramuestra
-            zone_file = f"zones_contramuestra_{distribucion}.json"
             print(f"📁 Packing QC usando zonas de contramuestra: {zone_file}")
-        else:
-            zone_file = f"zones_{profile}_{distribucion}.json"
         
         print(f"📁 Cargando zonas para perfil: {AVAILABLE_PROFILES[profile]['name']} - {distribucion}")
         print(f"📄 Archivo: {zone_file}")
@@ -154,11 +267,15 @@ def capture_with_raspberry_camera(
     awbgains=None,
     exposure="normal",
     iso=None,
-    ev=0.0
+    ev=0.0,
+    mode=None
 ):
     """
-    Captura una foto con rpicam-still a máxima calidad.
+    Captura una foto con rpicam-still.
     Solo funciona con Raspberry Pi moderno.
+
+    Returns:
+        tuple: (imagen BGR, dict con latencia y tamaño del JPEG generado)
     """
     try:
         # Verificar que rpicam-still está disponible
@@ -189,6 +306,10 @@ def capture_with_raspberry_camera(
             "-o", tmp_path
         ]
 
+        # Modo del sensor (p. ej. binning 2028x1520 en vez del sensor completo)
+        if mode:
+            cmd += [f"--mode={mode}"]
+
         # Resolución
         if isinstance(resolution, str) and resolution.lower() != "max":
             if "x" in resolution:
@@ -206,6 +327,7 @@ def capture_with_raspberry_camera(
         print(f"🍓 Ejecutando: {' '.join(cmd)}")
         
         # Ejecutar comando
+        start_time = time.time()
         result = subprocess.run(
             cmd,
             capture_output=True,
@@ -224,6 +346,9 @@ def capture_with_raspberry_camera(
         if not os.path.exists(tmp_path):
             raise RuntimeError(f"{cmd_name} no generó el archivo de imagen")
 
+        capture_ms = (time.time() - start_time) * 1000
+        file_size = os.path.getsize(tmp_path)
+
         # Leer imagen con OpenCV
         img = cv2.imread(tmp_path)
         
@@ -237,7 +362,7 @@ def capture_with_raspberry_camera(
             raise RuntimeError(f"No se pudo leer la imagen capturada por {cmd_name}")
 
         print(f"✅ Imagen capturada exitosamente: {img.shape[1]}x{img.shape[0]}")
-        return img
+        return img, {"latency_ms": capture_ms, "file_size": file_size}
 
     except FileNotFoundError:
         print("❌ rpicam-still no encontrado")
@@ -362,72 +487,96 @@ def assign_zone(bbox, zones, img_size=None, zones_reference_size=(1920, 1080)):
         print(f"❌ Error en assign_zone: {e}")
         return "Sin clasificar"
 
-def detect_image_shift(img, reference_features=None):
-    """Detecta el desplazamiento de la imagen comparando características"""
+def count_detections_in_zones(boxes, zones, img_size, zones_reference_size=(1920, 1080), confidence=0.8):
+    """Filtra duplicados y cuenta las detecciones por zona.
+
+    Returns:
+        tuple: (cajas filtradas, conteo por zona, detecciones por zona, total)
+    """
+    zone_counts = {name: 0 for name in zones.keys()}
+    total_detections = 0
+    detections_by_zone = {}
+
+    if boxes is None or len(boxes) == 0:
+        return boxes, zone_counts, detections_by_zone, total_detections
+
+    # Filtrar detecciones duplicadas
+    filtered_boxes = remove_duplicate_detections(boxes, min_distance=50)
+    print(f"🔄 Detecciones después de filtrar duplicados: {len(filtered_boxes)}")
+
+    for i, box in enumerate(filtered_boxes):
+        try:
+            bbox = box.xyxy[0].tolist()
+            conf_score = float(box.conf[0])
+
+            if conf_score < confidence:
+                continue
+
+            # Determinar zona usando escalado apropiado
+            zone_name = assign_zone(bbox, zones, img_size, zones_reference_size)
+            if zone_name == "Sin clasificar":
+                continue  # descartar si no está en zona
+
+            # sumar dentro de zona
+            zone_counts[zone_name] += 1
+            if zone_name not in detections_by_zone:
+                detections_by_zone[zone_name] = []
+            detections_by_zone[zone_name].append({
+                "bbox": bbox,
+                "conf": conf_score
+            })
+            total_detections += 1
+
+        except Exception as e:
+            print(f"❌ Error procesando detección {i}: {e}")
+            continue
+
+    return filtered_boxes, zone_counts, detections_by_zone, total_detections
+
+def detect_boxes(img, scaled_zones, confidence, incremental_key=None, imgsz=None, profile=None, distribucion=None):
+    """Ejecuta el modelo sobre la imagen completa o, en modo incremental, solo sobre las zonas que cambiaron"""
+    if incremental_key:
+        return incremental_analyzer.analyze(incremental_key, img, scaled_zones, confidence, imgsz)
+    predict_options = {"imgsz": imgsz} if imgsz else {}
+    if remote_inference is not None:
+        # El nodo central recibe perfil y distribución junto al frame
+        predict_options.update(profile=profile, distribucion=distribucion)
+    results = model.predict(img, conf=confidence, verbose=False, **predict_options)
+    return results[0].boxes, None
+
+def check_tray(img, zones, profile, distribucion, mode="skip"):
+    """Aplica el filtro de bandeja antes de inferir.
+
+    mode: 'skip' omite la inferencia si el frame no es analizable, 'flag' solo lo informa, 'off' lo desactiva.
+
+    Returns:
+        tuple: (resultado del filtro o None, True si se debe omitir la inferencia)
+    """
+    if mode == "off":
+        return None, False
     try:
-        # Convertir a escala de grises
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Detectar características usando ORB
-        orb = cv2.ORB_create(nfeatures=500)
-        keypoints, descriptors = orb.detectAndCompute(gray, None)
-        
-        if reference_features is None or descriptors is None:
-            return (0, 0), {"keypoints": keypoints, "descriptors": descriptors}
-        
-        # Comparar con características de referencia
-        ref_descriptors = reference_features.get("descriptors")
-        if ref_descriptors is None:
-            return (0, 0), {"keypoints": keypoints, "descriptors": descriptors}
-        
-        # Encontrar coincidencias
-        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-        matches = bf.match(descriptors, ref_descriptors)
-        matches = sorted(matches, key=lambda x: x.distance)
-        
-        if len(matches) < 10:
-            print("⚠️ Pocas coincidencias encontradas para detectar desplazamiento")
-            return (0, 0), {"keypoints": keypoints, "descriptors": descriptors}
-        
-        # Obtener puntos correspondientes
-        src_pts = np.float32([keypoints[m.queryIdx].pt for m in matches[:20]]).reshape(-1, 1, 2)
-        dst_pts = np.float32([reference_features["keypoints"][m.trainIdx].pt for m in matches[:20]]).reshape(-1, 1, 2)
-        
-        # Calcular transformación
-        M, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
-        
-        if M is not None:
-            # Extraer desplazamiento
-            dx = M[0, 2]
-            dy = M[1, 2]
-            print(f"📐 Desplazamiento detectado: dx={dx:.1f}, dy={dy:.1f}")
-            return (dx, dy), {"keypoints": keypoints, "descriptors": descriptors}
-        
+        gate = tray_gate.classify(img, zones, profile, distribucion)
     except Exception as e:
-        print(f"❌ Error detectando desplazamiento: {e}")
-    
-    return (0, 0), {"keypoints": keypoints if 'keypoints' in locals() else None, 
-                    "descriptors": descriptors if 'descriptors' in locals() else None}
+        print(f"⚠️ Error en filtro de bandeja: {e}")
+        return None, False
+    return gate, (mode == "skip" and gate["status"] != STATUS_OK)
+
+def register_zones(img, zones, profile, distribucion, enabled=True):
+    """Ajusta las zonas si la cámara se movió respecto a la referencia del perfil"""
+    if not enabled:
+        return zones, None
+    try:
+        return zone_registrar.register(img, zones, profile, distribucion)
+    except Exception as e:
+        print(f"⚠️ Error en re-registro de zonas: {e}")
+        return zones, None
 
-def adjust_zones_for_shift(zones, shift_x, shift_y):
-    """Ajusta las zonas basado en el desplazamiento detectado"""
-    if abs(shift_x) < 5 and abs(shift_y) < 5:
-        return zones  # No ajustar para desplazamientos pequeños
-    
-    adjusted_zones = {}
-    for zone_name, poly in zones.items():
-        adjusted_poly = []
-        for point in poly:
-            adjusted_x = int(point[0] + shift_x)
-            adjusted_y = int(point[1] + shift_y)
-            adjusted_poly.append([adjusted_x, adjusted_y])
-        adjusted_zones[zone_name] = adjusted_poly
-    
-    print(f"🔄 Zonas ajustadas por desplazamiento: dx={shift_x:.1f}, dy={shift_y:.1f}")
-    return adjusted_zones
+def draw_zones_and_detections(img, detections, zones, confidence_threshold=0.8, render="full"):
+    """Dibuja las zonas (polígonos) y detecciones en la imagen sin escalado de polígonos.
 
-def draw_zones_and_detections(img, detections, zones, confidence_threshold=0.8):
-    """Dibuja las zonas (polígonos) y detecciones en la imagen sin escalado de polígonos"""
+    render: 'full' compone cada zona por separado, 'fast' todas las zonas en una sola composición
+    y 'outline' solo bordes y cajas, sin relleno ni etiquetas de detección.
+    """
     # Convertir de OpenCV (BGR) a PIL (RGB)
     img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     pil_img = Image.fromarray(img_rgb)
@@ -465,8 +614,18 @@ def draw_zones_and_detections(img, detections, zones, confidence_threshold=0.8):
         (138, 43, 226, 60), # Violeta azul semi-transparente
     ]
     
+    # Calidad reducida: un solo overlay con todas las zonas en vez de una composición por zona
+    if render == "fast":
+        overlay = Image.new('RGBA', pil_img.size, (255, 255, 255, 0))
+        overlay_draw = ImageDraw.Draw(overlay)
+        for i, poly in enumerate(zones.values()):
+            overlay_draw.polygon([(int(point[0]), int(point[1])) for point in poly],
+                                 fill=zone_colors[i % len(zone_colors)])
+        pil_img = Image.alpha_composite(pil_img.convert('RGBA'), overlay).convert('RGB')
+        draw = ImageDraw.Draw(pil_img)
+    
     # Dibujar zonas de fondo (polígonos)
-    print(f"🎨 Dibujando {len(zones)} zonas...")
+    print(f"🎨 Dibujando {len(zones)} zonas (render={render})...")
     for i, (zone_name, poly) in enumerate(zones.items()):
         try:
             color = zone_colors[i % len(zone_colors)]
@@ -476,16 +635,17 @@ def draw_zones_and_detections(img, detections, zones, confidence_threshold=0.8):
             for point in poly:
                 polygon_points.append((int(point[0]), int(point[1])))
             
-            # Crear overlay para transparencia
-            overlay = Image.new('RGBA', pil_img.size, (255, 255, 255, 0))
-            overlay_draw = ImageDraw.Draw(overlay)
-            
-            # Dibujar polígono relleno
-            overlay_draw.polygon(polygon_points, fill=color)
-            
-            # Combinar con la imagen original
-            pil_img = Image.alpha_composite(pil_img.convert('RGBA'), overlay).convert('RGB')
-            draw = ImageDraw.Draw(pil_img)
+            if render == "full":
+                # Crear overlay para transparencia
+                overlay = Image.new('RGBA', pil_img.size, (255, 255, 255, 0))
+                overlay_draw = ImageDraw.Draw(overlay)
+                
+                # Dibujar polígono relleno
+                overlay_draw.polygon(polygon_points, fill=color)
+                
+                # Combinar con la imagen original
+                pil_img = Image.alpha_composite(pil_img.convert('RGBA'), overlay).convert('RGB')
+                draw = ImageDraw.Draw(pil_img)
             
             # Dibujar borde del polígono
             draw.polygon(polygon_points, outline=color[:3], width=2)
@@ -531,6 +691,8 @@ def draw_zones_and_detections(img, detections, zones, confidence_threshold=0.8):
                 
                 # Dibujar bounding box
                 draw.rectangle([x1, y1, x2, y2], outline=(255, 0, 0), width=3)
+                if render == "outline":
+                    continue
                 
                 # Etiqueta con confianza y zona
                 label = f"Cherry {conf:.2f}\n{zone_name}"
@@ -551,6 +713,47 @@ def draw_zones_and_detections(img, detections, zones, confidence_threshold=0.8):
     # Convertir de vuelta a OpenCV
     return cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
 
+def request_priority():
+    """
+    Clase de prioridad del análisis: cabecera X-Analysis-Priority o campo 'priority'
+    (interactive, monitoring, batch). Sin indicarla, el modo incremental cuenta como monitoreo.
+    """
+    data = request.get_json(silent=True) if request.is_json else None
+    data = data if isinstance(data, dict) else {}
+    priority = (request.headers.get('X-Analysis-Priority') or request.args.get('priority')
+                or request.form.get('priority') or data.get('priority'))
+    if priority:
+        return str(priority).lower()
+    incremental = request.form.get('incremental', 'false').lower() == 'true' or data.get('incremental') is True
+    return PRIORITY_MONITORING if incremental else PRIORITY_INTERACTIVE
+
+def admission_controlled(view):
+    """Ejecuta el análisis solo con un cupo libre; si no lo obtiene responde 429/503 con Retry-After"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            with admission.slot(request_priority()):
+                return view(*args, **kwargs)
+        except AdmissionRejected as e:
+            print(f"🚦 Análisis rechazado ({e.status_code}): {e}")
+            response = jsonify({"success": False, "error": str(e), "overloaded": True, "retry_after": e.retry_after})
+            response.status_code = e.status_code
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+    return wrapper
+
+def finish_quality(quality, timer):
+    """Registra los tiempos de la solicitud en el controlador de latencia y arma el bloque 'quality'"""
+    served = latency_controller.served(quality, timer)
+    latency_controller.observe(timer)
+    return served
+
+@app.errorhandler(413)
+def request_too_large(e):
+    """Respuesta JSON cuando el archivo supera MAX_CONTENT_LENGTH"""
+    max_mb = app.config['MAX_CONTENT_LENGTH'] / (1024 * 1024)
+    return jsonify({"success": False, "error": f"Archivo demasiado grande (máximo {max_mb:.0f} MB)"}), 413
+
 @app.route('/')
 def index():
     """Página principal - redirigir al login"""
@@ -608,8 +811,11 @@ def serve_public(filename):
     return send_from_directory('../frontend/public', filename)
 
 @app.route('/analyze_cherries', methods=['POST'])
+@admission_controlled
 def analyze_cherries():
     try:
+        timer = StageTimer()
+        quality = latency_controller.current()
         if 'image' not in request.files:
             return jsonify({"success": False, "error": "No se envió imagen"})
         
@@ -630,18 +836,28 @@ def analyze_cherries():
         print(f"🎯 Confianza forzada a: {confidence}")
         print(f"📁 Zonas cargadas dinámicamente: {len(zones)}")
         
-        # Convertir a formato OpenCV
-        img_array = np.frombuffer(file.read(), np.uint8)
-        img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+        # Convertir a formato OpenCV, reduciendo al decodificar si supera la resolución de trabajo
+        img, decode_info = decode_upload(file, target_size=(1920, 1080))
+        timer.mark('decode')
         
         if img is None:
             return jsonify({"success": False, "error": "Imagen inválida"})
         
-        results = model.predict(img, conf=confidence, verbose=False)
+        # Filtro rápido: no gastar inferencia ni registros en bandejas vacías o frames inválidos
+        gate, skip_inference = check_tray(img, zones, profile, distribucion, request.form.get('tray_gate', 'skip'))
+        timer.mark('tray_gate')
+        if skip_inference:
+            return jsonify({
+                "success": False,
+                "error": gate["message"],
+                "tray_status": gate,
+                "inference_skipped": True
+            })
         
-        zone_counts = {name: 0 for name in zones.keys()}
-        total_detections = 0
-        detections_by_zone = {}
+        # Corregir zonas si la cámara se desplazó
+        zones, zone_shift = register_zones(img, zones, profile, distribucion,
+                                           request.form.get('register_zones', 'true').lower() == 'true')
+        timer.mark('register')
         
         # Obtener dimensiones de la imagen
         img_height, img_width = img.shape[:2]
@@ -652,53 +868,32 @@ def analyze_cherries():
         
         # Escalar zonas para el dibujo
         scaled_zones_for_drawing = scale_zones_to_image(zones, zones_reference_size, img_size)
- 
-        if len(results[0].boxes) > 0:
-            # Filtrar detecciones duplicadas
-            filtered_boxes = remove_duplicate_detections(results[0].boxes, min_distance=50)
-            print(f"🔄 Detecciones después de filtrar duplicados: {len(filtered_boxes)}")
-            
-            for i, box in enumerate(filtered_boxes):
-                try:
-                    bbox = box.xyxy[0].tolist()
-                    conf_score = float(box.conf[0])
-                    
-                    if conf_score < confidence:
-                        continue
-                    
-                    # Determinar zona usando escalado apropiado
-                    zone_name = assign_zone(bbox, zones, img_size, zones_reference_size)
-                    if zone_name == "Sin clasificar":
-                        continue  # descartar si no está en zona
-                    
-                    # sumar dentro de zona
-                    zone_counts[zone_name] += 1
-                    if zone_name not in detections_by_zone:
-                        detections_by_zone[zone_name] = []
-                    detections_by_zone[zone_name].append({
-                        "bbox": bbox,
-                        "conf": conf_score
-                    })
-                    total_detections += 1
-                
-                except Exception as e:
-                    print(f"❌ Error procesando detección {i}: {e}")
-                    continue
-            
-            # Usar las detecciones filtradas para el dibujo
-            results[0].boxes = filtered_boxes
+        
+        # Modo incremental opcional: solo re-inferir zonas que cambiaron respecto a la captura anterior
+        incremental_key = None
+        if request.form.get('incremental', 'false').lower() == 'true':
+            incremental_key = f"upload:{request.form.get('stream_key', 'default')}:{profile}:{distribucion}"
+        
+        boxes, incremental_info = detect_boxes(img, scaled_zones_for_drawing, confidence, incremental_key,
+                                               imgsz=quality['imgsz'], profile=profile, distribucion=distribucion)
+        filtered_boxes, zone_counts, detections_by_zone, total_detections = count_detections_in_zones(
+            boxes, zones, img_size, zones_reference_size, confidence
+        )
+        timer.mark('inference')
         
         processed_img = draw_zones_and_detections(
             img.copy(),
-            results[0].boxes,
+            filtered_boxes,
             scaled_zones_for_drawing,
-            confidence_threshold=confidence
+            confidence_threshold=confidence,
+            render=quality['render']
         )
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         processed_filename = f"analysis_{timestamp}_conf80.jpg"
         processed_path = os.path.join("static", processed_filename)
-        cv2.imwrite(processed_path, processed_img)
+        cv2.imwrite(processed_path, processed_img, [cv2.IMWRITE_JPEG_QUALITY, quality['jpeg_quality']])
+        timer.mark('render')
         
         # filtrar solo zonas con > 0
         filtered_results = {k: v for k, v in zone_counts.items() if v > 0}
@@ -736,15 +931,17 @@ def analyze_cherries():
             "zones_available": list(zones.keys())
         }
         
-        # Guardar en base de datos (PostgreSQL o local)
+        # Guardar en cola local durable; el escritor lo sube a PostgreSQL en segundo plano
         try:
-            analysis_id, saved_to_main_db = save_analysis_result(analysis_data, form_data, results_data)
-            db_status = "saved_to_postgresql" if saved_to_main_db else "saved_to_local_cache"
-            print(f"✅ Análisis guardado: {db_status}, ID: {analysis_id}")
+            cache_id, idempotency_key = persistence_writer.enqueue(analysis_data, form_data, results_data)
+            db_status = "queued_for_postgresql" if cache_id is not None else "save_failed"
+            print(f"✅ Análisis encolado: {db_status}, ID local: {cache_id}")
         except Exception as e:
             print(f"⚠️ Error guardando análisis: {e}")
-            analysis_id = None
+            cache_id = None
+            idempotency_key = None
             db_status = "save_failed"
+        timer.mark('persist')
 
         return jsonify({
             "success": True,
@@ -757,9 +954,15 @@ def analyze_cherries():
             "detections_by_zone": detections_by_zone,
             "image_size": f"{img_width}x{img_height}",
             "zones_available": list(zones.keys()),
-            "analysis_id": analysis_id,
+            "cache_id": cache_id,
+            "idempotency_key": idempotency_key,
             "database_status": db_status,
-            "db_connected": DB_AVAILABLE
+            "db_connected": is_db_available(),
+            "incremental": incremental_info,
+            "tray_status": gate,
+            "zone_shift": zone_shift,
+            "decode": decode_info,
+            "quality": finish_quality(quality, timer)
         })
         
     except Exception as e:
@@ -832,31 +1035,54 @@ def api_create_user():
         print(f"❌ Error en create_user: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+# Perfiles y defectos solo cambian con un despliegue; las zonas se revalidan en cada carga
+STATIC_METADATA_CACHE_CONTROL = 'public, max-age=3600'
+ZONES_CACHE_CONTROL = 'no-cache'
+
+def cached_json(key, build_payload, cache_control):
+    """Respuesta JSON precalculada con ETag fuerte; 304 si el cliente ya tiene esa versión"""
+    body, etag = metadata_cache.get(key, build_payload)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(body)
+        response.mimetype = 'application/json'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
 @app.route('/get_profiles', methods=['GET'])
 def get_profiles():
     """Endpoint para obtener los perfiles disponibles"""
-    return jsonify({
+    return cached_json(('profiles',), lambda: {
         "success": True,
         "profiles": AVAILABLE_PROFILES
-    })
+    }, STATIC_METADATA_CACHE_CONTROL)
 
 @app.route('/get_zones', methods=['GET'])
 def get_zones():
     """Endpoint para obtener las zonas disponibles según perfil"""
     profile = request.args.get('profile', 'qc_recepcion')
-    current_zones = load_zones(profile)
+    distribucion = request.args.get('distribucion', 'roja')
     
-    profile_info = AVAILABLE_PROFILES.get(profile, {})
+    def build():
+        current_zones = load_zones(profile, distribucion)
+        profile_info = AVAILABLE_PROFILES.get(profile, {})
+        return {
+            "success": True,
+            "profile": profile,
+            "profile_name": profile_info.get("name", "Desconocido"),
+            "profile_description": profile_info.get("description", ""),
+            "zones": list(current_zones.keys()),
+            "zones_count": len(current_zones),
+            "zones_details": current_zones
+        }
     
-    return jsonify({
-        "success": True,
-        "profile": profile,
-        "profile_name": profile_info.get("name", "Desconocido"),
-        "profile_description": profile_info.get("description", ""),
-        "zones": list(current_zones.keys()),
-        "zones_count": len(current_zones),
-        "zones_details": current_zones
-    })
+    if profile not in AVAILABLE_PROFILES or distribucion not in ('roja', 'bicolor'):
+        # Valores desconocidos no se guardan (load_zones responde con los valores por defecto)
+        return jsonify(build())
+    key = ('zones', profile, distribucion, zone_files_signature(profile, distribucion))
+    return cached_json(key, build, ZONES_CACHE_CONTROL)
 
 @app.route('/upload_zones', methods=['POST'])
 def upload_zones():
@@ -897,6 +1123,7 @@ def upload_zones():
         zone_file = AVAILABLE_PROFILES[profile]["file"]
         with open(zone_file, 'w', encoding='utf-8') as f:
             json.dump(zones_data, f, ensure_ascii=False, indent=2)
+        metadata_cache.invalidate('zones')
         
         # Cargar las nuevas zonas para verificar
         new_zones = load_zones(profile)
@@ -912,6 +1139,40 @@ def upload_zones():
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
+@app.route('/upload_empty_reference', methods=['POST'])
+def upload_empty_reference():
+    """Endpoint para registrar la imagen de bandeja vacía (filtro previo a la inferencia y re-registro de zonas)"""
+    try:
+        if 'image' not in request.files:
+            return jsonify({"success": False, "error": "No se envió imagen"})
+        
+        profile = request.form.get('profile', 'qc_recepcion')
+        distribucion = request.form.get('distribucion', 'roja')
+        if profile not in AVAILABLE_PROFILES:
+            return jsonify({"success": False, "error": f"Perfil '{profile}' no válido"})
+        if distribucion not in ["roja", "bicolor"]:
+            return jsonify({"success": False, "error": f"Distribución '{distribucion}' no válida"})
+        
+        img, _ = decode_upload(request.files['image'], target_size=(1920, 1080))
+        if img is None:
+            return jsonify({"success": False, "error": "Imagen inválida"})
+        
+        # Guardar a la resolución de referencia de las zonas
+        img = resize_image_to_standard(img)
+        path = reference_path(profile, distribucion)
+        cv2.imwrite(path, img)
+        tray_gate.invalidate(profile, distribucion)
+        zone_registrar.invalidate(profile, distribucion)
+        
+        return jsonify({
+            "success": True,
+            "message": f"Referencia de bandeja vacía actualizada para {AVAILABLE_PROFILES[profile]['name']} - {distribucion}",
+            "reference": path
+        })
+        
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+
 @app.route('/save_results', methods=['POST'])
 def save_results():
     """Guardar resultados en archivo JSON"""
@@ -951,9 +1212,12 @@ def update_confidence():
         return jsonify({"success": False, "error": str(e)})
 
 @app.route('/capture_local_camera', methods=['POST'])
+@admission_controlled
 def capture_local_camera():
     """Endpoint para capturar foto desde cámara local y analizarla inmediatamente"""
     try:
+        timer = StageTimer()
+        quality = latency_controller.current()
         data = request.get_json(force=True, silent=True) or {}
         
         # Obtener perfil y distribución del request
@@ -970,21 +1234,29 @@ def capture_local_camera():
         print(f"📷 Capturando desde cámara {camera_type} índice: {camera_index}")
         
         frame = None
+        capture_info = None
         
         # 1) Captura con Raspberry Pi Camera Module
         if camera_type in ('raspberry', 'libcamera'):
             try:
-                print("🍓 Capturando con Raspberry Pi Camera Module...")
-                frame = capture_with_raspberry_camera(
-                    resolution="max",
+                # Modo de sensor según resolución de trabajo; sensor completo solo para teselas o archivo
+                settings = select_capture_settings(profile, data.get('capture_purpose', 'inference'))
+                print(f"🍓 Capturando con Raspberry Pi Camera Module ({settings['sensor_mode']}, {settings['resolution']})...")
+                frame, raw_info = capture_with_raspberry_camera(
+                    resolution=settings['resolution'],
                     timeout_ms=1200,
-                    quality=100,
+                    quality=settings['quality'],
                     denoise="cdn_off",
                     sharpness=1.5,
                     contrast=1.2,
                     saturation=1.05,
                     awb="auto",
-                    exposure="normal"
+                    exposure="normal",
+                    mode=settings['mode']
+                )
+                capture_info = capture_stats.record(
+                    camera_type, settings, raw_info['latency_ms'], raw_info['file_size'],
+                    f"{frame.shape[1]}x{frame.shape[0]}"
                 )
                 print(f"✅ Captura Raspberry Pi exitosa: {frame.shape}")
             except Exception as e:
@@ -1015,8 +1287,14 @@ def capture_local_camera():
             cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)
             
             time.sleep(0.25)
+            start_time = time.time()
             ok, frame = cap.read()
             cap.release()
+            if ok and frame is not None:
+                capture_info = capture_stats.record(
+                    camera_type, {"sensor_mode": "usb", "resolution": "1920x1080"},
+                    (time.time() - start_time) * 1000, None, f"{frame.shape[1]}x{frame.shape[0]}"
+                )
             
             if not ok or frame is None:
                 return jsonify({
@@ -1031,14 +1309,24 @@ def capture_local_camera():
             }), 400
         
         print(f"📐 Imagen capturada: {frame.shape[1]}x{frame.shape[0]}")
+        timer.mark('capture')
+        
+        # Filtro rápido antes de inferir
+        gate, skip_inference = check_tray(frame, zones, profile, distribucion, data.get('tray_gate', 'skip'))
+        timer.mark('tray_gate')
+        if skip_inference:
+            return jsonify({
+                "success": False,
+                "error": gate["message"],
+                "tray_status": gate,
+                "inference_skipped": True,
+                "camera_used": camera_index
+            })
         
         # Procesar imagen igual que en analyze_cherries
         confidence = 0.8
-        results = model.predict(frame, conf=confidence, verbose=False)
-        
-        zone_counts = {name: 0 for name in zones.keys()}
-        total_detections = 0
-        detections_by_zone = {}
+        zones, zone_shift = register_zones(frame, zones, profile, distribucion, data.get('register_zones', True))
+        timer.mark('register')
         
         # Obtener dimensiones de la imagen
         img_height, img_width = frame.shape[:2]
@@ -1047,54 +1335,34 @@ def capture_local_camera():
         
         # Escalar zonas para el dibujo
         scaled_zones_for_drawing = scale_zones_to_image(zones, zones_reference_size, img_size)
- 
-        if len(results[0].boxes) > 0:
-            # Filtrar detecciones duplicadas
-            filtered_boxes = remove_duplicate_detections(results[0].boxes, min_distance=50)
-            print(f"🔄 Detecciones después de filtrar duplicados: {len(filtered_boxes)}")
-            
-            for i, box in enumerate(filtered_boxes):
-                try:
-                    bbox = box.xyxy[0].tolist()
-                    conf_score = float(box.conf[0])
-                    
-                    if conf_score < confidence:
-                        continue
-                    
-                    # Determinar zona usando escalado apropiado
-                    zone_name = assign_zone(bbox, zones, img_size, zones_reference_size)
-                    if zone_name == "Sin clasificar":
-                        continue
-                    
-                    zone_counts[zone_name] += 1
-                    if zone_name not in detections_by_zone:
-                        detections_by_zone[zone_name] = []
-                    detections_by_zone[zone_name].append({
-                        "bbox": bbox,
-                        "conf": conf_score
-                    })
-                    total_detections += 1
-                
-                except Exception as e:
-                    print(f"❌ Error procesando detección {i}: {e}")
-                    continue
-            
-            # Usar las detecciones filtradas para el dibujo
-            results[0].boxes = filtered_boxes
+        
+        # Modo incremental opcional (capturas repetidas de la misma cámara)
+        incremental_key = None
+        if data.get('incremental', False):
+            incremental_key = f"{camera_type}:{camera_index}:{profile}:{distribucion}"
+        
+        boxes, incremental_info = detect_boxes(frame, scaled_zones_for_drawing, confidence, incremental_key,
+                                               imgsz=quality['imgsz'], profile=profile, distribucion=distribucion)
+        filtered_boxes, zone_counts, detections_by_zone, total_detections = count_detections_in_zones(
+            boxes, zones, img_size, zones_reference_size, confidence
+        )
+        timer.mark('inference')
         
         # Dibujar zonas y detecciones
         processed_img = draw_zones_and_detections(
             frame.copy(),
-            results[0].boxes,
+            filtered_boxes,
             scaled_zones_for_drawing,
-            confidence_threshold=confidence
+            confidence_threshold=confidence,
+            render=quality['render']
         )
         
         # Guardar imagen procesada
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         processed_filename = f"analysis_{timestamp}_local_camera_conf80.jpg"
         processed_path = os.path.join("static", processed_filename)
-        cv2.imwrite(processed_path, processed_img)
+        cv2.imwrite(processed_path, processed_img, [cv2.IMWRITE_JPEG_QUALITY, quality['jpeg_quality']])
+        timer.mark('render')
         
         # Filtrar solo zonas con detecciones > 0
         filtered_results = {k: v for k, v in zone_counts.items() if v > 0}
@@ -1113,7 +1381,12 @@ def capture_local_camera():
             "detections_by_zone": detections_by_zone,
             "image_size": f"{img_width}x{img_height}",
             "zones_available": list(zones.keys()),
-            "camera_used": camera_index
+            "camera_used": camera_index,
+            "capture": capture_info,
+            "incremental": incremental_info,
+            "tray_status": gate,
+            "zone_shift": zone_shift,
+            "quality": finish_quality(quality, timer)
         })
         
     except Exception as e:
@@ -1122,6 +1395,67 @@ def capture_local_camera():
         traceback.print_exc()
         return jsonify({"success": False, "error": str(e)})
 
+@app.route('/capture_stats', methods=['GET'])
+def capture_stats_endpoint():
+    """Latencia y tamaño de archivo por modo de captura (para ajustar la política de resolución)"""
+    return jsonify({
+        "success": True,
+        "stats": capture_stats.summary(),
+        "current_policy": select_capture_settings(request.args.get('profile'))
+    })
+
+@app.route('/inference_status', methods=['GET'])
+def inference_status():
+    """Estado de los procesos de inferencia (vivos, slots libres, reinicios)"""
+    return jsonify({"success": True, "inference": inference_pool.status(), "admission": admission.status(),
+                    "quality": latency_controller.status(),
+                    "remote": remote_inference.status() if remote_inference is not None else None})
+
+@app.route('/api/infer', methods=['POST'])
+def api_infer():
+    """
+    Inferencia para estaciones (nodo central). Cuerpo: JPEG; parámetros conf, imgsz, profile,
+    distribucion. Respuesta: float32 little-endian Nx5 (x1, y1, x2, y2, confianza) con los
+    tiempos de cola e inferencia en X-Queue-Ms y X-Inference-Ms.
+    """
+    if INFERENCE_API_TOKEN and not hmac.compare_digest(request.headers.get('X-Inference-Token', ''),
+                                                       INFERENCE_API_TOKEN):
+        return jsonify({"success": False, "error": "Token de inferencia inválido"}), 401
+    
+    arrived = time.time()
+    try:
+        with admission.slot(request_priority()):
+            queue_ms = (time.time() - arrived) * 1000
+            img = cv2.imdecode(np.frombuffer(request.get_data(), np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                return jsonify({"success": False, "error": "Imagen inválida"}), 400
+            
+            confidence = float(request.args.get('conf', 0.8))
+            imgsz = request.args.get('imgsz', type=int)
+            start = time.time()
+            # Siempre el modelo de este nodo (nunca reenviar a otro nodo central)
+            results = local_model.predict(img, conf=confidence, verbose=False,
+                                          **({"imgsz": imgsz} if imgsz else {}))
+            detections = boxes_to_array(results[0].boxes)
+            inference_ms = (time.time() - start) * 1000
+    except AdmissionRejected as e:
+        response = jsonify({"success": False, "error": str(e), "overloaded": True, "retry_after": e.retry_after})
+        response.status_code = e.status_code
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    except Exception as e:
+        print(f"❌ Error en /api/infer: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+    
+    print(f"🛰️ Inferencia remota [{request.args.get('station', '?')}] {request.args.get('profile', '')}/"
+          f"{request.args.get('distribucion', '')}: {len(detections)} detecciones, "
+          f"cola {queue_ms:.0f} ms, inferencia {inference_ms:.0f} ms")
+    response = Response(encode_detections(detections), mimetype=DETECTIONS_CONTENT_TYPE)
+    response.headers['X-Queue-Ms'] = f"{queue_ms:.1f}"
+    response.headers['X-Inference-Ms'] = f"{inference_ms:.1f}"
+    response.headers['X-Detections'] = str(len(detections))
+    return response
+
 @app.route('/test_rtsp', methods=['POST'])
 def test_rtsp():
     """Endpoint para probar conectividad RTSP sin análisis"""
@@ -1230,8 +1564,11 @@ def test_rtsp():
         })
 
 @app.route('/analyze_rtsp', methods=['POST'])
+@admission_controlled
 def analyze_rtsp():
     try:
+        timer = StageTimer()
+        quality = latency_controller.current()
         data = request.get_json(force=True, silent=True) or {}
         rtsp_url = data.get('rtsp_url', '').strip()
         if not rtsp_url:
@@ -1404,6 +1741,8 @@ def analyze_rtsp():
                 ]
             }), 504
 
+        timer.mark('capture')
+
         # Obtener dimensiones originales
         original_height, original_width = img.shape[:2]
         print(f"📐 Imagen RTSP original: {original_width}x{original_height}")
@@ -1429,13 +1768,6 @@ def analyze_rtsp():
         cv2.imwrite(original_path, img)
         print(f"📁 Imagen original RTSP guardada: {original_path}")
 
-        # Ejecutar modelo
-        results = model.predict(img, conf=confidence, verbose=False)
-
-        zone_counts = {name: 0 for name in zones.keys()}
-        total_detections = 0
-        detections_by_zone = {}
-
         img_height, img_width = img.shape[:2]
         img_size = (img_width, img_height)
         zones_reference_size = (1280, 720)
@@ -1454,42 +1786,28 @@ def analyze_rtsp():
             scaled_zones_for_drawing = zones
             print(f"✅ Usando zonas sin escalar")
  
-        if len(results[0].boxes) > 0:
-            filtered_boxes = remove_duplicate_detections(results[0].boxes, min_distance=50)
-            print(f"🔄 Detecciones RTSP: {len(filtered_boxes)}")
-            
-            for i, box in enumerate(filtered_boxes):
-                try:
-                    bbox = box.xyxy[0].tolist()
-                    conf_score = float(box.conf[0])
-                    if conf_score < confidence:
-                        continue
-                    
-                    zone_name = assign_zone(bbox, zones, img_size, zones_reference_size)
-                    if zone_name == "Sin clasificar":
-                        continue
-                    
-                    zone_counts[zone_name] += 1
-                    if zone_name not in detections_by_zone:
-                        detections_by_zone[zone_name] = []
-                    detections_by_zone[zone_name].append({"bbox": bbox, "conf": conf_score})
-                    total_detections += 1
-                except Exception as e:
-                    print(f"❌ Error procesando detección {i}: {e}")
-                    continue
-            
-            results[0].boxes = filtered_boxes
+        # Ejecutar modelo (modo incremental opcional para monitoreo continuo del stream)
+        incremental_key = f"rtsp:{rtsp_url}:{profile}:{distribucion}" if data.get('incremental', False) else None
+        boxes, incremental_info = detect_boxes(img, scale_zones_to_image(zones, zones_reference_size, img_size),
+                                               confidence, incremental_key, imgsz=quality['imgsz'],
+                                               profile=profile, distribucion=distribucion)
+        filtered_boxes, zone_counts, detections_by_zone, total_detections = count_detections_in_zones(
+            boxes, zones, img_size, zones_reference_size, confidence
+        )
+        timer.mark('inference')
 
         processed_img = draw_zones_and_detections(
             img.copy(),
-            results[0].boxes,
+            filtered_boxes,
             scaled_zones_for_drawing,
-            confidence_threshold=confidence
+            confidence_threshold=confidence,
+            render=quality['render']
         )
 
         processed_filename = f"analysis_{timestamp}_rtsp_conf80.jpg"
         processed_path = os.path.join("static", processed_filename)
-        cv2.imwrite(processed_path, processed_img)
+        cv2.imwrite(processed_path, processed_img, [cv2.IMWRITE_JPEG_QUALITY, quality['jpeg_quality']])
+        timer.mark('render')
         print(f"📁 Imagen procesada RTSP guardada: {processed_path}")
 
         filtered_results = {k: v for k, v in zone_counts.items() if v > 0}
@@ -1503,7 +1821,9 @@ def analyze_rtsp():
             "zones_loaded": len(zones),
             "processed_image": f"/static/{processed_filename}",
             "original_image": f"/static/{original_filename}",
-            "detections_by_zone": detections_by_zone
+            "detections_by_zone": detections_by_zone,
+            "incremental": incremental_info,
+            "quality": finish_quality(quality, timer)
         })
 
     except Exception as e:
@@ -1513,22 +1833,83 @@ def analyze_rtsp():
         return jsonify({"success": False, "error": str(e)})
 
 # Endpoints de base de datos
+def versioned_json(build_payload):
+    """
+    Respuesta JSON con ETag derivado de los contadores de cambios y de la URL consultada.
+    Si el cliente envía If-None-Match con el mismo ETag se responde 304 sin consultar los datos.
+    """
+    key = (get_table_versions(HISTORY_PRIMARY_TIMEOUT_SEC), is_db_available(), request.full_path)
+    etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = jsonify(build_payload())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def parse_since_args():
+    """since_id (int) y since_ts (ISO 8601) del modo delta; ValueError si no son válidos"""
+    since_id = request.args.get('since_id')
+    since_ts = request.args.get('since_ts')
+    return (
+        int(since_id) if since_id else None,
+        datetime.fromisoformat(since_ts) if since_ts else None
+    )
+
+def delta_cursor(items, since_id, since_ts):
+    """Cursor para la siguiente consulta delta: mayor id y mayor updated_at vistos"""
+    ids = [item['id'] for item in items if item.get('id') is not None]
+    stamps = [item['updated_at'] for item in items if item.get('updated_at')]
+    if since_id is not None:
+        ids.append(since_id)
+    if since_ts is not None:
+        stamps.append(since_ts.isoformat())
+    return {
+        "since_id": max(ids) if ids else None,
+        "since_ts": max(stamps) if stamps else None
+    }
+
 @app.route('/get_analysis_history', methods=['GET'])
 def get_analysis_history_endpoint():
-    """Obtener historial de análisis"""
+    """Obtener historial de análisis (PostgreSQL y caché local combinados)"""
     try:
         limit = int(request.args.get('limit', 50))
         user_name = request.args.get('user_name')
         analysis_type = request.args.get('analysis_type')
+        try:
+            since_id, since_ts = parse_since_args()
+            since_local_id = request.args.get('since_local_id')
+            since_local_id = int(since_local_id) if since_local_id else None
+        except ValueError:
+            return jsonify({"success": False, "error": "since_id / since_local_id / since_ts inválidos"}), 400
+        
+        cursor = None
+        if request.args.get('cursor'):
+            cursor = decode_history_cursor(request.args['cursor'])
+            if cursor is None:
+                return jsonify({"success": False, "error": "Cursor inválido"}), 400
+        
+        since = None
+        if since_id is not None or since_local_id is not None or since_ts is not None:
+            since = {"since_id": since_id, "since_local_id": since_local_id, "since_ts": since_ts}
+        
+        def build():
+            page = get_federated_history(limit, user_name, analysis_type, cursor, since)
+            history = page["history"]
+            return {
+                "success": True,
+                "history": history,
+                "count": len(history),
+                "delta": since is not None,
+                "cursor": federated_delta_cursor(history, since),
+                "next_cursor": page["next_cursor"],
+                "has_more": page["has_more"],
+                "sources": page["sources"],
+                "db_connected": is_db_available()
+            }
         
-        history = get_analysis_history(limit, user_name, analysis_type)
-        
-        return jsonify({
-            "success": True,
-            "history": history,
-            "count": len(history),
-            "db_connected": DB_AVAILABLE
-        })
+        return versioned_json(build)
         
     except Exception as e:
         print(f"❌ Error obteniendo historial: {e}")
@@ -1538,12 +1919,12 @@ def get_analysis_history_endpoint():
 def sync_pending_data_endpoint():
     """Sincronizar datos pendientes"""
     try:
-        result = sync_pending_data()
+        result = persistence_writer.flush(sync_type='manual')
         
         return jsonify({
             "success": True,
             "sync_result": result,
-            "db_connected": DB_AVAILABLE
+            "db_connected": is_db_available()
         })
         
     except Exception as e:
@@ -1555,14 +1936,23 @@ def get_local_history_endpoint():
     """Obtener historial local"""
     try:
         limit = int(request.args.get('limit', 50))
-        history = get_local_history(limit)
+        try:
+            since_id, since_ts = parse_since_args()
+        except ValueError:
+            return jsonify({"success": False, "error": "since_id / since_ts inválidos"}), 400
         
-        return jsonify({
-            "success": True,
-            "history": history,
-            "count": len(history),
-            "source": "local_cache"
-        })
+        def build():
+            history = get_local_history(limit, since_id, since_ts)
+            return {
+                "success": True,
+                "history": history,
+                "count": len(history),
+                "delta": since_id is not None or since_ts is not None,
+                "cursor": delta_cursor(history, since_id, since_ts),
+                "source": "local_cache"
+            }
+        
+        return versioned_json(build)
         
     except Exception as e:
         print(f"❌ Error obteniendo historial local: {e}")
@@ -1578,7 +1968,9 @@ def database_status():
             "success": True,
             "db_connected": connection_ok,
             "connection_message": message,
-            "db_available": DB_AVAILABLE
+            "db_available": is_db_available(),
+            "circuit": db_circuit.snapshot(),
+            "persistence_queue": persistence_writer.status()
         })
         
     except Exception as e:
@@ -1587,27 +1979,35 @@ def database_status():
             "success": False,
             "error": str(e),
             "db_connected": False,
-            "db_available": DB_AVAILABLE
+            "db_available": is_db_available()
         })
 
+@app.route('/persistence_status', methods=['GET'])
+def persistence_status():
+    """Profundidad y retraso de la cola write-behind hacia PostgreSQL"""
+    try:
+        return jsonify({
+            "success": True,
+            "queue": persistence_writer.status(),
+            "local_store": local_maintenance.status(),
+            "replica": local_replica.status(),
+            "auth_cache": auth_cache.status()
+        })
+    except Exception as e:
+        print(f"❌ Error obteniendo estado de la cola: {e}")
+        return jsonify({"success": False, "error": str(e)})
+
+@app.route('/query_stats', methods=['GET'])
+def query_stats():
+    """Sentencias SQL con mayor tiempo acumulado (llamadas, promedio y máximo en ms)"""
+    limit = min(max(int(request.args.get('limit', 20)), 1), 200)
+    return jsonify({"success": True, "queries": get_query_stats(limit)})
+
 @app.route('/clear_local_cache', methods=['POST'])
 def clear_local_cache():
     """Limpiar caché local"""
     try:
-        from database import get_local_session, LocalCache
-        
-        local_db = get_local_session()
-        synced_records = local_db.query(LocalCache)\
-            .filter(LocalCache.status == 'synced')\
-            .all()
-        
-        count = len(synced_records)
-        
-        for record in synced_records:
-            local_db.delete(record)
-        
-        local_db.commit()
-        local_db.close()
+        count = clear_synced_cache()
         
         return jsonify({
             "success": True,
@@ -1620,7 +2020,7 @@ def clear_local_cache():
 
 @app.route('/force_upload_analysis', methods=['POST'])
 def force_upload_analysis():
-    """Forzar subida a PostgreSQL"""
+    """Forzar subida a PostgreSQL (con el idempotency_key del registro para no duplicarlo)"""
     try:
         data = request.get_json()
         
@@ -1630,13 +2030,30 @@ def force_upload_analysis():
         analysis_data = data.get('analysis_data', {})
         form_data = data.get('form_data', {})
         results_data = data.get('results_data', {})
+        cache_id = data.get('cache_id')
+        idempotency_key = data.get('idempotency_key')
+        if not idempotency_key and cache_id is not None:
+            idempotency_key = get_cached_analysis_key(cache_id)
+        
+        # Sin base principal el registro ya encolado se queda en la cola (no crear otra copia local)
+        if not is_db_available() and idempotency_key and is_cached_analysis_pending(idempotency_key):
+            return jsonify({
+                "success": False,
+                "error": "Base principal no disponible; el análisis sigue en la cola local",
+                "cache_id": cache_id,
+                "idempotency_key": idempotency_key
+            })
         
-        analysis_id, success = save_analysis_result(analysis_data, form_data, results_data)
+        analysis_id, success = save_analysis_result(analysis_data, form_data, results_data, idempotency_key)
         
         if success:
+            if idempotency_key:
+                # El escritor write-behind ya no debe subir este registro
+                mark_cache_synced(idempotency_key, analysis_id)
             return jsonify({
                 "success": True,
                 "analysis_id": analysis_id,
+                "idempotency_key": idempotency_key,
                 "message": "Análisis subido exitosamente"
             })
         else:
@@ -1718,84 +2135,172 @@ def api_get_defects(profile):
         if not profile:
             return jsonify({"error": "Se requiere el parámetro 'profile'"}), 400
             
-        defects = get_defects_for_profile(profile)
-        return jsonify({"defects": defects})
+        if profile not in AVAILABLE_PROFILES:
+            return jsonify({"defects": get_defects_for_profile(profile)})
+        return cached_json(('defects', profile), lambda: {
+            "defects": get_defects_for_profile(profile)
+        }, STATIC_METADATA_CACHE_CONTROL)
         
     except Exception as e:
         print(f"Error al obtener defectos: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+def report_query_from_args():
+    """
+    ReportQuery para los filtros de la solicitud y el motor donde ejecutarla: la réplica local
+    si cubre el rango pedido dentro del límite de antigüedad, si no la base principal.
+
+    Returns:
+        tuple: (ReportQuery, Engine o None para el motor por defecto)
+    """
+    start = ReportQuery.from_args(request.args).start
+    if local_replica.covers(start):
+        query = ReportQuery.from_args(
+            request.args, '?', results_from=REPLICA_RESULTS_FROM, zones_from=REPLICA_ZONES_FROM
+        )
+        return query, local_engine
+    return ReportQuery.from_args(request.args, '?' if is_sqlite() else '%s'), None
+
+def report_total(query, bind=None):
+    """Total de filas para los filtros: en caché por unos segundos y estimado en tablas grandes sin filtros"""
+    sql, params = query.count_sql()
+    
+    def load():
+        if bind is None and not query.has_filters and not is_sqlite():
+            estimate = run_query(
+                "SELECT reltuples::bigint AS estimate FROM pg_class WHERE relname = 'analysis_results'"
+            )
+            if estimate and (estimate[0].estimate or 0) > ESTIMATE_THRESHOLD:
+                return int(estimate[0].estimate), True
+        rows = run_query(sql, params, bind)
+        return (rows[0].total if rows else 0), False
+    
+    return report_counts.get((is_sqlite(), sql, tuple(params)), load)
+
 @app.route('/api/reports/data', methods=['GET'])
 def get_reports_data():
     try:
-        # Filtros
-        analysis_type = request.args.get('analysis_type')
-        distribution = request.args.get('distribution')
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
-        page = max(page, 1)
-        per_page = max(per_page, 1)
-
-        # Placeholder según motor
-        placeholder = '?' if is_sqlite() else '%s'
-
-        base = " FROM analysis_results"
-        where = " WHERE 1=1"
-        params = []
-
-        if analysis_type and analysis_type != 'all':
-            where += f" AND analysis_type = {placeholder}"
-            params.append(analysis_type)
-
-        if distribution and distribution != 'all':
-            where += f" AND distribucion = {placeholder}"
-            params.append(distribution)
-
-        if start_date:
-            try:
-                start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-                where += f" AND timestamp >= {placeholder}"
-                params.append(start_dt.strftime('%Y-%m-%d 00:00:00'))
-            except ValueError:
-                pass
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', 10)), 1), 500)
+        cursor_arg = request.args.get('cursor')
+        cursor = decode_cursor(cursor_arg) if cursor_arg else None
+        if cursor_arg and cursor is None:
+            return jsonify({"error": "Cursor inválido"}), 400
+
+        # Placeholder y tablas según el origen (réplica local o base principal)
+        query, bind = report_query_from_args()
+
+        def build():
+            # Con cursor: keyset sobre (timestamp, id); sin cursor: página por OFFSET (compatibilidad)
+            data_sql, params = query.page_sql(REPORT_COLUMNS, per_page, cursor, (page - 1) * per_page)
+            rows = get_analysis_results(data_sql, params, format_dates=False, bind=bind)
+            has_more = len(rows) > per_page
+            rows = rows[:per_page]
+            next_cursor = encode_cursor(rows[-1]['timestamp'], rows[-1]['id']) if has_more and rows else None
+
+            total, total_is_estimate = report_total(query, bind)
+
+            return {
+                "results": format_row_dates(rows),  # el frontend espera 'results'
+                "total": total,
+                "total_is_estimate": total_is_estimate,
+                "page": page,
+                "per_page": per_page,
+                "total_pages": (total + per_page - 1) // per_page,
+                "next_cursor": next_cursor,
+                "source": "replica" if bind is not None else "primary"
+            }
 
-        if end_date:
-            try:
-                end_dt = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
-                where += f" AND timestamp < {placeholder}"
-                params.append(end_dt.strftime('%Y-%m-%d 00:00:00'))
-            except ValueError:
-                pass
+        # Sondeo frecuente del frontend: 304 mientras no cambien los análisis
+        return versioned_json(build)
+    except Exception as e:
+        print(f"Error al obtener datos del informe: {e}")
+        return jsonify({"error": str(e)}), 500
 
-        # Total
-        count_sql = "SELECT COUNT(*) AS total" + base + where
-        total_row = get_analysis_results(count_sql, params)
-        total = total_row[0]['total'] if total_row else 0
-
-        # Datos con paginación: LIMIT/OFFSET insertados como enteros (no placeholders)
-        offset = (page - 1) * per_page
-        data_sql = (
-            "SELECT id, timestamp, user_name, analysis_type, profile, distribucion, "
-            "guia_sii, lote, num_frutos, num_proceso, id_caja, total_detections, "
-            "zones_analyzed, confidence_used, processed_image_path, results_json "
-            + base + where + " ORDER BY timestamp DESC "
-            f"LIMIT {int(per_page)} OFFSET {int(offset)}"
-        )
+def defect_rate(defects, fruits):
+    """Porcentaje de defectos sobre frutos revisados"""
+    return round(100.0 * (defects or 0) / fruits, 2) if fruits else None
 
-        rows = get_analysis_results(data_sql, params)
+@app.route('/api/reports/aggregate', methods=['GET'])
+def get_reports_aggregate():
+    """Totales y tasas de defectos agrupados por día, lote, guía SII, perfil o distribución (calculados en SQL)"""
+    try:
+        group_by = request.args.get('group_by', 'day')
+        if group_by not in AGGREGATE_GROUPS:
+            return jsonify({"error": f"group_by inválido, opciones: {', '.join(AGGREGATE_GROUPS)}"}), 400
+        limit = min(max(int(request.args.get('limit', 500)), 1), 5000)
+        zone = request.args.get('zone')
+
+        query, bind = report_query_from_args()
+        totals_sql, params = query.aggregate_sql(group_by, limit)
+        zones_sql, zone_params = query.aggregate_zones_sql(group_by, zone)
+
+        groups = {}
+        for row in run_query(totals_sql, params, bind):
+            key = row.grupo
+            groups[key] = {
+                "group": key.isoformat() if hasattr(key, 'isoformat') else key,
+                "analyses": row.analyses,
+                "fruits": row.fruits or 0,
+                "defects": row.defects or 0,
+                "defect_rate": defect_rate(row.defects, row.fruits),
+                "zones": {}
+            }
+        for row in run_query(zones_sql, zone_params, bind):
+            group = groups.get(row.grupo)
+            if group is not None:
+                group["zones"][row.zone_name] = {
+                    "defects": row.defects or 0,
+                    "rate": defect_rate(row.defects, group["fruits"])
+                }
 
         return jsonify({
-            "results": rows,  # el frontend espera 'results'
-            "total": total,
-            "page": page,
-            "per_page": per_page,
-            "total_pages": (total + per_page - 1) // per_page
+            "group_by": group_by,
+            "zone": zone,
+            "groups": list(groups.values()),
+            "source": "replica" if bind is not None else "primary"
         })
     except Exception as e:
-        print(f"Error al obtener datos del informe: {e}")
+        print(f"Error al agregar informe: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/dashboard/summary', methods=['GET'])
+def get_dashboard_summary():
+    """Resumen del dashboard (totales, serie diaria y zonas principales) leído de los rollups diarios"""
+    try:
+        today = datetime.utcnow().date()
+        days = min(max(int(request.args.get('days', 30)), 1), 3660)
+        try:
+            end_day = datetime.strptime(request.args['end_date'], '%Y-%m-%d').date() if request.args.get('end_date') else today
+            start_day = datetime.strptime(request.args['start_date'], '%Y-%m-%d').date() if request.args.get('start_date') \
+                else end_day - timedelta(days=days - 1)
+        except ValueError:
+            return jsonify({"error": "Fechas inválidas, formato esperado YYYY-MM-DD"}), 400
+        profile = request.args.get('profile')
+        distribucion = request.args.get('distribucion')
+
+        summary = get_rollup_summary(
+            start_day, end_day,
+            profile if profile and profile != 'all' else None,
+            distribucion if distribucion and distribucion != 'all' else None,
+            min(max(int(request.args.get('top_zones', 10)), 1), 100)
+        )
+        if summary is None:
+            return jsonify({
+                "error": "Base principal no disponible y sin réplica local para calcular el resumen",
+                "source": "unavailable"
+            }), 503
+        summary['totals']['defect_rate'] = defect_rate(summary['totals']['defects'], summary['totals']['fruits'])
+        for entry in summary['daily'] + summary['top_zones']:
+            entry['defect_rate'] = defect_rate(entry['defects'], entry['fruits'])
+        summary.update({
+            "start_date": start_day.isoformat(),
+            "end_date": end_day.isoformat()
+        })
+        return jsonify(summary)
+    except Exception as e:
+        print(f"Error al obtener resumen del dashboard: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/reports/detail/<int:analysis_id>', methods=['GET'])
@@ -1834,65 +2339,85 @@ def get_analysis_detail(analysis_id):
         print(f"Error al obtener detalles del análisis: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/reports/export/csv', methods=['GET'])
-def export_reports_csv():
-    try:
-        analysis_type = request.args.get('analysis_type')
-        distribution = request.args.get('distribution')
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-
-        placeholder = '?' if is_sqlite() else '%s'
-        base = " FROM analysis_results"
-        where = " WHERE 1=1"
-        params = []
+# Filas leídas del cursor y escritas al cliente por bloque del export CSV
+EXPORT_FETCH_SIZE = 1000
 
-        if analysis_type and analysis_type != 'all':
-            where += f" AND analysis_type = {placeholder}"
-            params.append(analysis_type)
+EXPORT_CSV_HEADER = ['ID','Fecha','Usuario','Tipo de Análisis','Perfil','Distribución','Guía SII','Lote','N° Frutos','Total Defectos','Zonas Analizadas','Confianza']
 
-        if distribution and distribution != 'all':
-            where += f" AND distribucion = {placeholder}"
-            params.append(distribution)
+def export_csv_value(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return '' if value is None else value
 
-        if start_date:
-            try:
-                start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-                where += f" AND timestamp >= {placeholder}"
-                params.append(start_dt.strftime('%Y-%m-%d 00:00:00'))
-            except ValueError:
-                pass
-
-        if end_date:
-            try:
-                end_dt = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
-                where += f" AND timestamp < {placeholder}"
-                params.append(end_dt.strftime('%Y-%m-%d 00:00:00'))
-            except ValueError:
-                pass
-
-        query = "SELECT id, timestamp, user_name, analysis_type, profile, distribucion, guia_sii, lote, num_frutos, total_detections, zones_analyzed, confidence_used" + base + where + " ORDER BY timestamp DESC"
-        results = get_analysis_results(query, params)
+@app.route('/api/reports/export/csv', methods=['GET'])
+def export_reports_csv():
+    """Export CSV en streaming: se escribe por bloques a medida que se leen del cursor"""
+    try:
+        include_zones = request.args.get('zones', 'false').lower() in ('1', 'true', 'yes')
+        query, bind = report_query_from_args()
+        columns = EXPORT_COLUMNS + (['results_json'] if include_zones else [])
+        export_sql, params = query.export_sql(columns)
+
+        zone_names = []
+        if include_zones:
+            zones_sql, zone_params = query.zone_names_sql()
+            zone_names = [row.zone_name for row in run_query(zones_sql, zone_params, bind)]
+    except Exception as e:
+        print(f"Error al exportar informe CSV: {e}")
+        return jsonify({"error": str(e)}), 500
 
+    def generate():
         output = io.StringIO()
         writer = csv.writer(output)
-        writer.writerow(['ID','Fecha','Usuario','Tipo de Análisis','Perfil','Distribución','Guía SII','Lote','N° Frutos','Total Defectos','Zonas Analizadas','Confianza'])
-        for row in results:
-            writer.writerow([
-                row.get('id',''), row.get('timestamp',''), row.get('user_name',''),
-                row.get('analysis_type',''), row.get('profile',''), row.get('distribucion',''),
-                row.get('guia_sii',''), row.get('lote',''), row.get('num_frutos',''),
-                row.get('total_detections',''), row.get('zones_analyzed',''), row.get('confidence_used','')
-            ])
-        output.seek(0)
-        resp = make_response(output.getvalue())
-        resp.headers['Content-Disposition'] = 'attachment; filename=reporte_analisis.csv'
-        resp.headers['Content-type'] = 'text/csv; charset=utf-8'
-        return resp
+        writer.writerow(EXPORT_CSV_HEADER + zone_names)
+        pending = 0
+        try:
+            for row in iter_query_rows(export_sql, params, EXPORT_FETCH_SIZE, bind):
+                values = [export_csv_value(value) for value in row[:len(EXPORT_COLUMNS)]]
+                if include_zones:
+                    try:
+                        results = json.loads(row[-1]) if row[-1] else {}
+                    except (TypeError, ValueError):
+                        results = {}
+                    values += [results.get(zone, '') if isinstance(results, dict) else '' for zone in zone_names]
+                writer.writerow(values)
+                pending += 1
+                if pending >= EXPORT_FETCH_SIZE:
+                    yield output.getvalue()
+                    output.seek(0)
+                    output.truncate(0)
+                    pending = 0
+        except Exception as e:
+            # Los encabezados ya se enviaron: se deja constancia al final del archivo
+            print(f"Error al exportar informe CSV: {e}")
+            writer.writerow([f"ERROR: {e}"])
+        yield output.getvalue()
+
+    resp = Response(stream_with_context(generate()), mimetype='text/csv')
+    resp.headers['Content-Disposition'] = 'attachment; filename=reporte_analisis.csv'
+    resp.headers['Content-type'] = 'text/csv; charset=utf-8'
+    return resp
+
+@app.route('/api/reports/export/parquet', methods=['GET'], defaults={'fmt': 'parquet'})
+@app.route('/api/reports/export/arrow', methods=['GET'], defaults={'fmt': 'arrow'})
+def export_reports_columnar(fmt):
+    """Export Parquet / Arrow IPC en streaming, con una columna por zona"""
+    if not ARROW_AVAILABLE:
+        return jsonify({"error": "Export columnar no disponible: instalar pyarrow"}), 501
+    try:
+        query, bind = report_query_from_args()
+        export_sql, params = query.export_sql(COLUMNAR_COLUMNS)
+        zones_sql, zone_params = query.zone_names_sql()
+        zone_names = [row.zone_name for row in run_query(zones_sql, zone_params, bind)]
     except Exception as e:
-        print(f"Error al exportar informe CSV: {e}")
+        print(f"Error al exportar informe {fmt}: {e}")
         return jsonify({"error": str(e)}), 500
 
+    rows = iter_query_rows(export_sql, params, EXPORT_FETCH_SIZE, bind)
+    resp = Response(stream_with_context(iter_columnar(rows, fmt, zone_names)), mimetype=COLUMNAR_FORMATS[fmt]['mimetype'])
+    resp.headers['Content-Disposition'] = f"attachment; filename=reporte_analisis.{COLUMNAR_FORMATS[fmt]['extension']}"
+    return resp
+
 @app.route('/api/reports/export/pdf', methods=['GET'])
 def export_reports_pdf():
     """Exportar informe a PDF (implementación básica)"""
@@ -1981,14 +2506,15 @@ def manual_analysis():
             "zones_available": list(defects_data.keys())
         }
         
-        # Guardar en base de datos
+        # Guardar en cola local durable (subida a PostgreSQL en segundo plano)
         try:
-            analysis_id, saved_to_main_db = save_analysis_result(analysis_data, form_data, results_data)
-            db_status = "saved_to_postgresql" if saved_to_main_db else "saved_to_local_cache"
-            print(f"✅ Análisis manual guardado: {db_status}, ID: {analysis_id}")
+            cache_id, idempotency_key = persistence_writer.enqueue(analysis_data, form_data, results_data)
+            db_status = "queued_for_postgresql" if cache_id is not None else "save_failed"
+            print(f"✅ Análisis manual encolado: {db_status}, ID local: {cache_id}")
         except Exception as e:
             print(f"⚠️ Error guardando análisis manual: {e}")
-            analysis_id = None
+            cache_id = None
+            idempotency_key = None
             db_status = "save_failed"
         
         return jsonify({
@@ -1997,19 +2523,18 @@ def manual_analysis():
             "total_cherries": total_defects,
             "analysis_type": "manual",
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "analysis_id": analysis_id,
+            "cache_id": cache_id,
+            "idempotency_key": idempotency_key,
             "database_status": db_status,
-            "db_connected": DB_AVAILABLE
+            "db_connected": is_db_available()
         })
         
     except Exception as e:
         print(f"❌ Error en análisis manual: {e}")
         return jsonify({"success": False, "error": str(e)})
 
-if __name__ == '__main__':
-    print("🚀 Iniciando servidor RancoQC...")
-    
-    # Inicializar base de datos
+def init_database():
+    """Crea tablas, verifica la conexión y el usuario administrador (una vez, antes de atender solicitudes)"""
     try:
         create_tables()
         connection_ok, message = test_db_connection()
@@ -2032,8 +2557,52 @@ if __name__ == '__main__':
                 print("✅ Usuario administrador ya existe")
     except Exception as e:
         print(f"⚠️ Error creando admin inicial: {e}")
+
+def preload_runtime():
+    """
+    Deja en memoria las características ORB de referencia de cada perfil.
+    Con gunicorn --preload se ejecuta en el proceso maestro junto con la carga del modelo,
+    así los workers comparten esas páginas por copy-on-write en vez de leerlas cada uno.
+    """
+    for profile in AVAILABLE_PROFILES:
+        for distribucion in ('roja', 'bicolor'):
+            zone_registrar.preload(profile, distribucion)
+
+def start_background_services(leader_lock_path=None):
+    """
+    Inicia los hilos de segundo plano de este proceso. El sondeo de salud de la base principal
+    corre en cada proceso; los servicios únicos (write-behind, mantenimiento, réplica y caché de
+    usuarios) en uno solo: con leader_lock_path, el worker que obtiene el lock de archivo.
+    """
+    db_circuit.start()
+    # Cada proceso web lanza sus propios procesos de inferencia (el modelo se carga allí)
+    if inference_pool.enabled:
+        inference_pool.start()
     
-    print("🌐 Accede a: http://localhost:5001")
+    def start_singletons():
+        persistence_writer.start()
+        local_maintenance.start()
+        local_replica.start()
+        auth_cache.start()
+    
+    if leader_lock_path is None:
+        start_singletons()
+    else:
+        run_when_leader(leader_lock_path, start_singletons)
+
+if __name__ == '__main__':
+    print("🚀 Iniciando servidor RancoQC (desarrollo; en producción usar gunicorn -c gunicorn.conf.py)...")
+    
+    init_database()
+    
+    # Hilos de segundo plano solo en el proceso hijo del reloader
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
+    
+    port = int(os.getenv('PORT', 5001))
+    print(f"🌐 Accede a: http://localhost:{port}")
+    if remote_inference is not None:
+        print(f"🛰️ Inferencia en nodo central: {INFERENCE_SERVER_URL} (respaldo local)")
     print("👤 Credenciales Admin: admin / admin123")
     
     # Verificar modelo
@@ -2043,12 +2612,4 @@ if __name__ == '__main__':
         print(f"❌ Modelo YOLO NO encontrado: {MODEL_PATH}")
         print("   Por favor, coloca tu archivo best.pt en la carpeta del proyecto")
     
-    # Configuración de sesiones
-    app.secret_key = 'rancoqc_secret_key_change_in_production'
-    app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
-    app.config['SESSION_COOKIE_SECURE'] = False  # Para desarrollo local
-    app.config['SESSION_COOKIE_HTTPONLY'] = True
-    app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hora
-    
-    print("🔐 Configuración de sesiones aplicada")
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    app.run(debug=True, host='0.0.0.0', port=port)
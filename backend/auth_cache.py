@@ -0,0 +1,156 @@
+"""
+Caché local de credenciales: hashes y roles de `users` copiados a SQLite para iniciar sesión sin la base principal
+"""
+import hmac
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+AUTH_CACHE_TTL_HOURS = int(os.getenv('AUTH_CACHE_TTL_HOURS', 72))
+AUTH_CACHE_REFRESH_SEC = int(os.getenv('AUTH_CACHE_REFRESH_SEC', 300))
+
+auth_metadata = MetaData()
+
+# Tabla propia del archivo local: no se crea en PostgreSQL
+cached_users = Table(
+    "auth_cache", auth_metadata,
+    Column("user_id", Integer, primary_key=True, autoincrement=False),  # mismo id que en `users`
+    Column("username", String(100), unique=True, nullable=False),
+    Column("password_hash", String(256), nullable=False),
+    Column("role", String(20), nullable=False),
+    Column("cached_at", DateTime, nullable=False),  # última confirmación contra la base principal
+)
+
+# Columnas de `users` que se copian
+_users = Table(
+    "users", MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("username", String(100)),
+    Column("password_hash", String(256)),
+    Column("role", String(20)),
+)
+
+
+class AuthCache:
+    """
+    Copia de usuarios en el SQLite local. Cada entrada vale AUTH_CACHE_TTL_HOURS desde su última
+    confirmación contra la base principal (refresco periódico o inicio de sesión en línea);
+    create_user, delete_user y update_user_role la actualizan al confirmar en la base principal
+    y el refresco periódico trae los cambios hechos desde otras estaciones.
+    """
+
+    def __init__(self, local_engine, primary_engine, primary_available, enabled=True,
+                 ttl_hours=AUTH_CACHE_TTL_HOURS, refresh_sec=AUTH_CACHE_REFRESH_SEC):
+        self.local_engine = local_engine
+        self.primary_engine = primary_engine
+        self.primary_available = primary_available
+        self.enabled = enabled and ttl_hours > 0
+        self.ttl = timedelta(hours=ttl_hours)
+        self.refresh_sec = refresh_sec
+        self.last_refresh_at = None
+        self.last_error = None
+        self._thread = None
+
+    def create_tables(self):
+        auth_metadata.create_all(bind=self.local_engine)
+
+    def lookup(self, username):
+        """Entrada vigente (dentro del TTL) del usuario o None"""
+        if not self.enabled:
+            return None
+        with self.local_engine.connect() as conn:
+            row = conn.execute(select(cached_users).where(cached_users.c.username == username)).first()
+        if row is None or datetime.utcnow() - row.cached_at > self.ttl:
+            return None
+        return row
+
+    def verify(self, entry, password_hash):
+        return hmac.compare_digest(entry.password_hash, password_hash)
+
+    def store(self, users):
+        """
+        Guarda o reemplaza usuarios confirmados en la base principal.
+
+        Args:
+            users (list): dicts con user_id, username, password_hash y role
+        """
+        if not self.enabled or not users:
+            return
+        now = datetime.utcnow()
+        rows = [dict(user, cached_at=now) for user in users]
+        statement = sqlite_insert(cached_users)
+        with self.local_engine.begin() as conn:
+            # Un nombre reutilizado por otro id (usuario borrado y recreado) reemplaza la entrada anterior
+            conn.execute(cached_users.delete().where(
+                cached_users.c.username.in_([row["username"] for row in rows]),
+                cached_users.c.user_id.not_in([row["user_id"] for row in rows])
+            ))
+            conn.execute(statement.on_conflict_do_update(
+                index_elements=["user_id"],
+                set_={column: statement.excluded[column] for column in ("username", "password_hash", "role", "cached_at")}
+            ), rows)
+
+    def remove(self, user_id=None, username=None):
+        if not self.enabled:
+            return
+        with self.local_engine.begin() as conn:
+            if user_id is not None:
+                conn.execute(cached_users.delete().where(cached_users.c.user_id == user_id))
+            if username is not None:
+                conn.execute(cached_users.delete().where(cached_users.c.username == username))
+
+    def set_role(self, user_id, role):
+        if not self.enabled:
+            return
+        with self.local_engine.begin() as conn:
+            conn.execute(cached_users.update().where(cached_users.c.user_id == user_id).values(role=role))
+
+    def refresh(self):
+        """Copia todos los usuarios de la base principal y borra los que ya no existen"""
+        with self.primary_engine.connect() as source:
+            users = [
+                {"user_id": row.id, "username": row.username, "password_hash": row.password_hash, "role": row.role}
+                for row in source.execute(select(_users))
+            ]
+        with self.local_engine.begin() as conn:
+            conn.execute(cached_users.delete().where(cached_users.c.user_id.not_in([u["user_id"] for u in users])))
+        self.store(users)
+        self.last_refresh_at = datetime.utcnow()
+        self.last_error = None
+        return len(users)
+
+    def start(self):
+        """Inicia el refresco periódico en segundo plano (idempotente)"""
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._run, name="auth-cache", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            if self.primary_available():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    self.last_error = str(e)
+                    print(f"⚠️ Error refrescando caché de usuarios: {e}")
+            time.sleep(self.refresh_sec)
+
+    def status(self):
+        try:
+            with self.local_engine.connect() as conn:
+                cached = len(conn.execute(select(cached_users.c.user_id)).all())
+        except Exception:
+            cached = None
+        return {
+            "enabled": self.enabled,
+            "users": cached,
+            "ttl_hours": self.ttl.total_seconds() / 3600,
+            "last_refresh_at": self.last_refresh_at.isoformat() if self.last_refresh_at else None,
+            "last_error": self.last_error,
+            "running": self._thread is not None and self._thread.is_alive()
+        }
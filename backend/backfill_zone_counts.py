@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""
+Script para poblar analysis_zone_counts con los análisis guardados antes de existir la tabla
+"""
+import argparse
+
+from database import engine, local_engine, create_tables, backfill_zone_counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Normalizar results_json en analysis_zone_counts")
+    parser.add_argument('--local', action='store_true', help="Procesar la base SQLite local en vez de la principal")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Análisis por transacción")
+    args = parser.parse_args()
+
+    print("🚀 Backfill de conteos por zona")
+    create_tables()
+    try:
+        processed, inserted = backfill_zone_counts(local_engine if args.local else engine, args.batch_size)
+        print(f"🎉 Backfill completado: {processed} análisis, {inserted} conteos insertados")
+    except Exception as e:
+        print(f"❌ Error en backfill: {e}")
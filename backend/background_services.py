@@ -0,0 +1,62 @@
+"""
+Arranque de hilos de segundo plano cuando hay varios procesos worker: los servicios únicos
+(escritor write-behind, mantenimiento, réplica, caché de usuarios) corren en un solo proceso
+"""
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin flock, cada proceso es su propio líder
+    fcntl = None
+
+
+class LeaderLock:
+    """Lock de archivo (flock) exclusivo: lo tiene un solo proceso a la vez y se libera si muere"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def try_acquire(self):
+        if self._file is not None:
+            return True
+        if fcntl is None:
+            return True
+        handle = open(self.path, "a+")
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        handle.seek(0)
+        handle.truncate()
+        handle.write(str(os.getpid()))
+        handle.flush()
+        self._file = handle
+        return True
+
+    @property
+    def held(self):
+        return self._file is not None
+
+
+def run_when_leader(lock_path, start_services, retry_sec=15.0):
+    """
+    Ejecuta start_services() en el primer proceso que obtenga el lock. Los demás reintentan
+    cada retry_sec segundos, así otro worker toma el relevo si el líder termina o se reinicia.
+
+    Returns:
+        LeaderLock: estado del lock en este proceso
+    """
+    lock = LeaderLock(lock_path)
+
+    def attempt():
+        while not lock.try_acquire():
+            time.sleep(retry_sec)
+        print(f"👑 Proceso {os.getpid()} ejecuta los servicios en segundo plano")
+        start_services()
+
+    threading.Thread(target=attempt, name="background-leader", daemon=True).start()
+    return lock
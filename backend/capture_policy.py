@@ -0,0 +1,117 @@
+"""
+Política de resolución de captura para la cámara de Raspberry Pi según el perfil y la inferencia
+"""
+import os
+import threading
+import time
+from collections import deque
+
+# Modos del sensor IMX477 (HQ Camera): ancho x alto nativos del modo y string para --mode
+SENSOR_MODES = [
+    {"name": "fast", "mode": "1332:990:10:P", "size": (1332, 990)},
+    {"name": "binned", "mode": "2028:1520:12:P", "size": (2028, 1520)},
+    {"name": "full", "mode": "4056:3040:12:P", "size": (4056, 3040)},
+]
+
+# Resolución de trabajo por perfil (la de referencia de las zonas) y configuración de inferencia
+DEFAULT_WORKING_RESOLUTION = (1920, 1080)
+PROFILE_WORKING_RESOLUTION = {}
+
+INFERENCE_CONFIG = {
+    "tiled": os.getenv('INFERENCE_TILED', 'False').lower() == 'true',
+    "imgsz": int(os.getenv('INFERENCE_IMGSZ', 640)),
+}
+
+CAPTURE_QUALITY = int(os.getenv('CAPTURE_QUALITY', 90))
+ARCHIVE_QUALITY = 100
+
+
+def select_capture_settings(profile=None, purpose="inference"):
+    """
+    Elige modo de sensor, tamaño de salida y calidad JPEG para una captura.
+
+    Args:
+        profile (str): Perfil de análisis (define la resolución de trabajo)
+        purpose (str): 'inference' o 'archive'
+
+    Returns:
+        dict: {"sensor_mode", "mode", "resolution", "quality", "purpose"}
+    """
+    full = SENSOR_MODES[-1]
+    if purpose == "archive" or INFERENCE_CONFIG["tiled"]:
+        # Solo la inferencia por teselas o el archivo necesitan el sensor completo
+        return {
+            "sensor_mode": full["name"],
+            "mode": full["mode"],
+            "resolution": "max",
+            "quality": ARCHIVE_QUALITY,
+            "purpose": "archive" if purpose == "archive" else "tiled"
+        }
+
+    work_w, work_h = PROFILE_WORKING_RESOLUTION.get(profile, DEFAULT_WORKING_RESOLUTION)
+    needed = max(work_w, INFERENCE_CONFIG["imgsz"]), max(work_h, INFERENCE_CONFIG["imgsz"] * 9 // 16)
+    chosen = full
+    for sensor_mode in SENSOR_MODES:
+        width, height = sensor_mode["size"]
+        # Las zonas se escalan por eje, basta con cubrir el tamaño de trabajo sin recortar el campo visual
+        if width >= needed[0] and height >= needed[1]:
+            chosen = sensor_mode
+            break
+
+    width, height = chosen["size"]
+    return {
+        "sensor_mode": chosen["name"],
+        "mode": chosen["mode"],
+        "resolution": f"{width}x{height}",
+        "quality": CAPTURE_QUALITY,
+        "purpose": purpose
+    }
+
+
+class CaptureStats:
+    """Registro en memoria de latencia y tamaño de archivo por captura, para ajustar la política"""
+
+    def __init__(self, maxlen=200):
+        self._entries = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, camera_type, settings, latency_ms, file_size=None, image_size=None):
+        entry = {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "camera_type": camera_type,
+            "sensor_mode": settings.get("sensor_mode") if settings else None,
+            "resolution": settings.get("resolution") if settings else None,
+            "quality": settings.get("quality") if settings else None,
+            "latency_ms": round(latency_ms, 1),
+            "file_size_kb": round(file_size / 1024, 1) if file_size is not None else None,
+            "image_size": image_size
+        }
+        with self._lock:
+            self._entries.append(entry)
+        print(f"⏱️ Captura {camera_type} [{entry['sensor_mode']}]: {entry['latency_ms']} ms, "
+              f"{entry['file_size_kb']} KB")
+        return entry
+
+    def summary(self):
+        with self._lock:
+            entries = list(self._entries)
+
+        by_mode = {}
+        for entry in entries:
+            key = f"{entry['camera_type']}:{entry['sensor_mode']}"
+            by_mode.setdefault(key, []).append(entry)
+
+        modes = {}
+        for key, items in by_mode.items():
+            latencies = sorted(e["latency_ms"] for e in items)
+            sizes = [e["file_size_kb"] for e in items if e["file_size_kb"] is not None]
+            modes[key] = {
+                "captures": len(items),
+                "latency_ms_p50": latencies[len(latencies) // 2],
+                "latency_ms_max": latencies[-1],
+                "avg_file_size_kb": round(sum(sizes) / len(sizes), 1) if sizes else None
+            }
+        return {"modes": modes, "recent": entries[-20:]}
+
+
+capture_stats = CaptureStats()
@@ -0,0 +1,174 @@
+"""
+Export columnar (Parquet / Arrow IPC) del historial de análisis con los conteos por zona como columnas
+"""
+import json
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    ARROW_AVAILABLE = True
+except ImportError:
+    pa = None
+    pq = None
+    ARROW_AVAILABLE = False
+
+# Columnas leídas de analysis_results (results_json se aplana en una columna por zona)
+COLUMNAR_COLUMNS = [
+    "id", "timestamp", "user_name", "analysis_type", "profile", "distribucion",
+    "guia_sii", "lote", "num_frutos", "total_detections", "zones_analyzed", "confidence_used",
+    "results_json"
+]
+
+# Columnas de texto con pocos valores distintos: se guardan con codificación de diccionario
+DICTIONARY_COLUMNS = {"user_name", "analysis_type", "profile", "distribucion", "guia_sii", "lote"}
+
+# Filas por row group / record batch
+COLUMNAR_BATCH_ROWS = 50000
+
+FORMATS = {
+    "parquet": {"extension": "parquet", "mimetype": "application/vnd.apache.parquet"},
+    "arrow": {"extension": "arrows", "mimetype": "application/vnd.apache.arrow.stream"},
+}
+
+
+def build_schema(zone_names):
+    """Esquema Arrow: columnas base más una columna int32 por zona"""
+    text_type = pa.dictionary(pa.int32(), pa.string())
+    fields = [
+        pa.field("id", pa.int64()),
+        pa.field("timestamp", pa.timestamp("us")),
+    ]
+    for name in COLUMNAR_COLUMNS[2:8]:
+        fields.append(pa.field(name, text_type))
+    fields += [
+        pa.field("num_frutos", pa.int32()),
+        pa.field("total_detections", pa.int32()),
+        pa.field("zones_analyzed", pa.int32()),
+        pa.field("confidence_used", pa.float64()),
+    ]
+    fields += [pa.field(zone, pa.int32()) for zone in zone_names]
+    return pa.schema(fields)
+
+
+def _to_datetime(value):
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    return value
+
+
+def _zone_count(results, zone):
+    value = results.get(zone)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return int(value)
+
+
+def _record_batch(schema, rows, zone_names):
+    """Convierte un bloque de filas (tuplas en el orden de COLUMNAR_COLUMNS) en un RecordBatch"""
+    columns = list(zip(*rows))
+    arrays = [
+        pa.array(columns[0], pa.int64()),
+        pa.array([_to_datetime(v) for v in columns[1]], pa.timestamp("us")),
+    ]
+    for index in range(2, 8):
+        arrays.append(pa.array(columns[index], pa.string()).dictionary_encode())
+    for index in range(8, 11):
+        arrays.append(pa.array(columns[index], pa.int32()))
+    arrays.append(pa.array(columns[11], pa.float64()))
+
+    results = []
+    for results_json in columns[12]:
+        try:
+            parsed = json.loads(results_json) if results_json else {}
+        except (TypeError, ValueError):
+            parsed = {}
+        results.append(parsed if isinstance(parsed, dict) else {})
+    for zone in zone_names:
+        arrays.append(pa.array([_zone_count(r, zone) for r in results], pa.int32()))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class ChunkSink:
+    """Destino de escritura que acumula bytes para entregarlos por bloques en una respuesta HTTP"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _open_writer(fmt, sink, schema):
+    if fmt == "parquet":
+        return pq.ParquetWriter(sink, schema, compression="zstd", use_dictionary=True)
+    # Formato stream: admite diccionarios distintos en cada batch (el formato file no)
+    return pa.ipc.new_stream(sink, schema)
+
+
+def iter_columnar(rows, fmt, zone_names, batch_rows=COLUMNAR_BATCH_ROWS):
+    """
+    Escribe las filas en Parquet o Arrow IPC por row groups y entrega los bytes a medida que se generan.
+
+    Args:
+        rows: iterable de filas en el orden de COLUMNAR_COLUMNS (p. ej. iter_query_rows)
+        fmt (str): 'parquet' o 'arrow'
+        zone_names (list): zonas que se convierten en columnas
+        batch_rows (int): filas por row group
+
+    Yields:
+        bytes: bloques del archivo
+    """
+    if not ARROW_AVAILABLE:
+        raise RuntimeError("pyarrow no está instalado (pip install pyarrow)")
+    schema = build_schema(zone_names)
+    sink = ChunkSink()
+    writer = _open_writer(fmt, pa.PythonFile(sink, mode="w"), schema)
+    try:
+        batch = []
+        for row in rows:
+            batch.append(tuple(row))
+            if len(batch) >= batch_rows:
+                writer.write_batch(_record_batch(schema, batch, zone_names))
+                batch = []
+                yield sink.drain()
+        if batch:
+            writer.write_batch(_record_batch(schema, batch, zone_names))
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def write_columnar_file(rows, path, fmt, zone_names, batch_rows=COLUMNAR_BATCH_ROWS):
+    """Escribe el export completo a un archivo; devuelve los bytes escritos"""
+    written = 0
+    with open(path, "wb") as output:
+        for chunk in iter_columnar(rows, fmt, zone_names, batch_rows):
+            output.write(chunk)
+            written += len(chunk)
+    return written
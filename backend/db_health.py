@@ -0,0 +1,112 @@
+"""
+Circuit breaker para la base de datos principal, con sondeo de salud en segundo plano
+"""
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+STATE_CLOSED = "closed"        # PostgreSQL sano: las consultas van a la base principal
+STATE_OPEN = "open"            # PostgreSQL caído: todo se atiende desde SQLite local
+STATE_HALF_OPEN = "half_open"  # Probando si PostgreSQL volvió
+
+
+class CircuitBreaker:
+    """
+    Mantiene el estado de salud de la base principal. Mientras el circuito está abierto,
+    las solicitudes van directo al almacenamiento local sin esperar timeouts de conexión;
+    solo el hilo de sondeo intenta reconectar.
+    """
+
+    def __init__(self, engine, failure_threshold=2, cooldown_sec=10.0, probe_interval_sec=15.0):
+        self.engine = engine
+        self.failure_threshold = failure_threshold
+        self.cooldown_sec = cooldown_sec
+        self.probe_interval_sec = probe_interval_sec
+        # Cerrado hasta que fallen consultas o el sondeo: no desviar solicitudes antes del primer sondeo
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self.last_probe_at = None
+        self.last_latency_ms = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def allow_request(self):
+        """True si las consultas deben ir a la base principal"""
+        return self.state == STATE_CLOSED
+
+    def record_success(self):
+        with self._lock:
+            if self.state != STATE_CLOSED:
+                print("✅ Base principal disponible: circuito cerrado")
+            self.state = STATE_CLOSED
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.last_error = None
+
+    def record_failure(self, error):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = str(error).strip().splitlines()[0] if str(error).strip() else repr(error)
+            if self.state == STATE_HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != STATE_OPEN:
+                    print(f"🔌 Base principal no disponible, circuito abierto: {self.last_error}")
+                self.state = STATE_OPEN
+                self.opened_at = time.time()
+
+    def probe(self):
+        """Ejecuta SELECT 1 contra la base principal y actualiza el estado"""
+        with self._lock:
+            if self.state == STATE_OPEN and time.time() - self.opened_at >= self.cooldown_sec:
+                self.state = STATE_HALF_OPEN
+        start = time.time()
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            self.last_latency_ms = round((time.time() - start) * 1000, 1)
+            self.record_success()
+            return True
+        except Exception as e:
+            self.record_failure(e)
+            return False
+        finally:
+            self.last_probe_at = datetime.utcnow()
+
+    def start(self):
+        """Sondeo inicial sincrónico y luego periódico en segundo plano (idempotente)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        if not self.probe():
+            # Sin conexión al arrancar: abrir de inmediato en vez de esperar failure_threshold fallos
+            with self._lock:
+                if self.state != STATE_OPEN:
+                    print(f"🔌 Base principal no disponible al iniciar, circuito abierto: {self.last_error}")
+                self.state = STATE_OPEN
+                self.opened_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="db-health", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            # Con el circuito abierto se sondea al terminar el enfriamiento
+            wait = self.cooldown_sec if self.state != STATE_CLOSED else self.probe_interval_sec
+            if self._stop.wait(wait):
+                break
+            self.probe()
+
+    def stop(self):
+        self._stop.set()
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "last_probe_at": self.last_probe_at.isoformat() if self.last_probe_at else None,
+            "last_latency_ms": self.last_latency_ms,
+            "open_for_sec": round(time.time() - self.opened_at, 1) if self.opened_at else None
+        }
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Script para exportar el historial de análisis a Parquet o Arrow IPC (para pandas / revisiones de temporada)
+"""
+import argparse
+
+from database import engine, local_engine, iter_query_rows
+from reports_query import ReportQuery
+from columnar_export import ARROW_AVAILABLE, COLUMNAR_COLUMNS, COLUMNAR_BATCH_ROWS, write_columnar_file
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exportar analysis_results en formato columnar")
+    parser.add_argument('output', help="Archivo de salida")
+    parser.add_argument('--format', choices=['parquet', 'arrow'], default='parquet')
+    parser.add_argument('--start-date', help="YYYY-MM-DD")
+    parser.add_argument('--end-date', help="YYYY-MM-DD (inclusive)")
+    parser.add_argument('--analysis-type')
+    parser.add_argument('--distribution')
+    parser.add_argument('--batch-rows', type=int, default=COLUMNAR_BATCH_ROWS, help="Filas por row group")
+    parser.add_argument('--local', action='store_true', help="Exportar desde la base SQLite local")
+    args = parser.parse_args()
+
+    if not ARROW_AVAILABLE:
+        print("❌ pyarrow no está instalado (pip install pyarrow)")
+        raise SystemExit(1)
+
+    target = local_engine if args.local else engine
+    query = ReportQuery(
+        analysis_type=args.analysis_type,
+        distribution=args.distribution,
+        start_date=args.start_date,
+        end_date=args.end_date,
+        placeholder='%s' if target.dialect.name == 'postgresql' else '?'
+    )
+    zones_sql, zone_params = query.zone_names_sql()
+    zone_names = [row[0] for row in iter_query_rows(zones_sql, zone_params, bind=target)]
+    export_sql, params = query.export_sql(COLUMNAR_COLUMNS)
+
+    print(f"🚀 Exportando a {args.format}: {args.output} ({len(zone_names)} columnas de zona)")
+    try:
+        written = write_columnar_file(
+            iter_query_rows(export_sql, params, bind=target), args.output,
+            args.format, zone_names, args.batch_rows
+        )
+        print(f"🎉 Export completado: {written / 1024:.1f} KB")
+    except Exception as e:
+        print(f"❌ Error exportando: {e}")
@@ -0,0 +1,53 @@
+"""
+Configuración de gunicorn para producción: gunicorn -c gunicorn.conf.py
+
+El maestro importa la aplicación una vez (preload_app) con el modelo YOLO y las referencias
+de zonas ya cargados; los workers se forkean después y comparten esas páginas por copy-on-write.
+"""
+import os
+
+from dotenv import load_dotenv
+
+# Antes de leer la configuración de abajo (y antes de importar la app en el maestro)
+load_dotenv()
+
+CPU_COUNT = os.cpu_count() or 1
+
+wsgi_app = "wsgi:create_app(prefork=True)"
+bind = os.getenv("BIND", "0.0.0.0:5001")
+preload_app = True
+
+# Por defecto la inferencia corre en un pool de procesos aparte (INFERENCE_WORKERS=1), que aísla
+# las caídas del modelo: ese pool es de un worker web, así que entonces se usa un solo worker con
+# hilos para E/S (base de datos, cámara). Con INFERENCE_WORKERS=0 se reparten los núcleos en workers
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", 1))
+workers = int(os.getenv("WEB_WORKERS", 1 if INFERENCE_WORKERS > 0 else max(1, min(CPU_COUNT // 2, 4))))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", 4))
+
+# Si se piden varios workers (WEB_WORKERS>1), un pool de inferencia por worker cargaría el modelo
+# (y sus slots de memoria compartida) una vez por worker: el modelo queda en el maestro precargado
+# y se comparte por copy-on-write. Se fija antes de importar la app
+if workers > 1:
+    os.environ["INFERENCE_WORKERS"] = "0"
+
+# Núcleos repartidos entre los workers para PyTorch
+torch_threads = int(os.getenv("TORCH_THREADS", max(1, CPU_COUNT // workers)))
+
+# Una inferencia en la Raspberry Pi puede tardar varios segundos
+timeout = int(os.getenv("WEB_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Reciclar workers de vez en cuando: se vuelven a forkear desde el maestro precargado
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", 1000))
+max_requests_jitter = 100
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    from wsgi import init_worker
+    init_worker(torch_threads)
+    server.log.info("Worker %s listo (torch_threads=%s)", worker.pid, torch_threads)
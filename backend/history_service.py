@@ -0,0 +1,292 @@
+"""
+Historial federado: PostgreSQL y caché local leídos en paralelo y mezclados en una sola lista ordenada
+"""
+import base64
+import heapq
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+from database import (
+    AnalysisResult, LocalCache, LOCAL_HISTORY_COLUMNS, analysis_history_item, local_history_item,
+    get_db_session, get_local_session, is_db_available, local_engine, local_replica
+)
+from local_replica import replica_results
+
+# Tiempo máximo de espera por la base principal antes de responder solo con el caché local
+HISTORY_PRIMARY_TIMEOUT_SEC = float(os.getenv('HISTORY_PRIMARY_TIMEOUT_SEC', 3))
+
+# Filas del caché local revisadas por consulta al filtrar por usuario / tipo
+LOCAL_SCAN_CHUNK = 200
+
+SOURCE_PRIMARY = 'postgresql'
+SOURCE_LOCAL = 'local_cache'
+
+# Una lectura por origen; los hilos se reutilizan entre solicitudes
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='history')
+
+
+def encode_history_cursor(state):
+    """Cursor opaco con la posición alcanzada en cada origen: {"p": [timestamp, id], "l": id}"""
+    raw = json.dumps(state, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_history_cursor(cursor):
+    """Devuelve el estado del cursor o None si no es válido"""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        primary = state.get('p')
+        local = state.get('l')
+        return {
+            'p': [str(primary[0]), int(primary[1])] if primary else None,
+            'l': int(local) if local is not None else None
+        }
+    except (ValueError, TypeError, IndexError, AttributeError, UnicodeError):
+        return None
+
+
+def _parse_timestamp(value):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return datetime.min
+
+
+def _sort_key(item):
+    """Orden del historial: timestamp y, ante empate, primero PostgreSQL y luego id"""
+    return (_parse_timestamp(item.get('timestamp')), item['source'] == SOURCE_PRIMARY, item['id'])
+
+
+def _keyset_filters(table, user_name, analysis_type, after, since):
+    """Condiciones comunes de la lectura de analysis_results (o de su réplica con las mismas columnas)"""
+    conditions = []
+    if user_name:
+        conditions.append(table.user_name == user_name)
+    if analysis_type:
+        conditions.append(table.analysis_type == analysis_type)
+    if after is not None:
+        timestamp, analysis_id = _parse_timestamp(after[0]), after[1]
+        conditions.append(or_(
+            table.timestamp < timestamp,
+            and_(table.timestamp == timestamp, table.id < analysis_id)
+        ))
+    if since is not None:
+        since_id, since_ts = since
+        changes = []
+        if since_id is not None:
+            changes.append(table.id > since_id)
+        if since_ts is not None:
+            changes.append(table.updated_at > since_ts)
+        conditions.append(or_(*changes))
+    return conditions
+
+
+def _read_replica(limit, user_name, analysis_type, after=None, since=None):
+    """La misma página que _read_primary, leída de la réplica local de los últimos días"""
+    columns = replica_results.c
+    statement = replica_results.select()\
+        .where(*_keyset_filters(columns, user_name, analysis_type, after, since))\
+        .order_by(columns.timestamp.desc(), columns.id.desc())\
+        .limit(limit)
+    with local_engine.connect() as conn:
+        return [analysis_history_item(row) for row in conn.execute(statement)]
+
+
+def _read_primary(limit, user_name, analysis_type, after=None, since=None, replica_only=False):
+    """
+    Página de analysis_results ordenada por (timestamp, id) descendente.
+    after: [timestamp, id] del último elemento entregado (keyset); since: (since_id, since_ts) del modo delta.
+
+    Con la réplica local al día la página se lee de ella; solo se consulta PostgreSQL si la
+    réplica no alcanza a llenarla (el rango sigue antes de la ventana replicada).
+    """
+    if replica_only or local_replica.is_fresh():
+        items = _read_replica(limit, user_name, analysis_type, after, since)
+        if replica_only or since is not None or len(items) >= limit:
+            return items
+
+    db = get_db_session()
+    try:
+        results = db.query(AnalysisResult)\
+            .filter(*_keyset_filters(AnalysisResult, user_name, analysis_type, after, since))\
+            .order_by(AnalysisResult.timestamp.desc(), AnalysisResult.id.desc())\
+            .limit(limit).all()
+        return [analysis_history_item(result) for result in results]
+    finally:
+        db.close()
+
+
+def _read_local(limit, user_name, analysis_type, include_synced, after_id=None, since=None):
+    """
+    Registros del caché local por id descendente (orden de llegada). Los filtros de usuario y tipo
+    viven en summary_json, así que se aplican aquí revisando la tabla por bloques.
+    """
+    local_db = get_local_session()
+    try:
+        query = local_db.query(*LOCAL_HISTORY_COLUMNS).filter(LocalCache.data_type == 'analysis_result')
+        if not include_synced:
+            query = query.filter(LocalCache.status != 'synced')
+        if since is not None:
+            since_id, since_ts = since
+            changes = []
+            if since_id is not None:
+                changes.append(LocalCache.id > since_id)
+            if since_ts is not None:
+                changes.append(LocalCache.last_sync_attempt > since_ts)
+            query = query.filter(or_(*changes))
+
+        items = []
+        chunk = max(limit, LOCAL_SCAN_CHUNK)
+        while len(items) < limit:
+            page = query
+            if after_id is not None:
+                page = page.filter(LocalCache.id < after_id)
+            rows = page.order_by(LocalCache.id.desc()).limit(chunk).all()
+            for row in rows:
+                item = local_history_item(row)
+                if user_name and item['user_name'] != user_name:
+                    continue
+                if analysis_type and item['analysis_type'] != analysis_type:
+                    continue
+                items.append(item)
+                if len(items) >= limit:
+                    break
+            if len(rows) < chunk:
+                break
+            after_id = rows[-1].id
+        return items
+    finally:
+        local_db.close()
+
+
+def get_federated_history(limit=50, user_name=None, analysis_type=None, cursor=None, since=None):
+    """
+    Historial combinado de PostgreSQL y del caché local.
+
+    Ambas lecturas corren en paralelo; el resultado es un k-way merge por timestamp descendente
+    sin duplicados por idempotency_key (se prefiere la fila de PostgreSQL). Mientras la base
+    principal responde, del caché local solo se toman los registros aún no sincronizados.
+
+    Args:
+        limit (int): máximo de elementos
+        user_name (str, optional): filtrar por usuario
+        analysis_type (str, optional): filtrar por tipo de análisis
+        cursor (dict, optional): estado de decode_history_cursor para la página siguiente
+        since (dict, optional): modo delta {'since_id', 'since_local_id', 'since_ts'}
+
+    Returns:
+        dict: history, next_cursor, has_more y estado de cada origen
+    """
+    cursor = cursor or {'p': None, 'l': None}
+    primary_since = local_since = None
+    if since is not None:
+        primary_since = (since.get('since_id'), since.get('since_ts'))
+        local_since = (since.get('since_local_id'), since.get('since_ts'))
+
+    # Se lee una fila extra por origen para saber si queda algo después de esta página
+    fetch = limit + 1
+    primary_online = is_db_available()
+    # Sin base principal, los análisis ya subidos se leen de la réplica local si existe
+    replica_only = not primary_online and local_replica.covers()
+    primary_expected = primary_online or replica_only
+    primary_future = None
+    if primary_expected:
+        primary_future = _executor.submit(
+            _read_primary, fetch, user_name, analysis_type, cursor['p'], primary_since, replica_only
+        )
+    local_future = _executor.submit(
+        _read_local, fetch, user_name, analysis_type, not primary_expected, cursor['l'], local_since
+    )
+
+    sources = {SOURCE_PRIMARY: 'unavailable', SOURCE_LOCAL: 'ok'}
+    primary_items = []
+    if primary_future is not None:
+        try:
+            primary_items = primary_future.result(timeout=HISTORY_PRIMARY_TIMEOUT_SEC)
+            sources[SOURCE_PRIMARY] = 'replica' if replica_only else 'ok'
+        except FutureTimeout:
+            print(f"⚠️ Historial: base principal sin respuesta en {HISTORY_PRIMARY_TIMEOUT_SEC}s")
+            sources[SOURCE_PRIMARY] = 'timeout'
+        except Exception as e:
+            print(f"⚠️ Error obteniendo historial de DB principal: {e}")
+            sources[SOURCE_PRIMARY] = 'error'
+
+    local_items = []
+    try:
+        if primary_expected and sources[SOURCE_PRIMARY] not in ('ok', 'replica'):
+            # La base principal falló: los sincronizados solo se pueden mostrar desde el caché
+            local_future.cancel()
+            local_items = _read_local(fetch, user_name, analysis_type, True, cursor['l'], local_since)
+        else:
+            local_items = local_future.result()
+    except Exception as e:
+        print(f"❌ Error obteniendo historial local: {e}")
+        sources[SOURCE_LOCAL] = 'error'
+
+    # Las filas duplicadas se consumen (el cursor avanza sobre ellas) pero no se muestran;
+    # has_more solo se marca si después de la página queda una fila que sí se mostraría
+    primary_keys = {item['idempotency_key'] for item in primary_items if item.get('idempotency_key')}
+    history = []
+    seen_keys = set()
+    last = {SOURCE_PRIMARY: None, SOURCE_LOCAL: None}
+    consumed = {SOURCE_PRIMARY: 0, SOURCE_LOCAL: 0}
+    has_more = False
+    for item in heapq.merge(primary_items, local_items, key=_sort_key, reverse=True):
+        key = item.get('idempotency_key')
+        duplicate = bool(key) and (key in seen_keys or (item['source'] == SOURCE_LOCAL and key in primary_keys))
+        if not duplicate and len(history) >= limit:
+            has_more = True
+            break
+        last[item['source']] = item
+        consumed[item['source']] += 1
+        if duplicate:
+            continue
+        if key:
+            seen_keys.add(key)
+        history.append(item)
+
+    # Un origen que entregó todas sus filas leídas (fetch) puede tener más después de ellas
+    if not has_more:
+        has_more = any(len(items) >= fetch and consumed[source] == len(items)
+                       for source, items in ((SOURCE_PRIMARY, primary_items), (SOURCE_LOCAL, local_items)))
+
+    next_state = dict(cursor)
+    if last[SOURCE_PRIMARY] is not None:
+        next_state['p'] = [last[SOURCE_PRIMARY]['timestamp'], last[SOURCE_PRIMARY]['id']]
+    if last[SOURCE_LOCAL] is not None:
+        next_state['l'] = last[SOURCE_LOCAL]['id']
+
+    return {
+        'history': history,
+        'next_cursor': encode_history_cursor(next_state) if has_more else None,
+        'has_more': has_more,
+        'sources': sources
+    }
+
+
+def federated_delta_cursor(items, since=None):
+    """
+    Cursor delta por origen: mayor id de cada tabla y mayor updated_at vistos.
+    Un origen sin elementos queda en 0 para que sus inserciones nuevas también lleguen como delta.
+    """
+    since = since or {}
+    primary_ids = [item['id'] for item in items if item['source'] == SOURCE_PRIMARY]
+    local_ids = [item['id'] for item in items if item['source'] == SOURCE_LOCAL]
+    stamps = [item['updated_at'] for item in items if item.get('updated_at')]
+    if since.get('since_id') is not None:
+        primary_ids.append(since['since_id'])
+    if since.get('since_local_id') is not None:
+        local_ids.append(since['since_local_id'])
+    if since.get('since_ts') is not None:
+        stamps.append(since['since_ts'].isoformat())
+    return {
+        'since_id': max(primary_ids) if primary_ids else 0,
+        'since_local_id': max(local_ids) if local_ids else 0,
+        'since_ts': max(stamps) if stamps else None
+    }
@@ -0,0 +1,127 @@
+"""
+Decodificación de imágenes subidas a resolución reducida (sin copiar ni decodificar a tamaño nativo)
+"""
+import io
+import mmap
+import struct
+import tempfile
+
+import cv2
+import numpy as np
+from flask import Request
+
+# Cuerpos mayores a este tamaño se guardan en archivo temporal en vez de RAM
+UPLOAD_SPOOL_THRESHOLD = 1024 * 1024
+
+# Factores de reducción soportados por libjpeg al decodificar
+REDUCED_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+# Marcadores SOF (inicio de frame) que contienen las dimensiones de un JPEG
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class SpoolingRequest(Request):
+    """Request que envía los archivos subidos grandes a un archivo temporal en disco"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_SPOOL_THRESHOLD:
+            return io.BytesIO()
+        return tempfile.TemporaryFile("rb+")
+
+
+def read_image_dimensions(data):
+    """
+    Lee ancho y alto desde la cabecera JPEG o PNG sin decodificar la imagen.
+
+    Returns:
+        tuple: (formato, ancho, alto) o (None, None, None) si no se reconoce
+    """
+    if len(data) >= 24 and bytes(data[:8]) == b"\x89PNG\r\n\x1a\n":
+        width, height = struct.unpack(">II", bytes(data[16:24]))
+        return "png", width, height
+
+    if len(data) < 4 or bytes(data[:2]) != b"\xff\xd8":
+        return None, None, None
+
+    pos = 2
+    size = len(data)
+    while pos + 4 <= size:
+        if data[pos] != 0xFF:
+            pos += 1
+            continue
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        segment_length = struct.unpack(">H", bytes(data[pos + 2:pos + 4]))[0]
+        if marker in _JPEG_SOF_MARKERS and pos + 9 <= size:
+            height, width = struct.unpack(">HH", bytes(data[pos + 5:pos + 9]))
+            return "jpeg", width, height
+        if marker == 0xDA:  # inicio de datos comprimidos sin SOF previo
+            break
+        pos += 2 + segment_length
+    return "jpeg", None, None
+
+
+def choose_decode_flag(width, height, target_size=(1920, 1080)):
+    """Mayor factor de reducción que mantiene la imagen al menos del tamaño de trabajo"""
+    if not width or not height:
+        return cv2.IMREAD_COLOR, 1
+    # Comparar lado mayor con lado mayor para tolerar fotos verticales u orientación EXIF
+    long_side, short_side = max(width, height), min(width, height)
+    target_long, target_short = max(target_size), min(target_size)
+    for factor, flag in REDUCED_FLAGS:
+        if long_side // factor >= target_long and short_side // factor >= target_short:
+            return flag, factor
+    return cv2.IMREAD_COLOR, 1
+
+
+def _upload_buffer(file_storage):
+    """Vista sobre los bytes subidos sin copiarlos (memoria o archivo temporal mapeado)"""
+    stream = file_storage.stream
+    stream.seek(0)
+    if isinstance(stream, io.BytesIO):
+        return np.frombuffer(stream.getbuffer(), np.uint8), None
+    try:
+        mapped = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        return np.frombuffer(mapped, np.uint8), mapped
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return np.frombuffer(stream.read(), np.uint8), None
+
+
+def decode_upload(file_storage, target_size=(1920, 1080)):
+    """
+    Decodifica una imagen subida, reduciéndola al decodificar cuando supera la resolución de trabajo.
+
+    Returns:
+        tuple: (imagen BGR o None, dict con tamaño original, decodificado y factor)
+    """
+    buffer, mapped = _upload_buffer(file_storage)
+    try:
+        fmt, width, height = read_image_dimensions(buffer[:65536])
+        flag, factor = choose_decode_flag(width, height, target_size) if fmt == "jpeg" else (cv2.IMREAD_COLOR, 1)
+        img = cv2.imdecode(buffer, flag)
+        if img is None and flag != cv2.IMREAD_COLOR:
+            img = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+            factor = 1
+    finally:
+        del buffer
+        if mapped is not None:
+            mapped.close()
+
+    info = {
+        "format": fmt,
+        "original_size": f"{width}x{height}" if width and height else None,
+        "decoded_size": f"{img.shape[1]}x{img.shape[0]}" if img is not None else None,
+        "reduction_factor": factor
+    }
+    if factor > 1:
+        print(f"📉 Decodificación reducida 1/{factor}: {info['original_size']} -> {info['decoded_size']}")
+    return img, info
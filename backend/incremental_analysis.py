@@ -0,0 +1,193 @@
+"""
+Análisis incremental por zonas: re-ejecuta el modelo solo en las zonas cuyos píxeles cambiaron
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+class CachedBox:
+    """Detección ligera compatible con las cajas de ultralytics (atributos xyxy y conf)"""
+    __slots__ = ("xyxy", "conf")
+
+    def __init__(self, bbox, conf):
+        self.xyxy = np.array([bbox], dtype=np.float32)
+        self.conf = np.array([conf], dtype=np.float32)
+
+
+def _box_center(bbox):
+    x1, y1, x2, y2 = bbox
+    return int((x1 + x2) / 2), int((y1 + y2) / 2)
+
+
+def _zone_for_point(point, polygons):
+    """Devuelve el nombre de la primera zona que contiene el punto, o None"""
+    for zone_name, polygon in polygons.items():
+        if cv2.pointPolygonTest(polygon, point, False) >= 0:
+            return zone_name
+    return None
+
+
+class _StreamState:
+    """Estado guardado para una fuente de imágenes (cámara, RTSP, estación)"""
+
+    def __init__(self, signature, small_gray, masks, detections):
+        self.signature = signature
+        self.small_gray = small_gray
+        self.masks = masks
+        self.detections = detections
+        self.updated_at = time.time()
+
+
+class IncrementalZoneAnalyzer:
+    """
+    Mantiene el frame anterior (reducido) y las detecciones por zona de cada fuente.
+    En cada frame nuevo calcula un puntaje de cambio por zona y solo infiere sobre
+    recortes de las zonas que cambiaron; el resto reutiliza las detecciones en caché.
+    """
+
+    def __init__(self, model, downsample_width=320, change_threshold=10.0,
+                 crop_padding=32, full_inference_ratio=0.5, max_age_sec=600, max_streams=8):
+        self.model = model
+        self.downsample_width = downsample_width
+        self.change_threshold = change_threshold
+        self.crop_padding = crop_padding
+        self.full_inference_ratio = full_inference_ratio
+        self.max_age_sec = max_age_sec
+        self.max_streams = max_streams
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def reset(self, key=None):
+        """Olvida el estado de una fuente (o de todas)"""
+        with self._lock:
+            if key is None:
+                self._states.clear()
+            else:
+                self._states.pop(key, None)
+
+    def _downsample(self, img):
+        height, width = img.shape[:2]
+        scale = min(1.0, self.downsample_width / float(width))
+        small = cv2.resize(img, (max(1, int(width * scale)), max(1, int(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (5, 5), 0), scale
+
+    @staticmethod
+    def _build_masks(zones, small_shape, scale):
+        masks = {}
+        for zone_name, poly in zones.items():
+            mask = np.zeros(small_shape, dtype=np.uint8)
+            pts = np.array([[int(x * scale), int(y * scale)] for x, y in poly], np.int32)
+            cv2.fillPoly(mask, [pts], 255)
+            masks[zone_name] = mask > 0
+        return masks
+
+    def _change_scores(self, previous, current, masks):
+        diff = cv2.absdiff(previous, current)
+        scores = {}
+        for zone_name, mask in masks.items():
+            scores[zone_name] = float(diff[mask].mean()) if mask.any() else 0.0
+        return scores
+
+    def _split_by_zone(self, boxes, polygons, offset=(0, 0), only_zone=None):
+        """Agrupa cajas por zona según su centro, desplazándolas al sistema de la imagen completa"""
+        per_zone = {}
+        if boxes is None:
+            return per_zone
+        ox, oy = offset
+        for box in boxes:
+            x1, y1, x2, y2 = box.xyxy[0].tolist()
+            bbox = [x1 + ox, y1 + oy, x2 + ox, y2 + oy]
+            center = _box_center(bbox)
+            if only_zone is not None:
+                zone_name = only_zone if cv2.pointPolygonTest(polygons[only_zone], center, False) >= 0 else None
+            else:
+                zone_name = _zone_for_point(center, polygons)
+            if zone_name is None:
+                continue
+            per_zone.setdefault(zone_name, []).append(CachedBox(bbox, float(box.conf[0])))
+        return per_zone
+
+    def _crop_rect(self, polygon, img_shape):
+        height, width = img_shape[:2]
+        x, y, w, h = cv2.boundingRect(polygon)
+        pad = self.crop_padding
+        x1, y1 = max(0, x - pad), max(0, y - pad)
+        x2, y2 = min(width, x + w + pad), min(height, y + h + pad)
+        return x1, y1, x2, y2
+
+    def analyze(self, key, img, scaled_zones, confidence=0.8, imgsz=None):
+        """
+        Detecta cerezas en `img` reutilizando las detecciones de zonas sin cambios.
+
+        Args:
+            key (str): Identificador de la fuente de imágenes
+            img (ndarray): Frame BGR
+            scaled_zones (dict): Zonas ya escaladas a las coordenadas de `img`
+            confidence (float): Umbral de confianza del modelo
+            imgsz (int): Tamaño de entrada del modelo (nivel de calidad); None usa el del modelo
+
+        Returns:
+            tuple: (lista de CachedBox, dict con información del modo incremental)
+        """
+        start = time.time()
+        predict_options = {"imgsz": imgsz} if imgsz else {}
+        polygons = {name: np.array(poly, np.int32) for name, poly in scaled_zones.items()}
+        signature = (img.shape[:2], tuple((name, tuple(map(tuple, poly))) for name, poly in scaled_zones.items()))
+        small_gray, scale = self._downsample(img)
+
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None and time.time() - state.updated_at > self.max_age_sec:
+                state = None
+
+        if state is not None and state.signature == signature:
+            scores = self._change_scores(state.small_gray, small_gray, state.masks)
+            changed = [name for name, score in scores.items() if score > self.change_threshold]
+            masks = state.masks
+        else:
+            scores = {}
+            changed = list(scaled_zones.keys())
+            masks = self._build_masks(scaled_zones, small_gray.shape, scale)
+
+        full_inference = state is None or state.signature != signature or \
+            len(changed) > self.full_inference_ratio * max(1, len(scaled_zones))
+
+        if full_inference:
+            results = self.model.predict(img, conf=confidence, verbose=False, **predict_options)
+            detections = self._split_by_zone(results[0].boxes, polygons)
+            changed = list(scaled_zones.keys())
+        elif changed:
+            detections = {name: boxes for name, boxes in state.detections.items() if name not in changed}
+            rects = [self._crop_rect(polygons[name], img.shape) for name in changed]
+            crops = [img[y1:y2, x1:x2] for x1, y1, x2, y2 in rects]
+            results = self.model.predict(crops, conf=confidence, verbose=False, **predict_options)
+            for zone_name, (x1, y1, _, _), result in zip(changed, rects, results):
+                zone_boxes = self._split_by_zone(result.boxes, polygons, offset=(x1, y1), only_zone=zone_name)
+                if zone_boxes.get(zone_name):
+                    detections[zone_name] = zone_boxes[zone_name]
+        else:
+            detections = state.detections
+
+        with self._lock:
+            self._states[key] = _StreamState(signature, small_gray, masks, detections)
+            self._states.move_to_end(key)
+            while len(self._states) > self.max_streams:
+                self._states.popitem(last=False)
+
+        merged = [box for zone_boxes in detections.values() for box in zone_boxes]
+        info = {
+            "mode": "full" if full_inference else "incremental",
+            "zones_inferred": changed,
+            "zones_reused": [name for name in scaled_zones.keys() if name not in changed],
+            "change_scores": {name: round(score, 2) for name, score in scores.items()},
+            "elapsed_ms": round((time.time() - start) * 1000, 1)
+        }
+        print(f"♻️ Análisis incremental [{key}]: modo={info['mode']}, "
+              f"inferidas={len(changed)}, reutilizadas={len(info['zones_reused'])}")
+        return merged, info
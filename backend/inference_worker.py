@@ -0,0 +1,304 @@
+"""
+Inferencia YOLO en procesos aparte: los frames pasan por slots de memoria compartida
+(multiprocessing.shared_memory) y vuelven solo las detecciones como arreglos compactos
+"""
+import atexit
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from incremental_analysis import CachedBox
+
+
+class InferenceError(Exception):
+    """El proceso de inferencia falló, se reinició o no respondió a tiempo"""
+
+
+class InferenceResult:
+    """Resultado compatible con el de ultralytics para el resto del código (atributo boxes)"""
+    __slots__ = ("boxes",)
+
+    def __init__(self, detections):
+        # detections: float32 Nx5 (x1, y1, x2, y2, confianza)
+        self.boxes = [CachedBox(row[:4].tolist(), float(row[4])) for row in detections]
+
+
+def _pack_boxes(boxes):
+    if boxes is None or len(boxes) == 0:
+        return np.zeros((0, 5), dtype=np.float32)
+    xyxy = boxes.xyxy.cpu().numpy().astype(np.float32)
+    conf = boxes.conf.cpu().numpy().astype(np.float32).reshape(-1, 1)
+    return np.hstack([xyxy, conf])
+
+
+def _worker_main(model_path, slot_names, conn, torch_threads):
+    """Bucle del proceso de inferencia: carga el modelo una vez y atiende solicitudes por el pipe"""
+    if torch_threads:
+        try:
+            import torch
+            torch.set_num_threads(int(torch_threads))
+        except ImportError:
+            pass
+    from ultralytics import YOLO
+
+    model = YOLO(model_path)
+    # Los segmentos los crea (y elimina) el proceso web; con spawn se comparte su resource_tracker
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    imgsz = (model.overrides or {}).get("imgsz")
+    conn.send(("ready", os.getpid(), max(imgsz) if isinstance(imgsz, (list, tuple)) else imgsz))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        request_id, slot, layout, confidence, options = message
+        try:
+            images = [np.ndarray(shape, dtype=np.uint8, buffer=slots[slot].buf, offset=offset)
+                      for offset, shape in layout]
+            results = model.predict(images if len(images) > 1 else images[0], conf=confidence, verbose=False,
+                                    **options)
+            conn.send((request_id, True, [_pack_boxes(result.boxes) for result in results]))
+            del images
+        except Exception as e:
+            conn.send((request_id, False, str(e)))
+
+    for segment in slots:
+        segment.close()
+
+
+class _WorkerHandle:
+    """Un proceso de inferencia con sus slots de memoria compartida y las solicitudes en curso"""
+
+    def __init__(self, index, slot_count, slot_bytes):
+        self.index = index
+        self.slots = [shared_memory.SharedMemory(create=True, size=slot_bytes) for _ in range(slot_count)]
+        self.free_slots = queue.Queue()
+        for slot in range(slot_count):
+            self.free_slots.put(slot)
+        self.process = None
+        self.conn = None
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.restarts = 0
+        self.requests = 0
+
+    def fail_pending(self, message):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(InferenceError(message))
+
+    def close(self):
+        for segment in self.slots:
+            try:
+                segment.close()
+                segment.unlink()
+            except (FileNotFoundError, OSError):
+                pass
+
+
+class InferencePool:
+    """
+    Procesos de inferencia dedicados. predict() tiene la misma forma que model.predict de
+    ultralytics (una imagen o una lista de recortes) para usarse en lugar del modelo en memoria.
+
+    Cada proceso tiene un anillo de slots de memoria compartida: el frame se copia una sola vez
+    al slot y el proceso lo lee sin deserializar. Si un proceso muere (o no responde en
+    timeout_sec) sus solicitudes fallan con InferenceError y se vuelve a lanzar.
+    """
+
+    def __init__(self, model_path, workers=1, slots_per_worker=2, slot_mb=40,
+                 timeout_sec=60.0, torch_threads=None):
+        self.model_path = model_path
+        self.worker_count = max(0, int(workers))
+        self.slots_per_worker = max(1, int(slots_per_worker))
+        self.slot_bytes = int(slot_mb * 1024 * 1024)
+        self.timeout_sec = timeout_sec
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // max(1, self.worker_count))
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._started_pid = None
+        # imgsz del modelo, informado por el primer proceso que lo carga
+        self.model_imgsz = None
+        self.last_error = None
+        atexit.register(self.shutdown)
+
+    @property
+    def enabled(self):
+        return self.worker_count > 0
+
+    def start(self):
+        """Lanza los procesos de inferencia (una vez por proceso web, también tras un fork)"""
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._workers = [_WorkerHandle(index, self.slots_per_worker, self.slot_bytes)
+                             for index in range(self.worker_count)]
+            for handle in self._workers:
+                self._spawn(handle)
+            self._started_pid = os.getpid()
+        print(f"🧠 Inferencia en {self.worker_count} proceso(s) aparte "
+              f"({self.slots_per_worker} slots de {self.slot_bytes // (1024 * 1024)} MB c/u)")
+
+    def _spawn(self, handle):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(self.model_path, [segment.name for segment in handle.slots], child_conn, self.torch_threads),
+            name=f"inference-{handle.index}",
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        handle.process, handle.conn = process, parent_conn
+        handle.ready.clear()
+        threading.Thread(target=self._read_results, args=(handle, parent_conn, process),
+                         name=f"inference-reader-{handle.index}", daemon=True).start()
+
+    def _read_results(self, handle, conn, process):
+        """Entrega los resultados de un proceso; al cerrarse el pipe (proceso caído) lo reinicia"""
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] == "ready":
+                if message[2]:
+                    self.model_imgsz = int(message[2])
+                handle.ready.set()
+                continue
+            request_id, ok, payload = message
+            with handle.lock:
+                future = handle.pending.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(InferenceError(payload))
+
+        process.join(timeout=1)
+        with self._lock:
+            if handle not in self._workers or handle.process is not process:
+                return
+        self.last_error = f"proceso de inferencia {handle.index} terminó (código {process.exitcode})"
+        print(f"❌ {self.last_error}; reiniciando")
+        handle.fail_pending(self.last_error)
+        handle.restarts += 1
+        # Pausa corta para no entrar en un ciclo de reinicios si el modelo no carga
+        time.sleep(min(30, 2 ** min(handle.restarts, 5)))
+        with self._lock:
+            if handle in self._workers:
+                self._spawn(handle)
+
+    def _restart(self, handle, reason):
+        """Termina un proceso que no responde; el hilo lector lo vuelve a lanzar"""
+        self.last_error = reason
+        print(f"⚠️ {reason}; terminando proceso de inferencia {handle.index}")
+        handle.fail_pending(reason)
+        if handle.process is not None and handle.process.is_alive():
+            handle.process.terminate()
+
+    def _pick_worker(self):
+        return max(self._workers, key=lambda handle: (handle.ready.is_set(), handle.free_slots.qsize()))
+
+    def predict(self, source, conf=0.25, verbose=False, imgsz=None):
+        """
+        Args:
+            source (ndarray | list): Frame BGR o lista de recortes
+            conf (float): Umbral de confianza
+            imgsz (int): Tamaño de entrada del modelo; None usa el del modelo
+
+        Returns:
+            list: un InferenceResult por imagen
+        """
+        self.start()
+        images = source if isinstance(source, (list, tuple)) else [source]
+        images = [np.ascontiguousarray(image, dtype=np.uint8) for image in images]
+        total = sum(image.nbytes for image in images)
+        if total > self.slot_bytes:
+            raise InferenceError(f"imagen de {total // (1024 * 1024)} MB no cabe en el slot "
+                                 f"de {self.slot_bytes // (1024 * 1024)} MB (INFERENCE_SLOT_MB)")
+
+        handle = self._pick_worker()
+        try:
+            slot = handle.free_slots.get(timeout=self.timeout_sec)
+        except queue.Empty:
+            raise InferenceError("sin slots libres para inferencia")
+
+        try:
+            layout = []
+            offset = 0
+            buffer = handle.slots[slot].buf
+            for image in images:
+                target = np.ndarray(image.shape, dtype=np.uint8, buffer=buffer, offset=offset)
+                target[...] = image
+                layout.append((offset, image.shape))
+                offset += image.nbytes
+            del target
+
+            request_id = next(self._ids)
+            future = Future()
+            with handle.lock:
+                handle.pending[request_id] = future
+                options = {"imgsz": int(imgsz)} if imgsz else {}
+                handle.conn.send((request_id, slot, layout, float(conf), options))
+            handle.requests += 1
+
+            try:
+                detections = future.result(timeout=self.timeout_sec)
+            except FutureTimeoutError:
+                self._restart(handle, f"inferencia sin respuesta en {self.timeout_sec:.0f} s")
+                raise InferenceError("la inferencia no respondió a tiempo")
+        finally:
+            # Un proceso caído ya no lee el slot; uno en pausa se termina antes de reutilizarlo
+            handle.free_slots.put(slot)
+
+        return [InferenceResult(array) for array in detections]
+
+    def shutdown(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+            self._started_pid = None
+        for handle in workers:
+            try:
+                handle.conn.send(None)
+            except (OSError, ValueError):
+                pass
+            if handle.process is not None:
+                handle.process.join(timeout=5)
+                if handle.process.is_alive():
+                    handle.process.terminate()
+            handle.fail_pending("inferencia detenida")
+            handle.close()
+
+    def status(self):
+        return {
+            "enabled": self.enabled,
+            "workers": [{
+                "index": handle.index,
+                "pid": handle.process.pid if handle.process is not None else None,
+                "alive": handle.process is not None and handle.process.is_alive(),
+                "ready": handle.ready.is_set(),
+                "free_slots": handle.free_slots.qsize(),
+                "in_flight": len(handle.pending),
+                "requests": handle.requests,
+                "restarts": handle.restarts
+            } for handle in self._workers],
+            "slot_mb": self.slot_bytes // (1024 * 1024),
+            "last_error": self.last_error
+        }
@@ -0,0 +1,353 @@
+"""
+Réplica local (SQLite) de los últimos días de analysis_results para servir historial e informes sin cruzar la red
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, DateTime, Text, Float, Boolean, Index, and_, or_, select,
+    func, literal
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from local_store import bump_table_version
+
+REPLICA_DAYS = int(os.getenv('REPLICA_DAYS', 14))
+REPLICA_REFRESH_SEC = int(os.getenv('REPLICA_REFRESH_SEC', 30))
+REPLICA_MAX_STALENESS_SEC = int(os.getenv('REPLICA_MAX_STALENESS_SEC', 120))
+# Cada refresco vuelve a leer este margen antes de la marca de agua: updated_at viene del reloj de
+# cada estación y una fila puede llegar a PostgreSQL con un updated_at anterior a la marca
+REPLICA_OVERLAP_SEC = int(os.getenv('REPLICA_OVERLAP_SEC', 300))
+REPLICA_BATCH_SIZE = 500
+
+# Columnas de resumen copiadas de analysis_results (sin detecciones ni rutas técnicas)
+REPLICA_COLUMNS = [
+    "id", "timestamp", "user_name", "analysis_type", "profile", "distribucion",
+    "guia_sii", "lote", "num_frutos", "num_proceso", "id_caja", "total_detections",
+    "zones_analyzed", "confidence_used", "processed_image_path", "results_json",
+    "synced_to_server", "idempotency_key", "updated_at"
+]
+
+replica_metadata = MetaData()
+
+# Tablas propias del archivo local: no se crean en PostgreSQL
+replica_results = Table(
+    "replica_analysis_results", replica_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),  # mismo id que en PostgreSQL
+    Column("timestamp", DateTime, nullable=False),
+    Column("user_name", String(100)),
+    Column("analysis_type", String(50)),
+    Column("profile", String(50)),
+    Column("distribucion", String(20)),
+    Column("guia_sii", String(100)),
+    Column("lote", String(100)),
+    Column("num_frutos", Integer),
+    Column("num_proceso", String(100)),
+    Column("id_caja", String(100)),
+    Column("total_detections", Integer),
+    Column("zones_analyzed", Integer),
+    Column("confidence_used", Float),
+    Column("processed_image_path", String(500)),
+    Column("results_json", Text),
+    Column("synced_to_server", Boolean),
+    Column("idempotency_key", String(36)),
+    Column("updated_at", DateTime),
+    Index("ix_replica_results_timestamp", "timestamp", "id"),
+    Index("ix_replica_results_type_timestamp", "analysis_type", "timestamp"),
+    Index("ix_replica_results_distribucion_timestamp", "distribucion", "timestamp"),
+    Index("ix_replica_results_updated", "updated_at", "id"),
+)
+
+replica_zone_counts = Table(
+    "replica_zone_counts", replica_metadata,
+    Column("analysis_id", Integer, primary_key=True),
+    Column("zone_name", String(100), primary_key=True),
+    Column("count", Integer, nullable=False, default=0),
+    Index("ix_replica_zone_counts_zone_analysis", "zone_name", "analysis_id"),
+)
+
+# Último refresco completo y marca de agua de refresh() (compartidos entre procesos worker: solo uno refresca)
+replica_state = Table(
+    "replica_state", replica_metadata,
+    Column("name", String(50), primary_key=True),
+    Column("value", DateTime),
+)
+
+# Las mismas columnas vistas en la base principal (para leerlas con los tipos correctos en cada motor)
+def _source_table(name, replica_table):
+    return Table(name, MetaData(), *[
+        Column(column.name, column.type, primary_key=column.primary_key) for column in replica_table.columns
+    ])
+
+source_results = _source_table("analysis_results", replica_results)
+source_zone_counts = _source_table("analysis_zone_counts", replica_zone_counts)
+
+# Para consultas SQL de informes: las tablas de la réplica con los alias de las originales
+REPLICA_RESULTS_FROM = "replica_analysis_results AS analysis_results"
+REPLICA_ZONES_FROM = "replica_zone_counts AS analysis_zone_counts"
+
+
+def replica_cutoff(days=REPLICA_DAYS, now=None):
+    """Inicio de la ventana replicada: medianoche de hace N días (la réplica guarda días completos)"""
+    today = (now or datetime.utcnow()).replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=days)
+
+
+class LocalReplica:
+    """
+    Copia en SQLite de los análisis de los últimos REPLICA_DAYS días con sus conteos por zona.
+
+    Un hilo la refresca desde PostgreSQL de forma incremental con una marca de agua de updated_at
+    guardada en replica_state, que solo avanza refresh() y se relee con un margen de overlap_sec.
+    Las escrituras de esta estación se aplican de inmediato con apply() sin mover la marca.
+    Las lecturas la usan solo si el último refresco está dentro de max_staleness_sec
+    (o si la base principal no responde) y el rango pedido cae dentro de la ventana.
+    """
+
+    def __init__(self, local_engine, primary_engine, primary_available, enabled=True,
+                 days=REPLICA_DAYS, refresh_sec=REPLICA_REFRESH_SEC,
+                 max_staleness_sec=REPLICA_MAX_STALENESS_SEC, batch_size=REPLICA_BATCH_SIZE,
+                 overlap_sec=REPLICA_OVERLAP_SEC):
+        self.local_engine = local_engine
+        self.primary_engine = primary_engine
+        self.primary_available = primary_available
+        self.enabled = enabled and days > 0
+        self.days = days
+        self.refresh_sec = refresh_sec
+        self.max_staleness_sec = max_staleness_sec
+        self.batch_size = batch_size
+        self.overlap_sec = overlap_sec
+        self.last_refresh_at = None
+        self.last_error = None
+        self.rows_refreshed = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def create_tables(self):
+        replica_metadata.create_all(bind=self.local_engine)
+
+    def cutoff(self):
+        return replica_cutoff(self.days)
+
+    def last_refresh(self):
+        """Último refresco hecho por este proceso o, si fue más reciente, por otro worker"""
+        try:
+            with self.local_engine.connect() as conn:
+                shared = self._state(conn, "last_refresh_at")
+        except Exception:
+            shared = None
+        candidates = [value for value in (self.last_refresh_at, shared) if value is not None]
+        return max(candidates) if candidates else None
+
+    def staleness_sec(self):
+        last_refresh_at = self.last_refresh()
+        if last_refresh_at is None:
+            return None
+        return (datetime.utcnow() - last_refresh_at).total_seconds()
+
+    def is_fresh(self):
+        age = self.staleness_sec()
+        return age is not None and age <= self.max_staleness_sec
+
+    def covers(self, start=None):
+        """
+        True si una lectura desde `start` (datetime o None = sin límite) puede servirse de la réplica.
+        Con la base principal caída la réplica es lo más completo disponible y se usa siempre.
+        """
+        if not self.enabled:
+            return False
+        if not self.primary_available():
+            return self._has_rows()
+        return self.is_fresh() and start is not None and start >= self.cutoff()
+
+    def _has_rows(self):
+        try:
+            with self.local_engine.connect() as conn:
+                return conn.execute(select(replica_results.c.id).limit(1)).first() is not None
+        except Exception:
+            return False
+
+    def get(self, analysis_id):
+        """Un análisis de la réplica como dict (solo columnas de resumen) o None"""
+        if not self.enabled:
+            return None
+        with self.local_engine.connect() as conn:
+            row = conn.execute(select(replica_results).where(replica_results.c.id == analysis_id)).mappings().first()
+        return dict(row) if row is not None else None
+
+    def daily_rollup_rows(self, start_day, end_day, all_zones_key, profile=None, distribucion=None):
+        """
+        Mismas filas que el resumen de daily_rollups (día, zona, análisis, frutos, defectos),
+        calculadas desde la réplica para cuando la base principal no responde.
+        """
+        start = datetime.combine(start_day, datetime.min.time())
+        end = datetime.combine(end_day, datetime.min.time()) + timedelta(days=1)
+        day = func.date(replica_results.c.timestamp)
+        filters = [replica_results.c.timestamp >= start, replica_results.c.timestamp < end]
+        if profile:
+            filters.append(replica_results.c.profile == profile)
+        if distribucion:
+            filters.append(replica_results.c.distribucion == distribucion)
+        totals = select(
+            day, literal(all_zones_key), func.count(),
+            func.coalesce(func.sum(replica_results.c.num_frutos), 0),
+            func.coalesce(func.sum(replica_results.c.total_detections), 0)
+        ).where(*filters).group_by(day)
+        zones = select(
+            day, replica_zone_counts.c.zone_name, func.count(),
+            func.coalesce(func.sum(replica_results.c.num_frutos), 0), func.sum(replica_zone_counts.c.count)
+        ).join_from(replica_results, replica_zone_counts, replica_zone_counts.c.analysis_id == replica_results.c.id)\
+            .where(*filters).group_by(day, replica_zone_counts.c.zone_name)
+        with self.local_engine.connect() as conn:
+            rows = conn.execute(totals).all() + conn.execute(zones).all()
+        return [(datetime.strptime(row[0], "%Y-%m-%d").date(),) + tuple(row[1:]) for row in rows]
+
+    def _state(self, conn, name):
+        return conn.execute(select(replica_state.c.value).where(replica_state.c.name == name)).scalar()
+
+    def _set_state(self, conn, name, value):
+        statement = sqlite_insert(replica_state).values(name=name, value=value)
+        conn.execute(statement.on_conflict_do_update(
+            index_elements=["name"], set_={"value": statement.excluded.value}
+        ))
+
+    def _changed_rows(self, conn, rows):
+        """Filas que faltan en la réplica o cuyo updated_at cambió (el margen relee filas ya copiadas)"""
+        current = dict(conn.execute(
+            select(replica_results.c.id, replica_results.c.updated_at)
+            .where(replica_results.c.id.in_([row["id"] for row in rows]))
+        ).all())
+        return [row for row in rows if row["id"] not in current or current[row["id"]] != row["updated_at"]]
+
+    def _upsert(self, conn, rows, zone_rows):
+        """Inserta o reemplaza filas de la réplica y sus conteos por zona"""
+        rows = [{column: row.get(column) for column in REPLICA_COLUMNS} for row in rows]
+        statement = sqlite_insert(replica_results)
+        conn.execute(statement.on_conflict_do_update(
+            index_elements=["id"],
+            set_={column: statement.excluded[column] for column in REPLICA_COLUMNS[1:]}
+        ), rows)
+        ids = [row["id"] for row in rows]
+        conn.execute(replica_zone_counts.delete().where(replica_zone_counts.c.analysis_id.in_(ids)))
+        if zone_rows:
+            conn.execute(replica_zone_counts.insert(), zone_rows)
+        bump_table_version(conn, "replica_analysis_results")
+
+    def apply(self, rows, zone_rows):
+        """
+        Aplica de inmediato análisis recién escritos en la base principal por esta estación.
+
+        Args:
+            rows (list): dicts con las columnas de analysis_results (incluido id)
+            zone_rows (list): filas de analysis_zone_counts de esos análisis
+        """
+        if not self.enabled:
+            return
+        cutoff = self.cutoff()
+        rows = [row for row in rows if row.get("id") is not None and row["timestamp"] >= cutoff]
+        if not rows:
+            return
+        ids = {row["id"] for row in rows}
+        try:
+            with self.local_engine.begin() as conn:
+                self._upsert(conn, rows, [zone for zone in zone_rows if zone["analysis_id"] in ids])
+        except Exception as e:
+            print(f"⚠️ Error actualizando réplica local: {e}")
+
+    def refresh(self):
+        """
+        Trae de PostgreSQL los análisis de la ventana cambiados desde la marca de agua (menos el
+        margen de overlap_sec) y borra de la réplica los que quedaron fuera de ella.
+
+        Returns:
+            int: filas copiadas
+        """
+        with self._lock:
+            cutoff = self.cutoff()
+            copied = 0
+            with self.local_engine.connect() as conn:
+                watermark = self._state(conn, "refresh_watermark") or datetime(1970, 1, 1)
+            # Paginación de este refresco por (updated_at, id) desde el inicio del margen
+            page_ts, page_id = watermark - timedelta(seconds=self.overlap_sec), 0
+            while True:
+                with self.primary_engine.connect() as source:
+                    rows = source.execute(
+                        select(*[source_results.c[column] for column in REPLICA_COLUMNS])
+                        .where(source_results.c.timestamp >= cutoff)
+                        .where(or_(
+                            source_results.c.updated_at > page_ts,
+                            and_(source_results.c.updated_at == page_ts, source_results.c.id > page_id)
+                        ))
+                        .order_by(source_results.c.updated_at, source_results.c.id)
+                        .limit(self.batch_size)
+                    ).mappings().all()
+                    zone_rows = []
+                    if rows:
+                        zone_rows = [dict(zone) for zone in source.execute(
+                            select(source_zone_counts)
+                            .where(source_zone_counts.c.analysis_id.in_([row["id"] for row in rows]))
+                        ).mappings()]
+                if not rows:
+                    break
+                with self.local_engine.begin() as conn:
+                    changed = self._changed_rows(conn, rows)
+                    if changed:
+                        changed_ids = {row["id"] for row in changed}
+                        self._upsert(conn, [dict(row) for row in changed],
+                                     [zone for zone in zone_rows if zone["analysis_id"] in changed_ids])
+                copied += len(changed)
+                page_ts, page_id = rows[-1]["updated_at"], rows[-1]["id"]
+                watermark = max(watermark, page_ts)
+                if len(rows) < self.batch_size:
+                    break
+
+            with self.local_engine.begin() as conn:
+                expired_ids = select(replica_results.c.id).where(replica_results.c.timestamp < cutoff)
+                conn.execute(replica_zone_counts.delete().where(replica_zone_counts.c.analysis_id.in_(expired_ids)))
+                expired = conn.execute(replica_results.delete().where(replica_results.c.timestamp < cutoff)).rowcount
+                if expired:
+                    bump_table_version(conn, "replica_analysis_results")
+                self.last_refresh_at = datetime.utcnow()
+                self._set_state(conn, "refresh_watermark", watermark)
+                self._set_state(conn, "last_refresh_at", self.last_refresh_at)
+
+            self.rows_refreshed += copied
+            self.last_error = None
+            if copied:
+                print(f"🪞 Réplica local: {copied} análisis actualizados desde la base principal")
+            return copied
+
+    def start(self):
+        """Inicia el refresco periódico en segundo plano (idempotente)"""
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._run, name="local-replica", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            if self.primary_available():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    self.last_error = str(e)
+                    print(f"⚠️ Error refrescando réplica local: {e}")
+            time.sleep(self.refresh_sec)
+
+    def status(self):
+        last_refresh_at = self.last_refresh()
+        age = self.staleness_sec()
+        return {
+            "enabled": self.enabled,
+            "days": self.days,
+            "cutoff": self.cutoff().isoformat(),
+            "last_refresh_at": last_refresh_at.isoformat() if last_refresh_at else None,
+            "staleness_sec": round(age, 1) if age is not None else None,
+            "max_staleness_sec": self.max_staleness_sec,
+            "fresh": self.is_fresh(),
+            "rows_refreshed": self.rows_refreshed,
+            "last_error": self.last_error,
+            "running": self._thread is not None and self._thread.is_alive()
+        }
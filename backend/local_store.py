@@ -0,0 +1,256 @@
+"""
+Almacenamiento local SQLite ajustado para Raspberry Pi: WAL, conexión por hilo, payloads comprimidos y limpieza programada
+"""
+import json
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+LOCAL_CACHE_RETENTION_DAYS = int(os.getenv('LOCAL_CACHE_RETENTION_DAYS', 7))
+LOCAL_CACHE_MAX_MB = int(os.getenv('LOCAL_CACHE_MAX_MB', 512))
+LOCAL_MAINTENANCE_INTERVAL_SEC = int(os.getenv('LOCAL_MAINTENANCE_INTERVAL_SEC', 3600))
+
+# Prefijo de un byte que identifica el códec de cada payload
+_CODEC_ZLIB = b"z"
+_CODEC_ZSTD = b"Z"
+
+# Campos del análisis que se guardan sin comprimir para listar el historial local
+SUMMARY_FORM_FIELDS = ["user", "analysis_type", "profile", "distribucion", "guia_sii", "lote", "num_frutos"]
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL permite lectores concurrentes con un escritor; synchronous=NORMAL reduce fsync en la SD"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA journal_size_limit=16777216")
+    cursor.close()
+
+
+def create_local_engine(url, pool_size=4, max_overflow=4):
+    """
+    Engine SQLite con pool de conexiones: cada hilo trabaja con su propia conexión mientras
+    la tiene tomada (en vez de compartir una sola entre todos los hilos).
+    """
+    local = create_engine(
+        url,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=10,
+        connect_args={'check_same_thread': False, 'timeout': 5},
+        echo=False
+    )
+    event.listen(local, "connect", _set_sqlite_pragmas)
+    return local
+
+
+def encode_payload(data):
+    """JSON comprimido (zstd si está instalado, si no zlib)"""
+    raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    if zstandard is not None:
+        return _CODEC_ZSTD + zstandard.ZstdCompressor(level=6).compress(raw)
+    return _CODEC_ZLIB + zlib.compress(raw, 6)
+
+
+def decode_payload(blob):
+    codec, body = bytes(blob[:1]), bytes(blob[1:])
+    if codec == _CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Payload comprimido con zstd pero zstandard no está instalado")
+        return json.loads(zstandard.ZstdDecompressor().decompress(body))
+    return json.loads(zlib.decompress(body))
+
+
+def load_cache_payload(data_json, data_blob):
+    """Payload completo de un registro del caché (comprimido o JSON plano de versiones anteriores)"""
+    if data_blob:
+        return decode_payload(data_blob)
+    return json.loads(data_json) if data_json else {}
+
+
+def build_summary(form_data, results_data, timestamp):
+    """Resumen liviano para el historial local (sin detecciones ni rutas técnicas)"""
+    summary = {field: form_data.get(field) for field in SUMMARY_FORM_FIELDS}
+    summary.update({
+        "timestamp": timestamp,
+        "total_detections": results_data.get("total_cherries", 0),
+        "zones_analyzed": results_data.get("zones_loaded", 0),
+        "results": results_data.get("results", {}),
+        "processed_image": results_data.get("processed_image")
+    })
+    return json.dumps(summary)
+
+
+def bump_table_version(conn, table_name):
+    """Incrementa el contador de cambios de una tabla (misma sintaxis en SQLite y PostgreSQL)"""
+    conn.execute(text(
+        "INSERT INTO table_versions (table_name, version) VALUES (:table_name, 1) "
+        "ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1"
+    ), {"table_name": table_name})
+
+
+def delete_synced(engine, older_than=None, batch_size=None):
+    """
+    DELETE en bloque de registros ya sincronizados.
+
+    Args:
+        older_than (datetime, optional): solo registros creados antes de esta fecha
+        batch_size (int, optional): borrar solo los N más antiguos
+
+    Returns:
+        int: registros eliminados
+    """
+    condition = "status = 'synced'"
+    params = {}
+    if older_than is not None:
+        condition += " AND created_at < :cutoff"
+        params["cutoff"] = older_than.strftime("%Y-%m-%d %H:%M:%S")
+    if batch_size:
+        sql = (f"DELETE FROM local_cache WHERE id IN "
+               f"(SELECT id FROM local_cache WHERE {condition} ORDER BY id LIMIT {int(batch_size)})")
+    else:
+        sql = f"DELETE FROM local_cache WHERE {condition}"
+    with engine.begin() as conn:
+        deleted = conn.execute(text(sql), params).rowcount
+        if deleted:
+            bump_table_version(conn, "local_cache")
+        return deleted
+
+
+class LocalStoreMaintenance:
+    """
+    Limpieza periódica del caché local: borra sincronizados antiguos, mantiene la tabla local_cache
+    bajo el tamaño máximo y devuelve páginas libres con incremental_vacuum.
+
+    El tope cuenta solo local_cache (con sus índices): la réplica y el caché de credenciales
+    comparten el archivo pero se acotan por días y no se pueden liberar borrando sincronizados.
+    """
+
+    def __init__(self, engine, interval_sec=LOCAL_MAINTENANCE_INTERVAL_SEC,
+                 retention_days=LOCAL_CACHE_RETENTION_DAYS, max_size_mb=LOCAL_CACHE_MAX_MB, vacuum_pages=2000):
+        self.engine = engine
+        self.interval_sec = interval_sec
+        self.retention_days = retention_days
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.vacuum_pages = vacuum_pages
+        self.last_run_at = None
+        self.last_result = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def size_bytes(self):
+        """Bytes ocupados por datos en todo el archivo (sin contar páginas libres)"""
+        with self.engine.connect() as conn:
+            page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+            page_count = conn.exec_driver_sql("PRAGMA page_count").scalar()
+            free_pages = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        return (page_count - free_pages) * page_size
+
+    def cache_size_bytes(self):
+        """
+        Bytes de local_cache y sus índices según dbstat; si SQLite no trae dbstat, estimado
+        por el largo de los payloads de cada fila
+        """
+        with self.engine.connect() as conn:
+            try:
+                return conn.exec_driver_sql(
+                    "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN "
+                    "(SELECT name FROM sqlite_master WHERE tbl_name = 'local_cache')"
+                ).scalar()
+            except OperationalError:
+                return conn.exec_driver_sql(
+                    "SELECT COALESCE(SUM(LENGTH(data_json) + COALESCE(LENGTH(data_blob), 0) "
+                    "+ COALESCE(LENGTH(summary_json), 0) + 100), 0) FROM local_cache"
+                ).scalar()
+
+    def enable_incremental_vacuum(self):
+        """auto_vacuum=INCREMENTAL solo aplica a un archivo existente tras un VACUUM completo (una vez)"""
+        with self.engine.connect() as conn:
+            if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+                return False
+            print("🧹 Activando auto_vacuum incremental en el caché local (VACUUM único)...")
+            raw = conn.connection.dbapi_connection
+            raw.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            raw.execute("VACUUM")
+        return True
+
+    def incremental_vacuum(self):
+        with self.engine.connect() as conn:
+            conn.exec_driver_sql(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)})")
+
+    def run_once(self):
+        """Ejecuta un ciclo de limpieza y devuelve lo realizado"""
+        with self._lock:
+            start = time.time()
+            cutoff = datetime.utcnow() - timedelta(days=self.retention_days)
+            deleted = delete_synced(self.engine, older_than=cutoff)
+
+            # Tope de tamaño: borrar los sincronizados más antiguos (nunca los pendientes)
+            capped = 0
+            while self.cache_size_bytes() > self.max_size_bytes:
+                removed = delete_synced(self.engine, batch_size=500)
+                if not removed:
+                    print("⚠️ Caché local sobre el tamaño máximo y sin registros sincronizados para borrar")
+                    break
+                capped += removed
+
+            self.incremental_vacuum()
+            self.last_run_at = datetime.utcnow()
+            self.last_result = {
+                "deleted_expired": deleted,
+                "deleted_over_size": capped,
+                "size_mb": round(self.cache_size_bytes() / 1024 / 1024, 1),
+                "file_size_mb": round(self.size_bytes() / 1024 / 1024, 1),
+                "elapsed_ms": round((time.time() - start) * 1000, 1)
+            }
+        if deleted or capped:
+            print(f"🧹 Caché local: {deleted} expirados y {capped} por tamaño eliminados "
+                  f"({self.last_result['size_mb']} MB)")
+        return self.last_result
+
+    def start(self):
+        """Inicia la limpieza periódica en segundo plano (idempotente)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="local-store-maintenance", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self.enable_incremental_vacuum()
+        except Exception as e:
+            print(f"⚠️ No se pudo activar incremental_vacuum: {e}")
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"⚠️ Error en mantenimiento del caché local: {e}")
+            time.sleep(self.interval_sec)
+
+    def status(self):
+        try:
+            size_mb = round(self.cache_size_bytes() / 1024 / 1024, 1)
+            file_size_mb = round(self.size_bytes() / 1024 / 1024, 1)
+        except Exception:
+            size_mb = file_size_mb = None
+        return {
+            "size_mb": size_mb,
+            "file_size_mb": file_size_mb,
+            "max_size_mb": round(self.max_size_bytes / 1024 / 1024),
+            "retention_days": self.retention_days,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_result": self.last_result,
+            "running": self._thread is not None and self._thread.is_alive()
+        }
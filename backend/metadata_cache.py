@@ -0,0 +1,52 @@
+"""
+Respuestas JSON de metadatos (perfiles, zonas, defectos) serializadas una vez por versión, con ETag fuerte
+"""
+import hashlib
+import json
+import threading
+
+
+class JsonResponseCache:
+    """
+    Guarda el cuerpo JSON ya serializado y su ETag (hash del contenido) por clave.
+    Las claves son tuplas cuyo primer elemento es el grupo ('zones', 'profiles', ...);
+    invalidate(grupo) descarta las entradas del grupo y sube su versión.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, build_payload):
+        """
+        Devuelve (cuerpo en bytes, etag) de la clave, construyéndolo solo la primera vez.
+
+        Args:
+            key (tuple): (grupo, ...) identificador de la respuesta
+            build_payload (callable): genera el dict a serializar
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            version = self._versions.get(key[0], 0)
+        if entry is not None:
+            return entry
+        body = json.dumps(build_payload(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        entry = (body, hashlib.sha1(body).hexdigest())
+        with self._lock:
+            # Si hubo una invalidación mientras se construía, no guardar el resultado viejo
+            if self._versions.get(key[0], 0) == version:
+                self._entries[key] = entry
+        return entry
+
+    def invalidate(self, group=None):
+        """Descarta las respuestas de un grupo (o todas) para que se recalculen en la próxima solicitud"""
+        with self._lock:
+            for key in [key for key in self._entries if group is None or key[0] == group]:
+                del self._entries[key]
+            for name in ([group] if group is not None else list(self._versions)):
+                self._versions[name] = self._versions.get(name, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "versions": dict(self._versions)}
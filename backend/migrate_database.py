@@ -95,6 +95,76 @@ def migrate_database():
         print(f"❌ Error en migración: {e}")
         return False
 
+# Columnas agregadas después de la creación inicial de las tablas: (tabla, columna, tipo SQL o {dialecto: tipo})
+SCHEMA_COLUMNS = [
+    ("analysis_results", "idempotency_key", "VARCHAR(36)"),
+    ("local_cache", "idempotency_key", "VARCHAR(36)"),
+    ("local_cache", "data_blob", {"postgresql": "BYTEA", "sqlite": "BLOB"}),
+    ("local_cache", "summary_json", "TEXT"),
+]
+
+# Índices requeridos: (nombre, tabla, columnas, único)
+SCHEMA_INDEXES = [
+    ("ux_analysis_results_idempotency_key", "analysis_results", "idempotency_key", True),
+    ("ix_local_cache_status_id", "local_cache", "status, id", False),
+    ("ix_analysis_results_timestamp", "analysis_results", "timestamp", False),
+    ("ix_analysis_results_type_timestamp", "analysis_results", "analysis_type, timestamp", False),
+    ("ix_analysis_results_distribucion_timestamp", "analysis_results", "distribucion, timestamp", False),
+    ("ix_analysis_results_lote", "analysis_results", "lote", False),
+    ("ix_analysis_results_guia_sii", "analysis_results", "guia_sii", False),
+    ("ix_analysis_results_updated_at", "analysis_results", "updated_at, id", False),
+]
+
+def _without_statement_timeout(conn):
+    """
+    Las conexiones de la app traen statement_timeout corto; una migración (índice sobre una tabla
+    grande) puede tardar más, así que se desactiva solo dentro de su transacción
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SET LOCAL statement_timeout = 0"))
+
+def apply_schema_migrations(engine):
+    """
+    Agregar columnas e índices faltantes (idempotente, funciona en PostgreSQL y SQLite).
+
+    Las columnas se confirman primero y cada índice va en su propia transacción: si un índice
+    falla, las columnas (p. ej. idempotency_key, que usa el escritor write-behind) quedan creadas.
+    """
+    inspector = inspect(engine)
+    tables = inspector.get_table_names()
+    applied = []
+
+    with engine.begin() as conn:
+        _without_statement_timeout(conn)
+        for table, column, column_type in SCHEMA_COLUMNS:
+            if table not in tables:
+                continue
+            columns = [col['name'] for col in inspector.get_columns(table)]
+            if isinstance(column_type, dict):
+                column_type = column_type[engine.dialect.name]
+            if column not in columns:
+                print(f"➕ Agregando columna '{column}' a tabla '{table}'...")
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+                applied.append(f"{table}.{column}")
+
+    for index_name, table, columns, unique in SCHEMA_INDEXES:
+        if table not in tables:
+            continue
+        unique_sql = "UNIQUE " if unique else ""
+        try:
+            with engine.begin() as conn:
+                _without_statement_timeout(conn)
+                conn.execute(text(f"CREATE {unique_sql}INDEX IF NOT EXISTS {index_name} ON {table} ({columns})"))
+        except Exception as e:
+            print(f"⚠️ No se pudo crear el índice '{index_name}': {e}")
+
+    # En SQLite, las conexiones del pool abiertas antes del cambio de esquema pueden preparar
+    # sentencias con el esquema anterior: se cierran para que las nuevas lo lean actualizado
+    engine.dispose()
+    if applied:
+        print(f"✅ Migraciones aplicadas: {', '.join(applied)}")
+    return applied
+
 def reset_users_table():
     """Eliminar y recrear tabla de usuarios (CUIDADO: borra todos los datos)"""
     try:
@@ -142,9 +212,10 @@ if __name__ == "__main__":
     print("🚀 Script de migración de base de datos")
     print("1. Migrar (agregar columnas faltantes)")
     print("2. Resetear tabla users (ELIMINA TODOS LOS USUARIOS)")
-    print("3. Salir")
+    print("3. Aplicar migraciones de esquema (columnas e índices de análisis)")
+    print("4. Salir")
     
-    choice = input("\nSelecciona una opción (1-3): ").strip()
+    choice = input("\nSelecciona una opción (1-4): ").strip()
     
     if choice == '1':
         migrate_database()
@@ -155,6 +226,8 @@ if __name__ == "__main__":
         else:
             print("❌ Operación cancelada")
     elif choice == '3':
+        apply_schema_migrations(create_engine(DATABASE_URL, pool_pre_ping=True))
+    elif choice == '4':
         print("👋 Saliendo...")
     else:
         print("❌ Opción inválida")
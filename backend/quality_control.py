@@ -0,0 +1,207 @@
+"""
+Calidad adaptativa según un presupuesto de latencia por solicitud: mide p50/p95 por etapa y el
+estado de throttling de la CPU (sysfs) y baja o sube el nivel de calidad (imgsz, dibujo,
+calidad JPEG)
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from capture_policy import INFERENCE_CONFIG
+
+# De mayor a menor calidad. imgsz_scale se aplica sobre el imgsz del modelo (1.0 = el del modelo,
+# sin forzarlo)
+QUALITY_LEVELS = [
+    {"name": "full", "imgsz_scale": 1.0, "render": "full", "jpeg_quality": 95},
+    {"name": "high", "imgsz_scale": 1.0, "render": "fast", "jpeg_quality": 90},
+    {"name": "medium", "imgsz_scale": 0.75, "render": "fast", "jpeg_quality": 80},
+    {"name": "low", "imgsz_scale": 0.5, "render": "outline", "jpeg_quality": 70},
+]
+
+# Raspberry Pi: bits de vcgencmd get_throttled (0x2 frecuencia limitada, 0x4 throttling, 0x8 límite térmico)
+THROTTLED_PATH = "/sys/devices/platform/soc/soc:firmware/get_throttled"
+THERMAL_PATH = "/sys/class/thermal/thermal_zone0/temp"
+CPUFREQ_DIR = "/sys/devices/system/cpu/cpu0/cpufreq"
+THROTTLE_ACTIVE_MASK = 0x2 | 0x4 | 0x8
+
+
+def _read_sysfs(path):
+    try:
+        with open(path) as handle:
+            return handle.read().strip()
+    except OSError:
+        return None
+
+
+def read_throttle_state(temp_limit_c=80.0):
+    """Estado de throttling desde sysfs; los campos quedan en None si el archivo no existe"""
+    raw = _read_sysfs(THROTTLED_PATH)
+    flags = int(raw, 16) if raw else None
+    temp = _read_sysfs(THERMAL_PATH)
+    temp_c = int(temp) / 1000.0 if temp and temp.lstrip("-").isdigit() else None
+    current = _read_sysfs(os.path.join(CPUFREQ_DIR, "scaling_cur_freq"))
+    maximum = _read_sysfs(os.path.join(CPUFREQ_DIR, "cpuinfo_max_freq"))
+    freq_ratio = int(current) / float(maximum) if current and maximum and int(maximum) > 0 else None
+    return {
+        "flags": hex(flags) if flags is not None else None,
+        "temp_c": round(temp_c, 1) if temp_c is not None else None,
+        "freq_ratio": round(freq_ratio, 2) if freq_ratio is not None else None,
+        "throttled": bool(flags is not None and flags & THROTTLE_ACTIVE_MASK)
+                     or (temp_c is not None and temp_c >= temp_limit_c)
+    }
+
+
+def model_imgsz(model):
+    """imgsz con que se entrenó un modelo de ultralytics (de sus overrides); None si no lo informa"""
+    imgsz = (getattr(model, "overrides", None) or {}).get("imgsz")
+    if isinstance(imgsz, (list, tuple)):
+        imgsz = max(imgsz) if imgsz else None
+    return int(imgsz) if imgsz else None
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class StageTimer:
+    """Tiempos por etapa de una solicitud: mark(etapa) registra lo transcurrido desde la marca anterior"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.stages = {}
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + (now - self._last) * 1000
+        self._last = now
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+
+class LatencyController:
+    """
+    Mantiene ventanas móviles de latencia por etapa y elige el nivel de calidad.
+
+    Baja un nivel si el p95 del total supera el presupuesto (o si hay throttling y el p50 ya
+    está cerca) y sube uno si el p95 queda bajo up_ratio del presupuesto sin throttling.
+    Tras cada cambio espera un cooldown y vuelve a juntar muestras con el nivel nuevo.
+    """
+
+    def __init__(self, budget_ms=3000, enabled=True, window=50, min_samples=5,
+                 down_cooldown_sec=10.0, up_cooldown_sec=60.0, up_ratio=0.6,
+                 temp_limit_c=80.0, throttle_poll_sec=5.0, base_imgsz=None):
+        self.budget_ms = budget_ms
+        # imgsz del modelo (entero o función que lo entrega); sin él se usa INFERENCE_IMGSZ
+        self.base_imgsz = base_imgsz
+        self.enabled = enabled
+        self.window = window
+        self.min_samples = min_samples
+        self.down_cooldown_sec = down_cooldown_sec
+        self.up_cooldown_sec = up_cooldown_sec
+        self.up_ratio = up_ratio
+        self.temp_limit_c = temp_limit_c
+        self.throttle_poll_sec = throttle_poll_sec
+        self.level = 0
+        self.changes = 0
+        self._samples = {}
+        self._last_change = 0.0
+        self._throttle = None
+        self._throttle_at = 0.0
+        self._lock = threading.Lock()
+
+    def throttle_state(self):
+        now = time.time()
+        if self._throttle is None or now - self._throttle_at >= self.throttle_poll_sec:
+            self._throttle = read_throttle_state(self.temp_limit_c)
+            self._throttle_at = now
+        return self._throttle
+
+    def model_imgsz(self):
+        base = self.base_imgsz() if callable(self.base_imgsz) else self.base_imgsz
+        return base or INFERENCE_CONFIG["imgsz"]
+
+    def current(self):
+        """
+        Parámetros del nivel vigente, ya resueltos. imgsz es None en los
+        niveles a escala 1.0 (se infiere con el tamaño del propio modelo) y, en los demás, una
+        fracción del imgsz del modelo en múltiplos de 32.
+        """
+        with self._lock:
+            index = self.level
+        level = QUALITY_LEVELS[index]
+        imgsz = None
+        if level["imgsz_scale"] < 1.0:
+            imgsz = max(320, int(self.model_imgsz() * level["imgsz_scale"]) // 32 * 32)
+        return {
+            "level": level["name"],
+            "index": index,
+            "imgsz": imgsz,
+            "render": level["render"],
+            "jpeg_quality": level["jpeg_quality"]
+        }
+
+    def observe(self, timer):
+        """Registra los tiempos de una solicitud terminada y ajusta el nivel si corresponde"""
+        total = timer.total_ms()
+        with self._lock:
+            for stage, elapsed in list(timer.stages.items()) + [("total", total)]:
+                self._samples.setdefault(stage, deque(maxlen=self.window)).append(elapsed)
+        if self.enabled:
+            self._adjust()
+        return total
+
+    def _adjust(self):
+        throttled = self.throttle_state()["throttled"]
+        with self._lock:
+            totals = list(self._samples.get("total", ()))
+            if len(totals) < self.min_samples:
+                return
+            p50, p95 = percentile(totals, 0.5), percentile(totals, 0.95)
+            since_change = time.time() - self._last_change
+            new_level = self.level
+            if (p95 > self.budget_ms or (throttled and p50 > 0.8 * self.budget_ms)) \
+                    and self.level < len(QUALITY_LEVELS) - 1 and since_change >= self.down_cooldown_sec:
+                new_level = self.level + 1
+            elif p95 < self.up_ratio * self.budget_ms and not throttled \
+                    and self.level > 0 and since_change >= self.up_cooldown_sec:
+                new_level = self.level - 1
+            if new_level == self.level:
+                return
+            previous, self.level = self.level, new_level
+            self.changes += 1
+            self._last_change = time.time()
+            self._samples.clear()
+        print(f"🎚️ Calidad {QUALITY_LEVELS[previous]['name']} -> {QUALITY_LEVELS[new_level]['name']} "
+              f"(p50={p50:.0f} ms, p95={p95:.0f} ms, presupuesto={self.budget_ms} ms, throttling={throttled})")
+
+    def served(self, quality, timer):
+        """Bloque 'quality' de la respuesta: nivel con que se atendió y tiempos por etapa"""
+        return {
+            "level": quality["level"],
+            "imgsz": quality["imgsz"],
+            "render": quality["render"],
+            "stages_ms": {stage: round(elapsed, 1) for stage, elapsed in timer.stages.items()},
+            "total_ms": round(timer.total_ms(), 1),
+            "budget_ms": self.budget_ms
+        }
+
+    def status(self):
+        with self._lock:
+            stages = {stage: {"p50_ms": round(percentile(list(values), 0.5), 1),
+                              "p95_ms": round(percentile(list(values), 0.95), 1),
+                              "samples": len(values)}
+                      for stage, values in self._samples.items() if values}
+        return {
+            "enabled": self.enabled,
+            "budget_ms": self.budget_ms,
+            "current": self.current(),
+            "changes": self.changes,
+            "stages": stages,
+            "throttle": self.throttle_state()
+        }
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+Script para reconstruir desde cero los rollups diarios del dashboard
+"""
+import argparse
+
+from database import engine, local_engine, create_tables, backfill_zone_counts, rebuild_rollups
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruir daily_rollups desde analysis_results")
+    parser.add_argument('--local', action='store_true', help="Procesar la base SQLite local en vez de la principal")
+    parser.add_argument('--backfill', action='store_true', help="Completar antes analysis_zone_counts")
+    args = parser.parse_args()
+
+    target = local_engine if args.local else engine
+    print("🚀 Reconstrucción de rollups diarios")
+    create_tables()
+    try:
+        if args.backfill:
+            backfill_zone_counts(target)
+        rebuild_rollups(target)
+        print("🎉 Rollups reconstruidos")
+    except Exception as e:
+        print(f"❌ Error reconstruyendo rollups: {e}")
@@ -0,0 +1,160 @@
+"""
+Inferencia en un nodo central: las estaciones envían el frame como JPEG a /api/infer y reciben
+las detecciones como float32 Nx5 (x1, y1, x2, y2, confianza). Si el nodo no responde o su cola
+supera el umbral, la estación usa su modelo local por un tiempo.
+"""
+import http.client
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+import cv2
+import numpy as np
+
+from inference_worker import InferenceResult
+
+DETECTIONS_CONTENT_TYPE = "application/x-detections-f32"
+
+
+class RemoteInferenceUnavailable(Exception):
+    """El nodo central no respondió, rechazó la solicitud o su cola está sobre el umbral"""
+
+
+def boxes_to_array(boxes):
+    """Cajas de ultralytics o CachedBox a float32 Nx5"""
+    if boxes is None or len(boxes) == 0:
+        return np.zeros((0, 5), dtype=np.float32)
+    return np.array([box.xyxy[0].tolist() + [float(box.conf[0])] for box in boxes], dtype=np.float32)
+
+
+def encode_detections(detections):
+    return np.ascontiguousarray(detections, dtype="<f4").tobytes()
+
+
+def decode_detections(body):
+    return np.frombuffer(body, dtype="<f4").reshape(-1, 5)
+
+
+class RemoteInferenceClient:
+    """
+    Sustituto de model.predict para una estación: envía cada imagen al nodo central y, si falla,
+    la infiere con fallback_model. Tras un fallo (o una cola lenta) se queda en local durante
+    cooldown_sec antes de volver a probar el nodo central.
+    """
+
+    def __init__(self, server_url, fallback_model, timeout_sec=5.0, max_queue_ms=1500,
+                 cooldown_sec=30.0, jpeg_quality=90, token=None, station=None):
+        parts = urlsplit(server_url)
+        self.server_url = server_url
+        self.scheme = parts.scheme or "http"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = (parts.path.rstrip("/") or "") + "/api/infer"
+        self.fallback_model = fallback_model
+        self.timeout_sec = timeout_sec
+        self.max_queue_ms = max_queue_ms
+        self.cooldown_sec = cooldown_sec
+        self.jpeg_quality = jpeg_quality
+        self.token = token
+        self.station = station
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._unavailable_until = 0.0
+        self.remote_requests = 0
+        self.local_requests = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_queue_ms = None
+        self.last_remote_ms = None
+
+    def _connection(self):
+        # Una conexión persistente por hilo (http.client no es seguro entre hilos)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            conn = cls(self.host, self.port, timeout=self.timeout_sec)
+            self._local.conn = conn
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+        self._local.conn = None
+
+    def remote_available(self):
+        return time.time() >= self._unavailable_until
+
+    def _mark_unavailable(self, reason):
+        with self._lock:
+            self.failures += 1
+            self.last_error = reason
+            self._unavailable_until = time.time() + self.cooldown_sec
+        print(f"⚠️ Nodo de inferencia central no disponible ({reason}); inferencia local por {self.cooldown_sec:.0f} s")
+
+    def _infer_remote(self, image, conf, imgsz, profile=None, distribucion=None):
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise RemoteInferenceUnavailable("no se pudo codificar la imagen")
+        params = {"conf": conf}
+        if imgsz:
+            params["imgsz"] = int(imgsz)
+        for key, value in (("profile", profile), ("distribucion", distribucion), ("station", self.station)):
+            if value:
+                params[key] = value
+        headers = {"Content-Type": "image/jpeg", "Accept": DETECTIONS_CONTENT_TYPE}
+        if self.token:
+            headers["X-Inference-Token"] = self.token
+
+        start = time.time()
+        try:
+            conn = self._connection()
+            conn.request("POST", f"{self.path}?{urlencode(params)}", body=encoded.tobytes(), headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self._drop_connection()
+            raise RemoteInferenceUnavailable(f"sin conexión: {e}")
+
+        if response.status != 200:
+            retry_after = response.getheader("Retry-After")
+            raise RemoteInferenceUnavailable(f"HTTP {response.status}" +
+                                             (f", Retry-After {retry_after} s" if retry_after else ""))
+
+        queue_ms = float(response.getheader("X-Queue-Ms", 0) or 0)
+        self.last_queue_ms = queue_ms
+        self.last_remote_ms = round((time.time() - start) * 1000, 1)
+        if self.max_queue_ms and queue_ms > self.max_queue_ms:
+            # Esta respuesta sirve, pero las siguientes se infieren en local hasta que baje la cola
+            self._mark_unavailable(f"cola de {queue_ms:.0f} ms sobre el umbral de {self.max_queue_ms} ms")
+        return decode_detections(body)
+
+    def predict(self, source, conf=0.25, verbose=False, imgsz=None, profile=None, distribucion=None):
+        """Misma forma que model.predict: una imagen o una lista de recortes, una respuesta por imagen"""
+        images = source if isinstance(source, (list, tuple)) else [source]
+        if self.remote_available():
+            try:
+                results = [InferenceResult(self._infer_remote(image, conf, imgsz, profile, distribucion))
+                           for image in images]
+                self.remote_requests += 1
+                return results
+            except RemoteInferenceUnavailable as e:
+                self._mark_unavailable(str(e))
+
+        self.local_requests += 1
+        options = {"imgsz": imgsz} if imgsz else {}
+        return self.fallback_model.predict(source, conf=conf, verbose=verbose, **options)
+
+    def status(self):
+        return {
+            "server_url": self.server_url,
+            "remote_available": self.remote_available(),
+            "retry_remote_in_sec": max(0.0, round(self._unavailable_until - time.time(), 1)),
+            "remote_requests": self.remote_requests,
+            "local_requests": self.local_requests,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_queue_ms": self.last_queue_ms,
+            "last_remote_ms": self.last_remote_ms,
+            "max_queue_ms": self.max_queue_ms
+        }
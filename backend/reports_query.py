@@ -0,0 +1,216 @@
+"""
+Constructor de consultas de informes: filtros compartidos, paginación por cursor y total en caché
+"""
+import base64
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Columnas de la tabla de informes
+REPORT_COLUMNS = [
+    "id", "timestamp", "user_name", "analysis_type", "profile", "distribucion",
+    "guia_sii", "lote", "num_frutos", "num_proceso", "id_caja", "total_detections",
+    "zones_analyzed", "confidence_used", "processed_image_path", "results_json"
+]
+
+# Columnas del export CSV
+EXPORT_COLUMNS = [
+    "id", "timestamp", "user_name", "analysis_type", "profile", "distribucion",
+    "guia_sii", "lote", "num_frutos", "total_detections", "zones_analyzed", "confidence_used"
+]
+
+# Agrupaciones permitidas en /api/reports/aggregate (expresión SQL válida en PostgreSQL y SQLite)
+AGGREGATE_GROUPS = {
+    "day": "DATE(analysis_results.timestamp)",
+    "lote": "analysis_results.lote",
+    "guia_sii": "analysis_results.guia_sii",
+    "profile": "analysis_results.profile",
+    "distribucion": "analysis_results.distribucion",
+}
+
+# Sobre este número de filas sin filtros se usa la estimación de PostgreSQL en vez de COUNT(*)
+ESTIMATE_THRESHOLD = 100000
+
+
+def encode_cursor(timestamp, analysis_id):
+    """Cursor opaco con (timestamp, id) de la última fila entregada"""
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.isoformat(sep=' ')
+    raw = json.dumps([str(timestamp), int(analysis_id)])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Devuelve (timestamp, id) o None si el cursor no es válido"""
+    try:
+        timestamp, analysis_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(timestamp), int(analysis_id)
+    except (ValueError, TypeError, UnicodeError):
+        return None
+
+
+def format_row_dates(rows):
+    """Convierte fechas a 'YYYY-MM-DD HH:MM:SS' para la respuesta JSON"""
+    for row in rows:
+        value = row.get('timestamp')
+        if isinstance(value, datetime):
+            row['timestamp'] = value.strftime('%Y-%m-%d %H:%M:%S')
+        elif isinstance(value, str) and len(value) > 19:
+            row['timestamp'] = value[:19]
+    return rows
+
+
+class ReportQuery:
+    """Filtros de informes traducidos a SQL parametrizado (un solo builder para datos y export)"""
+
+    def __init__(self, analysis_type=None, distribution=None, start_date=None, end_date=None, placeholder='?',
+                 results_from='analysis_results', zones_from='analysis_zone_counts'):
+        """results_from / zones_from permiten leer otras tablas con el mismo esquema (p. ej. la réplica local con alias)"""
+        self.analysis_type = analysis_type if analysis_type and analysis_type != 'all' else None
+        self.distribution = distribution if distribution and distribution != 'all' else None
+        self.start = self._parse_date(start_date)
+        self.end = self._parse_date(end_date)
+        if self.end is not None:
+            self.end += timedelta(days=1)
+        self.placeholder = placeholder
+        self.results_from = results_from
+        self.zones_from = zones_from
+
+    @classmethod
+    def from_args(cls, args, placeholder='?', **tables):
+        return cls(
+            analysis_type=args.get('analysis_type'),
+            distribution=args.get('distribution'),
+            start_date=args.get('start_date'),
+            end_date=args.get('end_date'),
+            placeholder=placeholder,
+            **tables
+        )
+
+    @staticmethod
+    def _parse_date(value):
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            return None
+
+    @property
+    def has_filters(self):
+        return any(v is not None for v in (self.analysis_type, self.distribution, self.start, self.end))
+
+    def where(self):
+        """Cláusula WHERE y parámetros; el orden de las condiciones calza con los índices compuestos"""
+        p = self.placeholder
+        clauses = []
+        params = []
+        if self.analysis_type:
+            clauses.append(f"analysis_type = {p}")
+            params.append(self.analysis_type)
+        if self.distribution:
+            clauses.append(f"distribucion = {p}")
+            params.append(self.distribution)
+        if self.start is not None:
+            clauses.append(f"timestamp >= {p}")
+            params.append(self.start.strftime('%Y-%m-%d 00:00:00'))
+        if self.end is not None:
+            clauses.append(f"timestamp < {p}")
+            params.append(self.end.strftime('%Y-%m-%d 00:00:00'))
+        sql = " WHERE " + " AND ".join(clauses) if clauses else ""
+        return sql, params
+
+    def count_sql(self):
+        where, params = self.where()
+        return f"SELECT COUNT(*) AS total FROM {self.results_from}" + where, params
+
+    def page_sql(self, columns, per_page, cursor=None, offset=0):
+        """
+        Página ordenada por (timestamp, id) descendente. Con cursor usa keyset (sin OFFSET);
+        sin cursor acepta OFFSET para compatibilidad con la paginación por número de página.
+        Pide una fila extra para saber si hay página siguiente.
+        """
+        p = self.placeholder
+        where, params = self.where()
+        if cursor is not None:
+            timestamp, analysis_id = cursor
+            keyset = f"(timestamp < {p} OR (timestamp = {p} AND id < {p}))"
+            where = (where + " AND " if where else " WHERE ") + keyset
+            params = params + [timestamp, timestamp, analysis_id]
+            offset = 0
+        sql = (
+            f"SELECT {', '.join(columns)} FROM {self.results_from}" + where +
+            f" ORDER BY timestamp DESC, id DESC LIMIT {int(per_page) + 1}"
+        )
+        if offset:
+            sql += f" OFFSET {int(offset)}"
+        return sql, params
+
+    def export_sql(self, columns):
+        where, params = self.where()
+        return f"SELECT {', '.join(columns)} FROM {self.results_from}" + where + " ORDER BY timestamp DESC, id DESC", params
+
+    def zone_names_sql(self):
+        """Zonas con conteos dentro de los filtros (columnas extra del export por zona)"""
+        where, params = self.where()
+        sql = (
+            f"SELECT DISTINCT analysis_zone_counts.zone_name AS zone_name FROM {self.results_from} "
+            f"JOIN {self.zones_from} ON analysis_zone_counts.analysis_id = analysis_results.id" + where +
+            " ORDER BY zone_name"
+        )
+        return sql, params
+
+    def aggregate_sql(self, group_by, limit=500):
+        """Análisis y frutos por grupo (sin unir conteos para no multiplicar num_frutos)"""
+        group = AGGREGATE_GROUPS[group_by]
+        where, params = self.where()
+        order = "grupo DESC" if group_by == "day" else "analyses DESC, grupo"
+        sql = (
+            f"SELECT {group} AS grupo, COUNT(*) AS analyses, SUM(num_frutos) AS fruits, "
+            f"SUM(total_detections) AS defects FROM {self.results_from}" + where +
+            f" GROUP BY {group} ORDER BY {order} LIMIT {int(limit)}"
+        )
+        return sql, params
+
+    def aggregate_zones_sql(self, group_by, zone=None):
+        """Defectos por grupo y zona desde analysis_zone_counts"""
+        group = AGGREGATE_GROUPS[group_by]
+        where, params = self.where()
+        if zone:
+            where = (where + " AND " if where else " WHERE ") + f"analysis_zone_counts.zone_name = {self.placeholder}"
+            params = params + [zone]
+        sql = (
+            f"SELECT {group} AS grupo, analysis_zone_counts.zone_name AS zone_name, "
+            f"SUM(analysis_zone_counts.count) AS defects FROM {self.results_from} "
+            f"JOIN {self.zones_from} ON analysis_zone_counts.analysis_id = analysis_results.id" + where +
+            f" GROUP BY {group}, analysis_zone_counts.zone_name"
+        )
+        return sql, params
+
+
+class CountCache:
+    """Total de filas por combinación de filtros, en memoria con TTL corto"""
+
+    def __init__(self, ttl_sec=30.0, max_entries=128):
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and now - entry[0] < self.ttl_sec:
+            return entry[1]
+        value = loader()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (now, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
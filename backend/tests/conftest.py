@@ -0,0 +1,13 @@
+"""
+Configuración común de las pruebas: backend en sys.path y base principal en SQLite en memoria
+(database.py crea sus engines al importarse; el caché local queda en un directorio temporal)
+"""
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.chdir(tempfile.mkdtemp(prefix="appdefectos-tests-"))
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from admission import (
+    AdmissionController, AdmissionRejected, PRIORITY_BATCH, PRIORITY_INTERACTIVE, PRIORITY_MONITORING
+)
+
+
+def wait_queued(controller, count, timeout=2.0):
+    deadline = time.time() + timeout
+    while sum(controller.status()["queued"].values()) < count:
+        assert time.time() < deadline, "la solicitud no llegó a la cola"
+        time.sleep(0.005)
+
+
+def acquire_in_thread(controller, priority, admitted, errors):
+    def run():
+        try:
+            controller.acquire(priority)
+            admitted.append(priority)
+        except AdmissionRejected as e:
+            errors.append(e)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_admits_up_to_max_concurrent_without_queueing():
+    controller = AdmissionController(max_concurrent=2, max_queue=0)
+    controller.acquire()
+    controller.acquire()
+    assert controller.status()["running"] == 2
+    with pytest.raises(AdmissionRejected) as error:
+        controller.acquire()
+    assert error.value.status_code == 429
+    assert error.value.retry_after >= 1
+
+
+def test_release_admits_next_waiter():
+    controller = AdmissionController(max_concurrent=1, max_queue=2, queue_timeout_sec=5)
+    controller.acquire()
+    admitted, errors = [], []
+    thread = acquire_in_thread(controller, PRIORITY_INTERACTIVE, admitted, errors)
+    wait_queued(controller, 1)
+    controller.release(0.1)
+    thread.join(2)
+    assert admitted == [PRIORITY_INTERACTIVE] and not errors
+    assert controller.status()["running"] == 1
+
+
+def test_interactive_is_admitted_before_earlier_low_priority():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout_sec=5)
+    controller.acquire()
+    admitted, errors = [], []
+    threads = [acquire_in_thread(controller, PRIORITY_BATCH, admitted, errors)]
+    wait_queued(controller, 1)
+    threads.append(acquire_in_thread(controller, PRIORITY_MONITORING, admitted, errors))
+    wait_queued(controller, 2)
+    threads.append(acquire_in_thread(controller, PRIORITY_INTERACTIVE, admitted, errors))
+    wait_queued(controller, 3)
+
+    for expected in range(1, 4):
+        controller.release()
+        deadline = time.time() + 2
+        while len(admitted) < expected and time.time() < deadline:
+            time.sleep(0.005)
+    for thread in threads:
+        thread.join(2)
+    assert admitted == [PRIORITY_INTERACTIVE, PRIORITY_MONITORING, PRIORITY_BATCH]
+    assert not errors
+
+
+def test_low_priority_only_uses_its_share_of_the_queue():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout_sec=5,
+                                     low_priority_queue_share=0.5)
+    controller.acquire()
+    admitted, errors = [], []
+    threads = [acquire_in_thread(controller, PRIORITY_MONITORING, admitted, errors) for _ in range(2)]
+    wait_queued(controller, 2)
+
+    with pytest.raises(AdmissionRejected) as error:
+        controller.acquire(PRIORITY_BATCH)
+    assert error.value.status_code == 429
+    assert controller.status()["rejected"][PRIORITY_BATCH] == 1
+
+    threads.append(acquire_in_thread(controller, PRIORITY_INTERACTIVE, admitted, errors))
+    wait_queued(controller, 3)
+    assert controller.status()["queued"][PRIORITY_INTERACTIVE] == 1
+
+    controller.release()
+    deadline = time.time() + 2
+    while not admitted and time.time() < deadline:
+        time.sleep(0.005)
+    assert admitted == [PRIORITY_INTERACTIVE]
+    controller.release()
+    controller.release()
+    for thread in threads:
+        thread.join(2)
+    assert len(admitted) == 3 and not errors
+
+
+def test_wait_timeout_returns_503_and_leaves_the_queue():
+    controller = AdmissionController(max_concurrent=1, max_queue=2, queue_timeout_sec=0.05)
+    controller.acquire()
+    with pytest.raises(AdmissionRejected) as error:
+        controller.acquire(PRIORITY_MONITORING)
+    assert error.value.status_code == 503
+    status = controller.status()
+    assert sum(status["queued"].values()) == 0
+    assert status["timed_out"][PRIORITY_MONITORING] == 1
+
+
+def test_unknown_priority_counts_as_interactive():
+    controller = AdmissionController(max_concurrent=1)
+    with controller.slot("urgente"):
+        assert controller.status()["admitted"][PRIORITY_INTERACTIVE] == 1
+    assert controller.status()["running"] == 0
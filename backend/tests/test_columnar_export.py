@@ -0,0 +1,57 @@
+import json
+from datetime import datetime
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from columnar_export import ChunkSink, iter_columnar  # noqa: E402
+
+
+def make_rows(count):
+    return [
+        (index, datetime(2026, 3, 1, 8, 0, index), "operador", "qc", "qc_recepcion", "A",
+         f"G{index % 2}", "L1", 50, index, 3, 0.8, json.dumps({"Zona 1": index, "Zona 2": "x"}))
+        for index in range(count)
+    ]
+
+
+def test_chunk_sink_accumulates_and_drains():
+    sink = ChunkSink()
+    assert sink.write(b"abc") == 3
+    assert sink.write(bytearray(b"de")) == 2
+    assert sink.tell() == 5
+    assert sink.drain() == b"abcde"
+    assert sink.drain() == b""
+    assert sink.tell() == 5
+    sink.close()
+    assert sink.closed
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_round_trip_in_several_batches(fmt):
+    rows = make_rows(5)
+    chunks = list(iter_columnar(iter(rows), fmt, ["Zona 1", "Zona 2"], batch_rows=2))
+    assert len(chunks) >= 3
+    data = b"".join(chunks)
+
+    if fmt == "parquet":
+        table = pq.read_table(pa.BufferReader(data))
+    else:
+        table = pa.ipc.open_stream(data).read_all()
+
+    assert table.num_rows == 5
+    assert table.column("id").to_pylist() == [0, 1, 2, 3, 4]
+    assert table.column("Zona 1").to_pylist() == [0, 1, 2, 3, 4]
+    # Valores no numéricos del results_json quedan nulos
+    assert table.column("Zona 2").to_pylist() == [None] * 5
+    assert table.column("timestamp").to_pylist()[1] == datetime(2026, 3, 1, 8, 0, 1)
+    assert [str(v) for v in table.column("guia_sii").to_pylist()] == ["G0", "G1", "G0", "G1", "G0"]
+
+
+def test_empty_export_still_has_schema():
+    data = b"".join(iter_columnar(iter([]), "arrow", ["Zona 1"]))
+    table = pa.ipc.open_stream(data).read_all()
+    assert table.num_rows == 0
+    assert "Zona 1" in table.schema.names
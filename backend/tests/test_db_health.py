@@ -0,0 +1,98 @@
+import time
+from contextlib import contextmanager
+
+from db_health import CircuitBreaker, STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN
+
+
+class FakeEngine:
+    """Engine mínimo para probe(): connect() falla mientras healthy sea False"""
+
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.connects = 0
+
+    @contextmanager
+    def connect(self):
+        self.connects += 1
+        if not self.healthy:
+            raise ConnectionError("connection refused\ndetalle")
+        yield self
+
+    def execute(self, statement):
+        return None
+
+
+def test_starts_closed_and_opens_after_threshold():
+    breaker = CircuitBreaker(FakeEngine(), failure_threshold=2)
+    assert breaker.state == STATE_CLOSED and breaker.allow_request()
+
+    breaker.record_failure(ConnectionError("timeout"))
+    assert breaker.state == STATE_CLOSED
+
+    breaker.record_failure(ConnectionError("timeout"))
+    assert breaker.state == STATE_OPEN
+    assert not breaker.allow_request()
+    assert breaker.last_error == "timeout"
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(FakeEngine(), failure_threshold=2)
+    breaker.record_failure(ConnectionError("timeout"))
+    breaker.record_success()
+    breaker.record_failure(ConnectionError("timeout"))
+    assert breaker.state == STATE_CLOSED
+
+
+def test_probe_waits_for_cooldown_then_closes():
+    engine = FakeEngine(healthy=False)
+    breaker = CircuitBreaker(engine, failure_threshold=1, cooldown_sec=60)
+    assert not breaker.probe()
+    assert breaker.state == STATE_OPEN
+    assert breaker.last_error == "connection refused"
+
+    # Antes del enfriamiento sigue abierto aunque la base vuelva
+    engine.healthy = True
+    opened_at = breaker.opened_at
+    assert breaker.probe()
+    assert breaker.state == STATE_CLOSED
+    assert opened_at is not None and breaker.opened_at is None
+
+
+def test_half_open_failure_reopens_immediately():
+    engine = FakeEngine(healthy=False)
+    breaker = CircuitBreaker(engine, failure_threshold=3, cooldown_sec=10)
+    breaker.state = STATE_OPEN
+    breaker.opened_at = time.time() - 11
+
+    assert not breaker.probe()
+    assert breaker.state == STATE_OPEN
+    assert time.time() - breaker.opened_at < 1
+
+
+def test_cooldown_moves_open_to_half_open_before_probing():
+    states = []
+
+    class RecordingEngine(FakeEngine):
+        @contextmanager
+        def connect(self):
+            states.append(breaker.state)
+            with super().connect() as conn:
+                yield conn
+
+    breaker = CircuitBreaker(RecordingEngine(), cooldown_sec=10)
+    breaker.state = STATE_OPEN
+    breaker.opened_at = time.time() - 11
+    assert breaker.probe()
+    assert states == [STATE_HALF_OPEN]
+    assert breaker.state == STATE_CLOSED
+
+
+def test_start_opens_at_once_when_initial_probe_fails():
+    breaker = CircuitBreaker(FakeEngine(healthy=False), failure_threshold=5, probe_interval_sec=60)
+    try:
+        breaker.start()
+        assert breaker.state == STATE_OPEN
+        assert not breaker.allow_request()
+        assert breaker.snapshot()["open_for_sec"] is not None
+    finally:
+        breaker.stop()
@@ -0,0 +1,117 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import history_service
+from history_service import (
+    SOURCE_LOCAL, SOURCE_PRIMARY, decode_history_cursor, encode_history_cursor, get_federated_history
+)
+
+BASE = datetime(2026, 3, 1, 8, 0, 0)
+
+
+def item(source, item_id, second, key=None):
+    return {
+        "source": source,
+        "id": item_id,
+        "timestamp": (BASE + timedelta(seconds=second)).strftime("%Y-%m-%d %H:%M:%S"),
+        "idempotency_key": key,
+    }
+
+
+@pytest.fixture
+def sources(monkeypatch):
+    """Orígenes en memoria con la misma paginación que _read_primary / _read_local"""
+    data = {"primary": [], "local": []}
+
+    def read_primary(limit, user_name, analysis_type, after=None, since=None, replica_only=False):
+        rows = sorted(data["primary"], key=lambda row: (row["timestamp"], row["id"]), reverse=True)
+        if after is not None:
+            rows = [row for row in rows if (row["timestamp"], row["id"]) < (after[0], after[1])]
+        return rows[:limit]
+
+    def read_local(limit, user_name, analysis_type, include_synced, after_id=None, since=None):
+        rows = sorted(data["local"], key=lambda row: row["id"], reverse=True)
+        if after_id is not None:
+            rows = [row for row in rows if row["id"] < after_id]
+        return rows[:limit]
+
+    monkeypatch.setattr(history_service, "_read_primary", read_primary)
+    monkeypatch.setattr(history_service, "_read_local", read_local)
+    monkeypatch.setattr(history_service, "is_db_available", lambda: True)
+    return data
+
+
+def page(limit, cursor=None):
+    return get_federated_history(limit=limit, cursor=decode_history_cursor(cursor) if cursor else None)
+
+
+def ids(result):
+    return [(row["source"], row["id"]) for row in result["history"]]
+
+
+def test_merges_by_timestamp_and_prefers_primary_rows(sources):
+    sources["primary"] = [item(SOURCE_PRIMARY, 10, 50, "a"), item(SOURCE_PRIMARY, 9, 30, "b")]
+    sources["local"] = [item(SOURCE_LOCAL, 3, 40, "c"), item(SOURCE_LOCAL, 2, 29, "b")]
+
+    result = page(10)
+    assert ids(result) == [(SOURCE_PRIMARY, 10), (SOURCE_LOCAL, 3), (SOURCE_PRIMARY, 9)]
+    assert result["has_more"] is False and result["next_cursor"] is None
+    assert result["sources"] == {SOURCE_PRIMARY: "ok", SOURCE_LOCAL: "ok"}
+
+
+def test_only_duplicates_left_means_no_more_pages(sources):
+    sources["primary"] = [item(SOURCE_PRIMARY, 10, 50, "a"), item(SOURCE_PRIMARY, 9, 40, "b")]
+    sources["local"] = [item(SOURCE_LOCAL, 5, 45, "a"), item(SOURCE_LOCAL, 4, 35, "b")]
+
+    result = page(2)
+    assert ids(result) == [(SOURCE_PRIMARY, 10), (SOURCE_PRIMARY, 9)]
+    assert result["has_more"] is False
+
+
+def test_pages_cover_every_row_once(sources):
+    sources["primary"] = [item(SOURCE_PRIMARY, 100 + n, 2 * n, f"k{n}") for n in range(12)]
+    # Locales: unos sin subir y otros duplicados de filas ya presentes en la base principal
+    sources["local"] = [item(SOURCE_LOCAL, n + 1, 2 * n + 1, None if n % 3 else f"k{n}") for n in range(9)]
+    expected = len(sources["primary"]) + sum(1 for row in sources["local"] if row["idempotency_key"] is None)
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        result = page(4, cursor)
+        seen.extend(ids(result))
+        pages += 1
+        assert pages < 20
+        if not result["has_more"]:
+            assert result["next_cursor"] is None
+            break
+        cursor = result["next_cursor"]
+        assert len(result["history"]) == 4
+
+    assert len(seen) == len(set(seen)) == expected
+    # Orden global por timestamp descendente a través de las páginas
+    all_rows = {(row["source"], row["id"]): row["timestamp"] for row in sources["primary"] + sources["local"]}
+    ordered = [all_rows[key] for key in seen]
+    assert ordered == sorted(ordered, reverse=True)
+
+
+def test_primary_timeout_falls_back_to_local(sources, monkeypatch):
+    def slow_primary(*args, **kwargs):
+        time.sleep(0.3)
+        return []
+
+    monkeypatch.setattr(history_service, "_read_primary", slow_primary)
+    monkeypatch.setattr(history_service, "HISTORY_PRIMARY_TIMEOUT_SEC", 0.05)
+    sources["local"] = [item(SOURCE_LOCAL, 1, 10)]
+
+    result = page(5)
+    assert ids(result) == [(SOURCE_LOCAL, 1)]
+    assert result["sources"][SOURCE_PRIMARY] == "timeout"
+
+
+def test_history_cursor_round_trip_and_invalid_input():
+    state = {"p": ["2026-03-01 08:00:05", 7], "l": 3}
+    assert decode_history_cursor(encode_history_cursor(state)) == state
+    assert decode_history_cursor(encode_history_cursor({"p": None, "l": None})) == {"p": None, "l": None}
+    for cursor in ("", "%%%", encode_history_cursor({"p": ["x"], "l": 1}), encode_history_cursor([1])):
+        assert decode_history_cursor(cursor) is None
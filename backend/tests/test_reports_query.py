@@ -0,0 +1,33 @@
+from datetime import datetime
+
+from reports_query import ReportQuery, decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip_with_datetime_and_string():
+    assert decode_cursor(encode_cursor(datetime(2026, 3, 1, 8, 30, 5), 42)) == ("2026-03-01 08:30:05", 42)
+    assert decode_cursor(encode_cursor("2026-03-01 08:30:05.123456", "7")) == ("2026-03-01 08:30:05.123456", 7)
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor("2026-03-01 08:30:05", 10 ** 12)
+    assert set(cursor) <= set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_=")
+
+
+def test_invalid_cursors_decode_to_none():
+    for cursor in ("", "no-es-base64!", encode_cursor("x", 1)[:-4], "W10=", "eyJhIjogMX0=", "WyJ4IiwgImEiXQ=="):
+        assert decode_cursor(cursor) is None
+
+
+def test_keyset_page_uses_cursor_and_drops_offset():
+    query = ReportQuery(analysis_type="qc", start_date="2026-03-01", placeholder="%s")
+    sql, params = query.page_sql(["id", "timestamp"], 10, ("2026-03-05 10:00:00", 99), offset=30)
+    assert "(timestamp < %s OR (timestamp = %s AND id < %s))" in sql
+    assert "OFFSET" not in sql and sql.endswith("LIMIT 11")
+    assert params == ["qc", "2026-03-01 00:00:00", "2026-03-05 10:00:00", "2026-03-05 10:00:00", 99]
+
+
+def test_end_date_is_exclusive_next_day():
+    query = ReportQuery(end_date="2026-03-31")
+    sql, params = query.count_sql()
+    assert sql.endswith("WHERE timestamp < ?")
+    assert params == ["2026-04-01 00:00:00"]
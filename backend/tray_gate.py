@@ -0,0 +1,190 @@
+"""
+Filtro previo a la inferencia: detecta bandejas vacías, cámara obstruida o mala exposición
+"""
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+REFERENCES_DIR = "references"
+
+# Estados posibles del frame
+STATUS_OK = "ok"
+STATUS_EMPTY = "empty"
+STATUS_OBSTRUCTED = "obstructed"
+STATUS_BAD_EXPOSURE = "bad_exposure"
+
+STATUS_MESSAGES = {
+    STATUS_EMPTY: "Bandeja vacía: no se detecta fruta en las zonas",
+    STATUS_OBSTRUCTED: "Cámara obstruida o bandeja fuera de posición",
+    STATUS_BAD_EXPOSURE: "Imagen demasiado oscura o sobreexpuesta",
+}
+
+
+def reference_path(profile, distribucion):
+    """Ruta de la imagen de referencia de bandeja vacía para un perfil y distribución"""
+    return os.path.join(REFERENCES_DIR, f"empty_{profile}_{distribucion}.jpg")
+
+
+class TrayGate:
+    """
+    Clasifica un frame como vacío, obstruido, mal expuesto o analizable en pocos milisegundos,
+    usando estadísticas de color por zona sobre una versión reducida del frame y comparándolas
+    con una imagen de bandeja vacía por perfil.
+    """
+
+    def __init__(self, small_size=(192, 108), zones_reference_size=(1920, 1080),
+                 dark_level=20, bright_level=245, clipped_ratio=0.6,
+                 occupancy_delta=18.0, empty_zone_ratio=0.1,
+                 obstruction_delta=35.0, obstruction_ratio=0.5, min_sharpness=15.0):
+        self.small_size = small_size
+        self.zones_reference_size = zones_reference_size
+        self.dark_level = dark_level
+        self.bright_level = bright_level
+        self.clipped_ratio = clipped_ratio
+        self.occupancy_delta = occupancy_delta
+        self.empty_zone_ratio = empty_zone_ratio
+        self.obstruction_delta = obstruction_delta
+        self.obstruction_ratio = obstruction_ratio
+        self.min_sharpness = min_sharpness
+        self._references = {}
+        self._masks = {}
+        self._lock = threading.Lock()
+
+    def _downsample(self, img):
+        # Saltar píxeles primero para que frames de 12 MP no paguen un resize completo
+        height, width = img.shape[:2]
+        step = max(1, min(width // (self.small_size[0] * 4), height // (self.small_size[1] * 4)))
+        if step > 1:
+            img = img[::step, ::step]
+        return cv2.resize(img, self.small_size, interpolation=cv2.INTER_AREA)
+
+    def _zone_masks(self, zones):
+        key = tuple((name, tuple(map(tuple, poly))) for name, poly in zones.items())
+        with self._lock:
+            cached = self._masks.get(key)
+        if cached is not None:
+            return cached
+
+        scale_x = self.small_size[0] / self.zones_reference_size[0]
+        scale_y = self.small_size[1] / self.zones_reference_size[1]
+        masks = {}
+        union = np.zeros((self.small_size[1], self.small_size[0]), dtype=np.uint8)
+        for zone_name, poly in zones.items():
+            mask = np.zeros_like(union)
+            pts = np.array([[int(x * scale_x), int(y * scale_y)] for x, y in poly], np.int32)
+            cv2.fillPoly(mask, [pts], 255)
+            masks[zone_name] = mask > 0
+            union |= mask
+        result = (masks, union == 0)
+        with self._lock:
+            if len(self._masks) > 32:
+                self._masks.clear()
+            self._masks[key] = result
+        return result
+
+    def _reference(self, profile, distribucion):
+        """Imagen de referencia reducida en Lab, recargada solo si el archivo cambió"""
+        path = reference_path(profile, distribucion)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        with self._lock:
+            cached = self._references.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        ref_img = cv2.imread(path)
+        if ref_img is None:
+            return None
+        ref_lab = cv2.cvtColor(self._downsample(ref_img), cv2.COLOR_BGR2LAB).astype(np.float32)
+        with self._lock:
+            self._references[path] = (mtime, ref_lab)
+        print(f"🧾 Referencia de bandeja vacía cargada: {path}")
+        return ref_lab
+
+    def invalidate(self, profile=None, distribucion=None):
+        with self._lock:
+            if profile is None:
+                self._references.clear()
+            else:
+                self._references.pop(reference_path(profile, distribucion), None)
+
+    def classify(self, img, zones, profile, distribucion):
+        """
+        Clasifica el frame antes de la inferencia.
+
+        Sin imagen de referencia solo la exposición puede marcar el frame como no analizable; un
+        frame poco nítido se informa en "warning" pero se infiere igual (fruta lisa sobre fondo
+        uniforme también tiene poca textura).
+
+        Returns:
+            dict: {"status", "message", "warning", "zones_occupied", "metrics", "elapsed_ms"}
+        """
+        start = time.time()
+        small = self._downsample(img)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        mean_luma = float(gray.mean())
+        dark_ratio = float((gray < self.dark_level).mean())
+        bright_ratio = float((gray > self.bright_level).mean())
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+        metrics = {
+            "mean_luma": round(mean_luma, 1),
+            "dark_ratio": round(dark_ratio, 3),
+            "bright_ratio": round(bright_ratio, 3),
+            "sharpness": round(sharpness, 1),
+            "reference": False
+        }
+        status = STATUS_OK
+        warning = None
+        zones_occupied = None
+
+        if dark_ratio > self.clipped_ratio or bright_ratio > self.clipped_ratio:
+            status = STATUS_BAD_EXPOSURE
+        else:
+            masks, outside = self._zone_masks(zones)
+            ref_lab = self._reference(profile, distribucion)
+            if ref_lab is not None:
+                metrics["reference"] = True
+                lab = cv2.cvtColor(small, cv2.COLOR_BGR2LAB).astype(np.float32)
+                delta = np.linalg.norm(lab - ref_lab, axis=2)
+
+                zones_occupied = []
+                for zone_name, mask in masks.items():
+                    if mask.any() and float(delta[mask].mean()) > self.occupancy_delta:
+                        zones_occupied.append(zone_name)
+
+                # Lo que está fuera de las zonas (borde de la bandeja) no debería cambiar
+                outside_changed = float((delta[outside] > self.obstruction_delta).mean()) if outside.any() else 0.0
+                metrics["outside_changed_ratio"] = round(outside_changed, 3)
+                metrics["occupied_ratio"] = round(len(zones_occupied) / max(1, len(masks)), 3)
+
+                if outside_changed > self.obstruction_ratio:
+                    status = STATUS_OBSTRUCTED
+                elif len(zones_occupied) <= self.empty_zone_ratio * len(masks):
+                    status = STATUS_EMPTY
+
+            if status == STATUS_OK and sharpness < self.min_sharpness:
+                # Una mano sobre el lente produce un frame casi sin textura; sin referencia no se
+                # distingue de una bandeja lisa, así que solo se advierte
+                if ref_lab is not None:
+                    status = STATUS_OBSTRUCTED
+                else:
+                    warning = "Imagen con poca nitidez: revisar que la cámara no esté obstruida"
+
+        result = {
+            "status": status,
+            "message": STATUS_MESSAGES.get(status, "Imagen analizable"),
+            "warning": warning,
+            "zones_occupied": zones_occupied,
+            "metrics": metrics,
+            "elapsed_ms": round((time.time() - start) * 1000, 2)
+        }
+        print(f"🚦 Filtro de bandeja: {status} ({result['elapsed_ms']} ms)")
+        return result
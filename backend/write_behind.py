@@ -0,0 +1,93 @@
+"""
+Persistencia write-behind: el análisis se guarda primero en SQLite local y un hilo lo sube a PostgreSQL
+"""
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from database import save_to_local_cache, sync_pending_data, get_queue_stats
+
+
+class WriteBehindWriter:
+    """
+    Encola cada resultado de forma durable en el caché local (SQLite) y responde de inmediato.
+    Un hilo en segundo plano sube los pendientes a la base principal en lotes agrupados,
+    en orden de llegada y con idempotency_key para que los reintentos no dupliquen filas.
+    """
+
+    def __init__(self, interval_sec=2.0, batch_size=200, max_backoff_sec=300.0):
+        self.interval_sec = interval_sec
+        self.batch_size = batch_size
+        self.max_backoff_sec = max_backoff_sec
+        self.current_backoff_sec = interval_sec
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self.last_flush_at = None
+        self.last_error = None
+        self.flushed_total = 0
+
+    def start(self):
+        """Inicia el hilo de escritura (idempotente)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        print("🧵 Escritor write-behind iniciado")
+
+    def enqueue(self, analysis_data, form_data, results_data):
+        """
+        Guarda el resultado en la cola local y despierta al escritor.
+
+        Returns:
+            tuple: (ID en caché local o None, idempotency_key)
+        """
+        idempotency_key = str(uuid.uuid4())
+        cache_id, _ = save_to_local_cache(analysis_data, form_data, results_data, idempotency_key)
+        if cache_id is not None:
+            self._wake.set()
+        return cache_id, idempotency_key
+
+    def flush(self, sync_type='automatic'):
+        """Sube todo lo pendiente; serializado para no competir con sincronizaciones manuales"""
+        with self._flush_lock:
+            result = sync_pending_data(self.batch_size, sync_type)
+            self.last_flush_at = datetime.utcnow()
+            self.flushed_total += result.get("synced", 0)
+            self.last_error = result["message"] if result.get("errors") else None
+            return result
+
+    def _run(self):
+        while True:
+            # Tras errores se espera con backoff exponencial; un enqueue nuevo no lo interrumpe
+            if self.current_backoff_sec > self.interval_sec:
+                time.sleep(self.current_backoff_sec)
+            else:
+                self._wake.wait(timeout=self.interval_sec)
+            self._wake.clear()
+            try:
+                failed = bool(self.flush().get("errors"))
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"⚠️ Error en escritor write-behind: {e}")
+                failed = True
+            if failed:
+                self.current_backoff_sec = min(self.current_backoff_sec * 2, self.max_backoff_sec)
+            else:
+                self.current_backoff_sec = self.interval_sec
+
+    def status(self):
+        """Profundidad de la cola, antigüedad del pendiente más viejo y estado del escritor"""
+        try:
+            stats = get_queue_stats()
+        except Exception as e:
+            stats = {"depth": None, "failed": None, "lag_seconds": None, "error": str(e)}
+        stats.update({
+            "writer_running": self._thread is not None and self._thread.is_alive(),
+            "last_flush_at": self.last_flush_at.isoformat() if self.last_flush_at else None,
+            "last_error": self.last_error,
+            "flushed_total": self.flushed_total,
+            "backoff_sec": self.current_backoff_sec
+        })
+        return stats
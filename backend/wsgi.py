@@ -0,0 +1,58 @@
+"""
+Punto de entrada WSGI de producción (sin el servidor de desarrollo ni el reloader de Werkzeug)
+
+    gunicorn -c gunicorn.conf.py                      # workers pre-forkeados que comparten el modelo
+    waitress-serve --port=5001 --call wsgi:create_app  # un proceso con hilos
+"""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Lock de archivo que decide qué worker ejecuta los servicios únicos en segundo plano
+LEADER_LOCK_PATH = os.getenv('BACKGROUND_LOCK_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.background.lock'))
+
+
+def configure_torch_threads(count):
+    """Hilos de PyTorch por proceso (con varios workers, repartir los núcleos entre ellos)"""
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(max(1, int(count)))
+
+
+def create_app(prefork=False):
+    """
+    Crea la aplicación: carga el modelo y la configuración (al importar app), inicializa la base
+    de datos y precarga las referencias de zonas.
+
+    Args:
+        prefork (bool): True con gunicorn --preload. El maestro solo carga y los hilos, engines
+            y threads de PyTorch se configuran en cada worker con init_worker() (post_fork)
+    """
+    import app as application
+
+    application.init_database()
+    application.preload_runtime()
+    if not prefork:
+        configure_torch_threads(int(os.getenv('TORCH_THREADS', os.cpu_count() or 1)))
+        application.start_background_services()
+    return application.app
+
+
+def init_worker(torch_threads):
+    """Configura un worker recién forkeado desde el maestro precargado"""
+    import app as application
+    from database import engine, local_engine
+
+    # Las conexiones abiertas por el maestro no se comparten: cada worker abre las suyas
+    engine.dispose(close=False)
+    local_engine.dispose(close=False)
+    configure_torch_threads(torch_threads)
+    # Con inferencia en procesos aparte, los núcleos de este worker se reparten entre ellos
+    pool = application.inference_pool
+    if pool.enabled:
+        pool.torch_threads = max(1, torch_threads // pool.worker_count)
+    application.start_background_services(LEADER_LOCK_PATH)
@@ -0,0 +1,217 @@
+"""
+Re-registro automático de zonas cuando la cámara se desplaza respecto a la imagen de referencia
+"""
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from tray_gate import reference_path
+
+
+def features_path(profile, distribucion):
+    """Archivo con las características ORB precalculadas de la referencia"""
+    return os.path.join(os.path.dirname(reference_path(profile, distribucion)),
+                        f"features_{profile}_{distribucion}.npz")
+
+
+class ZoneRegistrar:
+    """
+    Calcula una sola vez (y guarda en disco) los keypoints y descriptores ORB de la imagen de
+    referencia de cada perfil. En cada captura los compara contra una versión reducida en escala
+    de grises, estima desplazamiento u homografía con RANSAC y ajusta las zonas.
+
+    La última transformación aplicada por perfil se reutiliza mientras la nueva estimación no se
+    aleje más de stable_px: así las zonas ajustadas no varían por el ruido de RANSAC entre frames
+    (el análisis incremental compara las zonas para reutilizar detecciones).
+    """
+
+    def __init__(self, work_width=960, zones_reference_size=(1920, 1080), nfeatures=1000,
+                 ratio=0.75, min_inliers=15, min_shift_px=5.0, max_shift_px=300.0, method="affine",
+                 stable_px=3.0):
+        self.work_width = work_width
+        self.zones_reference_size = zones_reference_size
+        self.nfeatures = nfeatures
+        self.ratio = ratio
+        self.min_inliers = min_inliers
+        self.min_shift_px = min_shift_px
+        self.max_shift_px = max_shift_px
+        self.method = method
+        self.stable_px = stable_px
+        self._references = {}
+        self._applied = {}
+        self._lock = threading.Lock()
+        self._orb = threading.local()
+
+    def _detector(self):
+        # ORB no es seguro entre hilos: un detector por hilo
+        if not hasattr(self._orb, "detector"):
+            self._orb.detector = cv2.ORB_create(nfeatures=self.nfeatures)
+        return self._orb.detector
+
+    def _gray_small(self, img):
+        """Escala de grises reducida y factores para volver a coordenadas de referencia de zonas"""
+        height, width = img.shape[:2]
+        work_height = max(1, int(height * self.work_width / float(width)))
+        step = max(1, width // (self.work_width * 2))
+        src = img[::step, ::step] if step > 1 else img
+        small = cv2.resize(src, (self.work_width, work_height), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        to_ref = (self.zones_reference_size[0] / float(self.work_width),
+                  self.zones_reference_size[1] / float(work_height))
+        return gray, to_ref
+
+    def _detect(self, img):
+        gray, (fx, fy) = self._gray_small(img)
+        keypoints, descriptors = self._detector().detectAndCompute(gray, None)
+        if descriptors is None or not keypoints:
+            return None, None
+        pts = np.float32([kp.pt for kp in keypoints]) * np.float32([fx, fy])
+        return pts, descriptors
+
+    def _reference_features(self, profile, distribucion):
+        """Carga las características de referencia desde memoria, disco o recalculándolas"""
+        image_path = reference_path(profile, distribucion)
+        try:
+            mtime = os.path.getmtime(image_path)
+        except OSError:
+            return None
+
+        with self._lock:
+            cached = self._references.get(image_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        npz_path = features_path(profile, distribucion)
+        features = None
+        try:
+            with np.load(npz_path) as stored:
+                if float(stored["mtime"]) == mtime:
+                    features = (stored["pts"], stored["descriptors"])
+        except (OSError, KeyError, ValueError):
+            pass
+
+        if features is None:
+            ref_img = cv2.imread(image_path)
+            if ref_img is None:
+                return None
+            pts, descriptors = self._detect(ref_img)
+            if descriptors is None:
+                return None
+            features = (pts, descriptors)
+            try:
+                np.savez(npz_path, mtime=mtime, pts=pts, descriptors=descriptors)
+                print(f"💾 Características ORB de referencia guardadas: {npz_path}")
+            except OSError as e:
+                print(f"⚠️ No se pudieron guardar características de referencia: {e}")
+
+        with self._lock:
+            self._references[image_path] = (mtime, features)
+        return features
+
+    def preload(self, profile, distribucion):
+        """Carga en memoria las características de referencia (si existe la imagen); True si quedaron listas"""
+        return self._reference_features(profile, distribucion) is not None
+
+    def invalidate(self, profile=None, distribucion=None):
+        with self._lock:
+            if profile is None:
+                self._references.clear()
+                self._applied.clear()
+            else:
+                self._references.pop(reference_path(profile, distribucion), None)
+                self._applied.pop((profile, distribucion), None)
+
+    def _estimate(self, ref_pts, cap_pts):
+        """Transformación referencia -> captura como matriz 3x3 con sus inliers"""
+        if self.method == "homography":
+            matrix, mask = cv2.findHomography(ref_pts, cap_pts, cv2.RANSAC, 4.0)
+        else:
+            affine, mask = cv2.estimateAffinePartial2D(ref_pts, cap_pts, method=cv2.RANSAC,
+                                                       ransacReprojThreshold=4.0)
+            matrix = np.vstack([affine, [0, 0, 1]]) if affine is not None else None
+        inliers = int(mask.sum()) if mask is not None else 0
+        return matrix, inliers
+
+    def register(self, img, zones, profile, distribucion):
+        """
+        Ajusta las zonas (en coordenadas de referencia) al desplazamiento de la cámara.
+
+        Returns:
+            tuple: (zonas ajustadas o las originales, dict con el desplazamiento aplicado)
+        """
+        start = time.time()
+        info = {"applied": False, "dx": 0.0, "dy": 0.0, "max_shift_px": 0.0, "inliers": 0}
+
+        reference = self._reference_features(profile, distribucion)
+        if reference is None:
+            info["reason"] = "sin imagen de referencia"
+            return zones, info
+
+        ref_pts, ref_descriptors = reference
+        cap_pts, cap_descriptors = self._detect(img)
+        if cap_descriptors is None:
+            info["reason"] = "sin características en la captura"
+            return zones, info
+
+        matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+        good = []
+        for pair in matcher.knnMatch(ref_descriptors, cap_descriptors, k=2):
+            if len(pair) == 2 and pair[0].distance < self.ratio * pair[1].distance:
+                good.append(pair[0])
+
+        if len(good) < self.min_inliers:
+            info["reason"] = f"pocas coincidencias ({len(good)})"
+            return zones, info
+
+        src = np.float32([ref_pts[m.queryIdx] for m in good]).reshape(-1, 1, 2)
+        dst = np.float32([cap_pts[m.trainIdx] for m in good]).reshape(-1, 1, 2)
+        matrix, inliers = self._estimate(src, dst)
+        info["inliers"] = inliers
+        if matrix is None or inliers < self.min_inliers:
+            info["reason"] = "transformación no confiable"
+            return zones, info
+
+        # Desplazamiento medido sobre las esquinas del área de referencia
+        width, height = self.zones_reference_size
+        corners = np.float32([[0, 0], [width, 0], [width, height], [0, height]]).reshape(-1, 1, 2)
+        moved = cv2.perspectiveTransform(corners, matrix)
+        with self._lock:
+            previous = self._applied.get((profile, distribucion))
+        if previous is not None:
+            previous_moved = cv2.perspectiveTransform(corners, previous)
+            if np.linalg.norm((moved - previous_moved).reshape(-1, 2), axis=1).max() <= self.stable_px:
+                matrix, moved = previous, previous_moved
+                info["reused"] = True
+        displacement = np.linalg.norm((moved - corners).reshape(-1, 2), axis=1)
+        info["dx"] = round(float(matrix[0, 2]), 1)
+        info["dy"] = round(float(matrix[1, 2]), 1)
+        info["max_shift_px"] = round(float(displacement.max()), 1)
+        info["elapsed_ms"] = round((time.time() - start) * 1000, 1)
+
+        if displacement.max() < self.min_shift_px or displacement.max() > self.max_shift_px:
+            with self._lock:
+                self._applied.pop((profile, distribucion), None)
+        if displacement.max() < self.min_shift_px:
+            info["reason"] = "desplazamiento bajo el umbral"
+            return zones, info
+        if displacement.max() > self.max_shift_px:
+            info["reason"] = "desplazamiento excesivo, se mantienen las zonas originales"
+            print(f"⚠️ Desplazamiento de cámara fuera de rango: {info['max_shift_px']} px")
+            return zones, info
+
+        adjusted = {}
+        for zone_name, poly in zones.items():
+            pts = np.float32(poly).reshape(-1, 1, 2)
+            adjusted[zone_name] = [[int(round(x)), int(round(y))]
+                                   for x, y in cv2.perspectiveTransform(pts, matrix).reshape(-1, 2)]
+
+        with self._lock:
+            self._applied[(profile, distribucion)] = matrix
+        info["applied"] = True
+        info["method"] = self.method
+        print(f"🔄 Zonas re-registradas: dx={info['dx']}, dy={info['dy']}, "
+              f"máx={info['max_shift_px']} px, inliers={inliers}")
+        return adjusted, info
@@ -939,6 +939,9 @@ async function uploadData() {
         
         // Preparar datos para enviar
         const uploadPayload = {
+            // Clave del registro ya encolado: el servidor no crea un segundo análisis
+            idempotency_key: analysisResults.idempotency_key || null,
+            cache_id: analysisResults.cache_id ?? null,
             analysis_data: {
                 source_type: "uploaded_file",
                 confidence_used: analysisResults.confidence_used || 0.8
@@ -2285,7 +2288,8 @@ async function submitManualEntry() {
                 timestamp: result.timestamp,
                 analysis_type: 'manual',
                 database_status: result.database_status,
-                analysis_id: result.analysis_id
+                cache_id: result.cache_id,
+                idempotency_key: result.idempotency_key
             };
             
             // Cerrar modal
@@ -3,6 +3,12 @@ let currentUser = null;
 let historyData = [];
 let currentAction = null;
 let currentRecord = null;
+let historyCursor = null;
+let historyEtag = null;
+let historyDbConnected = null;
+
+// Intervalo de refresco incremental del historial (ms)
+const HISTORY_REFRESH_INTERVAL = 5000;
 
 // Inicializar la aplicación
 document.addEventListener('DOMContentLoaded', function() {
@@ -26,8 +32,9 @@ function initializeHistory() {
     // Verificar estado de base de datos
     checkDatabaseStatus();
     
-    // Cargar historial inicial
+    // Cargar historial inicial y refrescar solo los cambios
     loadHistory();
+    setInterval(refreshHistory, HISTORY_REFRESH_INTERVAL);
 }
 
 // Configurar interfaz de usuario
@@ -83,22 +90,16 @@ async function loadHistory() {
     try {
         showLoading();
         
-        // Obtener filtros
-        const filters = getFilters();
-        
-        // Construir URL con parámetros
-        const params = new URLSearchParams();
-        if (filters.user) params.append('user_name', filters.user);
-        if (filters.type) params.append('analysis_type', filters.type);
-        params.append('limit', filters.limit);
-        
-        const response = await fetch(`/get_analysis_history?${params}`);
+        const response = await fetch(`/get_analysis_history?${buildHistoryParams()}`, { cache: 'no-store' });
         const result = await response.json();
         
         hideLoading();
         
         if (result.success) {
             historyData = result.history;
+            historyCursor = result.cursor;
+            historyEtag = response.headers.get('ETag');
+            historyDbConnected = result.db_connected;
             displayHistory(historyData);
             updateStatistics(result);
             
@@ -120,6 +121,68 @@ async function loadHistory() {
     }
 }
 
+// Parámetros de consulta según los filtros actuales
+function buildHistoryParams() {
+    const filters = getFilters();
+    const params = new URLSearchParams();
+    if (filters.user) params.append('user_name', filters.user);
+    if (filters.type) params.append('analysis_type', filters.type);
+    params.append('limit', filters.limit);
+    return params;
+}
+
+// Refrescar solo análisis nuevos o modificados (304 si no hubo cambios)
+async function refreshHistory() {
+    if (!historyCursor || document.hidden) return;
+    
+    try {
+        const params = buildHistoryParams();
+        if (historyCursor.since_id !== null) params.append('since_id', historyCursor.since_id);
+        if (historyCursor.since_local_id !== null) params.append('since_local_id', historyCursor.since_local_id);
+        if (historyCursor.since_ts) params.append('since_ts', historyCursor.since_ts);
+        
+        const headers = historyEtag ? { 'If-None-Match': historyEtag } : {};
+        const response = await fetch(`/get_analysis_history?${params}`, { cache: 'no-store', headers });
+        if (response.status === 304) return;
+        
+        const result = await response.json();
+        if (!result.success) return;
+        historyEtag = response.headers.get('ETag');
+        
+        // Cambio de origen (PostgreSQL / caché local) o demasiados cambios: recarga completa
+        const limit = getFilters().limit;
+        if (result.db_connected !== historyDbConnected || result.count >= limit) {
+            await loadHistory();
+            return;
+        }
+        historyCursor = result.cursor;
+        if (result.count === 0) return;
+        
+        // Un análisis que ya llegó a PostgreSQL reemplaza a su copia pendiente del caché local
+        const uploadedKeys = new Set(result.history
+            .filter(record => record.source === 'postgresql' && record.idempotency_key)
+            .map(record => record.idempotency_key));
+        const byKey = new Map(historyData
+            .filter(record => record.source === 'postgresql' || !uploadedKeys.has(record.idempotency_key))
+            .map(record => [recordKey(record), record]));
+        result.history.forEach(record => byKey.set(recordKey(record), record));
+        historyData = Array.from(byKey.values())
+            .sort((a, b) => new Date(b.timestamp) - new Date(a.timestamp))
+            .slice(0, limit);
+        
+        displayHistory(historyData);
+        updateStatistics({ history: historyData, count: historyData.length });
+        hideNoResults();
+    } catch (error) {
+        console.error('Error refrescando historial:', error);
+    }
+}
+
+// Identificador único en el historial combinado (los ids de PostgreSQL y del caché local se repiten)
+function recordKey(record) {
+    return `${record.source}:${record.id}`;
+}
+
 // Obtener filtros actuales
 function getFilters() {
     return {
@@ -163,14 +226,14 @@ function displayHistory(data) {
                 </td>
                 <td>${syncStatus}</td>
                 <td class="actions">
-                    <button class="btn-icon" onclick="viewDetails(${record.id})" title="Ver detalles">
+                    <button class="btn-icon" onclick="viewDetails('${recordKey(record)}')" title="Ver detalles">
                         <i class="fas fa-eye"></i>
                     </button>
-                    <button class="btn-icon" onclick="downloadRecord(${record.id})" title="Descargar">
+                    <button class="btn-icon" onclick="downloadRecord('${recordKey(record)}')" title="Descargar">
                         <i class="fas fa-download"></i>
                     </button>
                     ${!record.synced ? `
-                    <button class="btn-icon upload" onclick="uploadAnalysis(${record.id})" title="Subir a PostgreSQL">
+                    <button class="btn-icon upload" onclick="uploadAnalysis('${recordKey(record)}')" title="Subir a PostgreSQL">
                         <i class="fas fa-upload"></i>
                     </button>
                     ` : ''}
@@ -200,7 +263,7 @@ function updateStatistics(result) {
 // Ver detalles de un registro
 async function viewDetails(recordId) {
     try {
-        const record = historyData.find(r => r.id === recordId);
+        const record = historyData.find(r => recordKey(r) === recordId);
         if (!record) {
             showNotification('Registro no encontrado', 'error');
             return;
@@ -306,7 +369,7 @@ async function viewDetails(recordId) {
 // Descargar registro individual
 function downloadRecord(recordId) {
     try {
-        const record = historyData.find(r => r.id === recordId);
+        const record = historyData.find(r => recordKey(r) === recordId);
         if (!record) {
             showNotification('Registro no encontrado', 'error');
             return;
@@ -547,7 +610,7 @@ async function executeCleanCache() {
 // Subir análisis específico a PostgreSQL
 async function uploadAnalysis(recordId) {
     try {
-        const record = historyData.find(r => r.id === recordId);
+        const record = historyData.find(r => recordKey(r) === recordId);
         if (!record) {
             showNotification('Registro no encontrado', 'error');
             return;
@@ -562,6 +625,9 @@ async function uploadAnalysis(recordId) {
         
         // Preparar datos para enviar
         const uploadPayload = {
+            // Clave del registro en la cola local: el servidor no crea un segundo análisis
+            idempotency_key: record.idempotency_key || null,
+            cache_id: record.source === 'local_cache' ? record.id : null,
             analysis_data: {
                 source_type: "historical_upload",
                 confidence_used: 0.8